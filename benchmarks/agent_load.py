@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Load-test ClozeAgent offline, against a stand-in for the INGInious backend.
+
+The harness replays BackendNewJob-shaped messages against a task directory on disk, granting at
+most the agent's advertised capacity at a time like the backend does, and records every
+send_job_result call instead of sending it. Run from the repository root::
+
+    python benchmarks/agent_load.py --jobs 5000 --concurrency 1,2,4,8
+    python benchmarks/agent_load.py --tasks-dir /srv/tasks --course os --task cache --jobs 2000
+
+Without --tasks-dir a course with one generated cloze task is written to a temporary directory.
+Jobs arrive all at once by default (saturation); --rate spreads the arrivals instead.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from run import AGENT_BASES, percentile  # noqa: E402
+from inginious_cloze_plugin import _load_task_descriptor_from_task_fs  # noqa: E402
+from inginious_cloze_plugin.agent_cloze import _load_local_fs_provider  # noqa: E402
+from inginious_cloze_plugin.cloze_workload import (  # noqa: E402
+    AnswerMix,
+    generate_submissions,
+    generate_variants,
+    parse_answer_mix,
+)
+
+try:
+    import zmq.asyncio
+except ModuleNotFoundError:  # pragma: no cover - the stub backend does not need ZeroMQ
+    zmq = None
+
+
+class DirectoryTaskFS(object):
+    """Minimal task filesystem over a local directory, used when INGInious is not installed."""
+
+    def __init__(self, prefix):
+        self.prefix = str(prefix)
+
+    def from_subfolder(self, name):
+        return DirectoryTaskFS(os.path.join(self.prefix, name))
+
+    def get(self, path):
+        with open(os.path.join(self.prefix, path), "rb") as handle:
+            return handle.read()
+
+
+def _tasks_filesystem(tasks_dir):
+    try:
+        return _load_local_fs_provider()(str(tasks_dir))
+    except ImportError:
+        return DirectoryTaskFS(tasks_dir)
+
+
+class LoadTestAgent(*AGENT_BASES):
+    def __init__(self, tasks_fs, concurrency, grading_workers):
+        context = zmq.asyncio.Context() if zmq is not None else None
+        super().__init__(context, "inproc://cloze-load-test", "Cloze load test", concurrency, tasks_fs, grading_workers)
+        self.completed: dict[Any, tuple[float, str]] = {}
+
+    async def send_job_result(self, job_id, result, text="", grade=None, problems=None, tests=None,
+                              custom=None, state="", archive=None, stdout=None, stderr=None):
+        self.completed[job_id] = (time.perf_counter(), result)
+
+
+def write_task_directory(root: Path, course: str, task: str, problems: int, variants: int, blanks: int,
+                         problem_count: int, table_ratio: float, seed: int) -> Path:
+    task_dir = root / course / task
+    task_dir.mkdir(parents=True)
+    descriptor = ["name: Cloze load test", "environment_type: cloze", "problems:"]
+    for index in range(problems):
+        filename = "variants_{}.json".format(index + 1)
+        bank = generate_variants(variants, blanks, seed=seed + index, table_ratio=table_ratio)
+        (task_dir / filename).write_text(json.dumps({"variants": bank}), encoding="utf-8")
+        descriptor += [
+            "  p{}:".format(index + 1),
+            "    type: cloze",
+            "    variants_file: {}".format(filename),
+            "    random_problem_count: {}".format(problem_count),
+        ]
+    (task_dir / "task.yaml").write_text("\n".join(descriptor) + "\n", encoding="utf-8")
+    return task_dir
+
+
+def load_cloze_problems(task_dir: Path) -> dict[str, dict[str, Any]]:
+    descriptor = _load_task_descriptor_from_task_fs(DirectoryTaskFS(task_dir))
+    problems = descriptor.get("problems", {}) if isinstance(descriptor, dict) else {}
+    cloze = {pid: problem for pid, problem in (problems or {}).items()
+             if isinstance(problem, dict) and problem.get("type") == "cloze"}
+    if not cloze:
+        raise SystemExit("No cloze problems in {}.".format(task_dir))
+    return cloze
+
+
+def build_messages(task_dir: Path, course: str, task: str, problems: dict[str, dict[str, Any]], jobs: int,
+                   mix: AnswerMix, seed: int) -> list[SimpleNamespace]:
+    """Return ``jobs`` BackendNewJob-shaped messages answering every cloze problem of the task."""
+    inputs_by_problem = {}
+    for offset, (pid, problem) in enumerate(problems.items()):
+        with open(task_dir / problem["variants_file"], "r", encoding="utf-8") as handle:
+            bank = json.load(handle)
+        problem_count = int(problem.get("random_problem_count") or 1)
+        inputs_by_problem[pid] = [
+            json.dumps(record["input"])
+            for record in generate_submissions(bank, jobs, seed=seed + offset, mix=mix, problem_count=problem_count)
+        ]
+    return [
+        SimpleNamespace(
+            job_id="load-{}".format(index),
+            course_id=course,
+            task_id=task,
+            task_problems=problems,
+            inputdata={pid: inputs[index] for pid, inputs in inputs_by_problem.items()},
+            environment_type="cloze",
+            environment="cloze",
+            environment_parameters={},
+            debug=False,
+        )
+        for index in range(jobs)
+    ]
+
+
+async def replay(agent: LoadTestAgent, messages: list[SimpleNamespace], rate: float) -> dict[str, Any]:
+    # The backend only hands a job to an agent that has a free slot; arrivals beyond that wait in
+    # its queue, which is what the queueing delay measures.
+    slots = asyncio.Semaphore(agent.grading_capacity)
+    arrived: dict[Any, float] = {}
+    dispatched: dict[Any, float] = {}
+    errors = 0
+    started = time.perf_counter()
+
+    async def submit(index, msg):
+        nonlocal errors
+        if rate > 0:
+            await asyncio.sleep(max(started + index / rate - time.perf_counter(), 0.0))
+        arrived[msg.job_id] = time.perf_counter()
+        async with slots:
+            dispatched[msg.job_id] = time.perf_counter()
+            try:
+                await agent.new_job(msg)
+            except Exception:
+                errors += 1
+
+    await asyncio.gather(*(submit(index, msg) for index, msg in enumerate(messages)))
+    finished = time.perf_counter()
+
+    queueing = sorted(dispatched[job_id] - arrived[job_id] for job_id in dispatched)
+    latency = sorted(done - dispatched[job_id] for job_id, (done, _) in agent.completed.items())
+    results: dict[str, int] = {}
+    for _, result in agent.completed.values():
+        results[result] = results.get(result, 0) + 1
+    return {
+        "jobs": len(messages),
+        "completed": len(agent.completed),
+        "errors": errors,
+        "results": results,
+        "elapsed_s": finished - started,
+        "jobs_per_sec": len(agent.completed) / (finished - started) if finished > started else 0.0,
+        "queueing_ms": _distribution(queueing),
+        "latency_ms": _distribution(latency),
+    }
+
+
+def _distribution(ordered: list[float]) -> dict[str, float]:
+    if not ordered:
+        return {}
+    return {
+        "mean": 1000.0 * sum(ordered) / len(ordered),
+        "p50": 1000.0 * percentile(ordered, 0.50),
+        "p95": 1000.0 * percentile(ordered, 0.95),
+        "p99": 1000.0 * percentile(ordered, 0.99),
+        "max": 1000.0 * ordered[-1],
+    }
+
+
+def run_setting(tasks_fs, messages, concurrency: int, grading_workers: int, rate: float,
+                warmup: int) -> dict[str, Any]:
+    if warmup:
+        # Fill the variants and compiled-solution caches so the first setting is not penalised.
+        warm = LoadTestAgent(tasks_fs, concurrency, grading_workers)
+        try:
+            asyncio.run(replay(warm, messages[:warmup], 0.0))
+        finally:
+            warm.close()
+
+    agent = LoadTestAgent(tasks_fs, concurrency, grading_workers)
+    try:
+        report = asyncio.run(replay(agent, messages, rate))
+    finally:
+        agent.close()
+    report.update(concurrency=concurrency, grading_workers=grading_workers, capacity=agent.grading_capacity)
+    return report
+
+
+def _format_report(report: dict[str, Any]) -> str:
+    queueing, latency = report["queueing_ms"], report["latency_ms"]
+    return (
+        "concurrency {concurrency:>3} workers {grading_workers:>3} (capacity {capacity:>3})  "
+        "{jobs_per_sec:>9.1f} jobs/s  "
+        "queue p50 {q50:>9.2f} p95 {q95:>9.2f} ms  "
+        "grading p50 {l50:>7.2f} p95 {l95:>7.2f} p99 {l99:>7.2f} ms  errors {errors}".format(
+            q50=queueing.get("p50", 0.0), q95=queueing.get("p95", 0.0),
+            l50=latency.get("p50", 0.0), l95=latency.get("p95", 0.0), l99=latency.get("p99", 0.0),
+            **report
+        )
+    )
+
+
+def _int_list(raw_value: str) -> list[int]:
+    return [int(part) for part in raw_value.split(",") if part.strip()]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test the cloze agent against a local stand-in backend.")
+    parser.add_argument("--jobs", type=int, default=2000, help="Jobs replayed per concurrency setting")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 2, 4, 8],
+                        help="Comma-separated agent concurrency settings (default: 1,2,4,8)")
+    parser.add_argument("--grading-workers", type=int, default=None,
+                        help="Grading pool size (default: same as the concurrency; 0 grades inline)")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="Job arrivals per second; 0 submits every job at once")
+    parser.add_argument("--warmup", type=int, default=50, help="Unmeasured jobs run before each setting")
+    parser.add_argument("--tasks-dir", help="Existing tasks directory; requires --course and --task")
+    parser.add_argument("--course", default="loadtest", help="Course id")
+    parser.add_argument("--task", default="cloze", help="Task id")
+    parser.add_argument("--problems", type=int, default=2, help="Generated cloze subproblems per task")
+    parser.add_argument("--variants", type=int, default=50, help="Generated variants per subproblem")
+    parser.add_argument("--blanks", type=int, default=10, help="Generated blanks per variant")
+    parser.add_argument("--problem-count", type=int, default=1, help="random_problem_count of generated subproblems")
+    parser.add_argument("--table-ratio", type=float, default=0.2, help="Share of generated variants with tables")
+    parser.add_argument("--mix", type=parse_answer_mix, default=AnswerMix(),
+                        help="Correct,partial,wrong weights per blank (default: 0.6,0.25,0.15)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for generated tasks and answers")
+    parser.add_argument("-o", "--output", help="Write the reports as JSON to this file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="cloze-load-") as scratch:
+        tasks_dir = Path(args.tasks_dir) if args.tasks_dir else Path(scratch)
+        task_dir = tasks_dir / args.course / args.task
+        if not args.tasks_dir:
+            write_task_directory(
+                tasks_dir, args.course, args.task, args.problems, args.variants, args.blanks,
+                args.problem_count, args.table_ratio, args.seed,
+            )
+        problems = load_cloze_problems(task_dir)
+        messages = build_messages(task_dir, args.course, args.task, problems, args.jobs, args.mix, args.seed)
+        tasks_fs = _tasks_filesystem(tasks_dir)
+
+        print("Replaying {} job(s) for {}/{} ({} cloze problem(s))".format(
+            len(messages), args.course, args.task, len(problems)
+        ))
+        reports = []
+        for concurrency in args.concurrency:
+            workers = concurrency if args.grading_workers is None else args.grading_workers
+            report = run_setting(tasks_fs, messages, concurrency, workers, args.rate, min(args.warmup, args.jobs))
+            print(_format_report(report), flush=True)
+            reports.append(report)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({"reports": reports}, indent=2), encoding="utf-8")
+        print("Wrote reports to {}".format(args.output))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark the cloze parse, grade, render and convert hot paths.
+
+Run from the repository root::
+
+    python benchmarks/run.py                       # every benchmark at every scale
+    python benchmarks/run.py --scale exam -k grade  # one scale, benchmarks whose name contains "grade"
+    python benchmarks/run.py --save-baseline        # record the current numbers as the baseline
+
+Results are written as JSON (``benchmarks/results/latest.json`` by default) and compared with the
+baseline when one exists, so that regressions show up as a per-benchmark diff.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from itertools import count
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, NamedTuple
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "scripts"))
+
+from convert_moodle_cache_xml import convert_moodle_cache_xml  # noqa: E402
+from convert_moodle_cloze_xml import convert_moodle_cloze_xml  # noqa: E402
+from inginious_cloze_plugin import cloze_agent  # noqa: E402
+from inginious_cloze_plugin.cloze_agent import ClozeAgent  # noqa: E402
+from inginious_cloze_plugin.cloze_core import (  # noqa: E402
+    build_variant_record,
+    clear_solution_cache,
+    grade_answers,
+    load_variants_payload,
+    parse_solutions_from_text,
+)
+from inginious_cloze_plugin.cloze_problem_frontend import DisplayableClozeProblem  # noqa: E402
+from inginious_cloze_plugin.cloze_workload import (  # noqa: E402
+    answers_for_variant,
+    generate_moodle_xml,
+    generate_variants,
+)
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+DEFAULT_OUTPUT = RESULTS_DIR / "latest.json"
+DEFAULT_BASELINE = RESULTS_DIR / "baseline.json"
+
+
+class Scale(NamedTuple):
+    name: str
+    variants: int
+    blanks: int
+    problem_count: int
+    table_ratio: float
+    questions: int
+
+
+SCALES = {
+    "small": Scale("small", variants=1, blanks=3, problem_count=1, table_ratio=0.0, questions=10),
+    "medium": Scale("medium", variants=50, blanks=10, problem_count=1, table_ratio=0.2, questions=200),
+    "exam": Scale("exam", variants=500, blanks=40, problem_count=5, table_ratio=0.2, questions=2000),
+}
+
+
+class MemoryTaskFS(object):
+    def __init__(self, files: dict[str, str]):
+        self._files = files
+
+    def get(self, path):
+        return self._files[path]
+
+    def from_subfolder(self, name):
+        return self
+
+
+class StandInAgent(object):
+    """Stands in for ``inginious.agent.Agent`` when INGInious is not installed."""
+
+    def __init__(self, context, backend_addr, friendly_name, concurrency, tasks_filesystem, ssh_allowed=False):
+        self._context = context
+        self._backend_addr = backend_addr
+        self._friendly_name = friendly_name
+        self._concurrency = concurrency
+        self._fs = tasks_filesystem
+
+
+# Mixed in after ClozeAgent so that its super().__init__() lands here instead of on object.
+AGENT_BASES = (ClozeAgent, StandInAgent) if cloze_agent.Agent is object else (ClozeAgent,)
+
+
+class BenchClozeAgent(*AGENT_BASES):
+    def __init__(self, tasks_fs, grading_workers=0):
+        super().__init__(None, "inproc://bench", "bench", 1, tasks_fs, grading_workers=grading_workers)
+        self.results = 0
+
+    async def send_job_result(self, job_id, result, text="", grade=None, problems=None, tests=None,
+                              custom=None, state="", archive=None, stdout=None, stderr=None):
+        self.results += 1
+
+
+class Benchmark(NamedTuple):
+    name: str
+    # Builds the fixtures for one scale and returns the operation to time; resources that need
+    # cleaning up are registered on the exit stack.
+    setup: Callable[[Scale, contextlib.ExitStack], Callable[[], Any]]
+
+
+def _variants_json(scale: Scale) -> str:
+    return json.dumps({"variants": generate_variants(scale.variants, scale.blanks, table_ratio=scale.table_ratio)})
+
+
+def _variants(scale: Scale) -> list[dict[str, Any]]:
+    return load_variants_payload(json.loads(_variants_json(scale)))
+
+
+def _problem(scale: Scale) -> tuple[dict[str, Any], MemoryTaskFS]:
+    task_fs = MemoryTaskFS({"variants.json": _variants_json(scale)})
+    problem = {"type": "cloze", "variants_file": "variants.json", "random_problem_count": scale.problem_count}
+    return problem, task_fs
+
+
+def _setup_parse(scale, stack):
+    text = _variants(scale)[0]["text"]
+    return lambda: parse_solutions_from_text(text)
+
+
+def _setup_build_variant(scale, stack):
+    variants = _variants(scale)
+    seeds = count()
+    return lambda: build_variant_record(variants, seed=str(next(seeds)), problem_count=scale.problem_count)
+
+
+def _setup_build_variant_cold(scale, stack):
+    # The warm benchmark above is served by the compiled-solution cache after the first pass over
+    # the bank; this one recompiles every selected text, as after a restart or a bank edit.
+    variants = _variants(scale)
+    seeds = count()
+    stack.callback(clear_solution_cache)
+
+    def build():
+        clear_solution_cache()
+        return build_variant_record(variants, seed=str(next(seeds)), problem_count=scale.problem_count)
+
+    return build
+
+
+def _setup_grade(scale, stack):
+    variant = build_variant_record(_variants(scale), seed="bench", problem_count=scale.problem_count)
+    answers = answers_for_variant(variant, random.Random(0))
+    return lambda: grade_answers(variant["solutions"], answers, plan=variant["grading_plan"], details=True)
+
+
+def _setup_show_input(scale, stack):
+    problem, task_fs = _problem(scale)
+    displayable = DisplayableClozeProblem("bench", problem, None, task_fs)
+    return lambda: displayable.show_input(None, "en", None)
+
+
+def _setup_new_job(scale, stack):
+    problem, task_fs = _problem(scale)
+    variant = build_variant_record(_variants(scale), seed="bench", problem_count=scale.problem_count)
+    answers = answers_for_variant(variant, random.Random(0))
+    msg = SimpleNamespace(
+        job_id="bench", course_id="course", task_id="task",
+        task_problems={"bench": problem}, inputdata={"bench": json.dumps(answers)},
+    )
+    agent = BenchClozeAgent(task_fs)
+    loop = asyncio.new_event_loop()
+    stack.callback(loop.close)
+    return lambda: loop.run_until_complete(agent.new_job(msg))
+
+
+def _xml_file(scale, stack) -> Path:
+    directory = Path(stack.enter_context(tempfile.TemporaryDirectory(prefix="cloze-bench-")))
+    path = directory / "{}.xml".format(scale.name)
+    path.write_text(generate_moodle_xml(scale.questions), encoding="utf-8")
+    return path
+
+
+def _setup_convert_cloze(scale, stack):
+    path = _xml_file(scale, stack)
+    return lambda: convert_moodle_cloze_xml(path)
+
+
+def _setup_convert_cache(scale, stack):
+    path = _xml_file(scale, stack)
+    return lambda: convert_moodle_cache_xml(path)
+
+
+BENCHMARKS = (
+    Benchmark("parse_solutions_from_text", _setup_parse),
+    Benchmark("build_variant_record", _setup_build_variant),
+    Benchmark("build_variant_record_cold", _setup_build_variant_cold),
+    Benchmark("grade_answers", _setup_grade),
+    Benchmark("show_input", _setup_show_input),
+    Benchmark("agent_new_job", _setup_new_job),
+    Benchmark("convert_moodle_cloze_xml", _setup_convert_cloze),
+    Benchmark("convert_moodle_cache_xml", _setup_convert_cache),
+)
+
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    # Nearest-rank percentile over sorted samples.
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def measure(operation: Callable[[], Any], min_time: float, min_iterations: int,
+            max_iterations: int = 1_000_000) -> dict[str, Any]:
+    """Time ``operation`` until both ``min_time`` seconds and ``min_iterations`` calls are reached.
+
+    The first call is a warm-up and is not timed. Peak memory is measured with tracemalloc on a
+    separate call so that tracing does not slow down the timed samples.
+    """
+    operation()
+    samples = []
+    clock = time.perf_counter
+    total = 0.0
+    while (total < min_time or len(samples) < min_iterations) and len(samples) < max_iterations:
+        started = clock()
+        operation()
+        elapsed = clock() - started
+        samples.append(elapsed)
+        total += elapsed
+
+    tracemalloc.start()
+    try:
+        operation()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    ordered = sorted(samples)
+    return {
+        "iterations": len(samples),
+        "ops_per_sec": len(samples) / total if total else float("inf"),
+        "mean_ms": 1000.0 * total / len(samples),
+        "min_ms": 1000.0 * ordered[0],
+        "p50_ms": 1000.0 * percentile(ordered, 0.50),
+        "p95_ms": 1000.0 * percentile(ordered, 0.95),
+        "p99_ms": 1000.0 * percentile(ordered, 0.99),
+        "max_ms": 1000.0 * ordered[-1],
+        "peak_kib": peak / 1024.0,
+    }
+
+
+def run_benchmarks(benchmarks, scales, min_time: float, min_iterations: int, report=None) -> dict[str, Any]:
+    results = {}
+    for scale in scales:
+        for benchmark in benchmarks:
+            key = "{}[{}]".format(benchmark.name, scale.name)
+            with contextlib.ExitStack() as stack:
+                operation = benchmark.setup(scale, stack)
+                results[key] = measure(operation, min_time, min_iterations)
+            if report is not None:
+                report(key, results[key])
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "min_time": min_time,
+            "min_iterations": min_iterations,
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict[str, Any], baseline: dict[str, Any], threshold: float) -> list[dict[str, Any]]:
+    """Return one row per benchmark present in both runs, flagging changes beyond ``threshold``.
+
+    Throughput regresses when ops/sec drops, tail latency when p95 grows, and memory when the peak
+    grows, each by more than ``threshold`` (a fraction, e.g. 0.1 for 10%).
+    """
+    rows = []
+    for key, result in current["results"].items():
+        previous = baseline.get("results", {}).get(key)
+        if previous is None:
+            continue
+        changes = {
+            "ops_per_sec": _relative_change(result["ops_per_sec"], previous["ops_per_sec"]),
+            "p95_ms": _relative_change(result["p95_ms"], previous["p95_ms"]),
+            "peak_kib": _relative_change(result["peak_kib"], previous["peak_kib"]),
+        }
+        regressions = [
+            metric for metric, change in changes.items()
+            if (change < -threshold if metric == "ops_per_sec" else change > threshold)
+        ]
+        rows.append({"name": key, "changes": changes, "regressions": regressions})
+    return rows
+
+
+def _relative_change(current: float, previous: float) -> float:
+    if not previous:
+        return 0.0
+    return (current - previous) / previous
+
+
+def _format_result(key: str, result: dict[str, Any]) -> str:
+    return "{:<42} {:>11.1f} ops/s  p50 {:>9.3f} ms  p95 {:>9.3f} ms  p99 {:>9.3f} ms  peak {:>9.1f} KiB".format(
+        key, result["ops_per_sec"], result["p50_ms"], result["p95_ms"], result["p99_ms"], result["peak_kib"]
+    )
+
+
+def _format_comparison(row: dict[str, Any]) -> str:
+    changes = row["changes"]
+    flag = "REGRESSION ({})".format(", ".join(row["regressions"])) if row["regressions"] else "ok"
+    return "{:<42} ops/s {:>+7.1%}  p95 {:>+7.1%}  peak {:>+7.1%}  {}".format(
+        row["name"], changes["ops_per_sec"], changes["p95_ms"], changes["peak_kib"], flag
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the cloze plugin hot paths.")
+    parser.add_argument("--scale", action="append", choices=sorted(SCALES),
+                        help="Fixture scale to run (repeatable). Defaults to all scales.")
+    parser.add_argument("-k", "--filter", default="", help="Only run benchmarks whose name contains this text.")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Minimum timed seconds per benchmark.")
+    parser.add_argument("--min-iterations", type=int, default=10, help="Minimum timed calls per benchmark.")
+    parser.add_argument("-o", "--output", default=str(DEFAULT_OUTPUT), help="Where to write the JSON results.")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="Baseline JSON results to compare against.")
+    parser.add_argument("--save-baseline", action="store_true", help="Also write the results to the baseline file.")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative change reported as a regression (default: 0.10).")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="Exit with status 1 when a regression is reported.")
+    parser.add_argument("--list", action="store_true", help="List the benchmarks and scales, then exit.")
+    args = parser.parse_args(argv)
+
+    benchmarks = [benchmark for benchmark in BENCHMARKS if args.filter in benchmark.name]
+    scales = [SCALES[name] for name in (args.scale or SCALES)]
+    if args.list:
+        for benchmark in benchmarks:
+            print(benchmark.name)
+        print("scales: {}".format(", ".join(scale.name for scale in scales)))
+        return 0
+    if not benchmarks:
+        parser.error("no benchmark matches {!r}".format(args.filter))
+
+    current = run_benchmarks(
+        benchmarks, scales, args.min_time, args.min_iterations,
+        report=lambda key, result: print(_format_result(key, result), flush=True),
+    )
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(current, indent=2, sort_keys=True), encoding="utf-8")
+    print("Wrote results to {}".format(output))
+
+    baseline_path = Path(args.baseline)
+    regressed = False
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(current, indent=2, sort_keys=True), encoding="utf-8")
+        print("Saved baseline to {}".format(baseline_path))
+    elif baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+        rows = compare(current, baseline, args.threshold)
+        print("\nCompared with {} ({}):".format(baseline_path, baseline.get("meta", {}).get("created", "unknown date")))
+        for row in rows:
+            print(_format_comparison(row))
+        regressed = any(row["regressions"] for row in rows)
+
+    return 1 if regressed and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
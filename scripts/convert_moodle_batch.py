@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from convert_moodle_cache_xml import _cleanup_cache_html
+from convert_moodle_cloze_xml import _sanitize_moodle_html, iter_cloze_questions, iter_cloze_variants, write_variants_file
+
+CONVERTERS = {
+    "cloze": _sanitize_moodle_html,
+    "cache": _cleanup_cache_html,
+}
+
+
+def _expand_inputs(patterns: list[str]) -> list[Path]:
+    inputs: list[Path] = []
+    seen: set[Path] = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(str(path) for path in Path(pattern).rglob("*.xml"))
+        else:
+            matches = sorted(glob.glob(pattern, recursive=True)) or [pattern]
+        for match in matches:
+            path = Path(match)
+            if path not in seen:
+                seen.add(path)
+                inputs.append(path)
+    return inputs
+
+
+def _category_slug(category: str) -> str:
+    # Moodle paths look like "$course$/top/Cache/Direct mapped"; keep the meaningful tail.
+    parts = [part for part in category.split("/") if part and not part.startswith("$")]
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", "_".join(parts)).strip("_").lower()
+    return slug or "uncategorized"
+
+
+def _output_paths(inputs: list[Path], output_dir: Path) -> dict[Path, Path]:
+    outputs: dict[Path, Path] = {}
+    used: dict[Path, Path] = {}
+    for path in inputs:
+        output = output_dir / (path.stem + ".json")
+        if output in used:
+            raise SystemExit(f"Both {used[output]} and {path} would be written to {output}.")
+        used[output] = path
+        outputs[path] = output
+    return outputs
+
+
+def convert_file(input_path: Path, output_path: Path, converter: str, keep_names: bool, per_category: bool):
+    clean_html = CONVERTERS[converter]
+    started = time.perf_counter()
+    written: list[tuple[str, int]] = []
+
+    if per_category:
+        categories: dict[str, list[dict[str, str]]] = {}
+        for category, _, name, text in iter_cloze_questions(input_path):
+            variants = categories.setdefault(_category_slug(category), [])
+            variants.append({"id": str(len(variants)), "name": name if keep_names else "", "text": clean_html(text)})
+        category_dir = output_path.with_suffix("")
+        category_dir.mkdir(parents=True, exist_ok=True)
+        for slug, variants in categories.items():
+            category_path = category_dir / (slug + ".json")
+            written.append((str(category_path), write_variants_file(variants, category_path)))
+    else:
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        written.append((str(output_path), write_variants_file(
+            iter_cloze_variants(input_path, clean_html, keep_names=keep_names), output_path
+        )))
+
+    return written, time.perf_counter() - started
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Convert many Moodle quiz XML exports into cloze variants JSON files in parallel."
+    )
+    parser.add_argument("inputs", nargs="+", help="XML files, directories (searched recursively) or glob patterns.")
+    parser.add_argument("-o", "--output-dir", required=True, help="Directory receiving one JSON file per input.")
+    parser.add_argument("--converter", choices=sorted(CONVERTERS), default="cloze",
+                        help="Conversion rules: plain cloze banks or cache/TLB banks (default: cloze).")
+    parser.add_argument("--per-category", action="store_true",
+                        help="Write one JSON file per Moodle question category, in a directory named after each input.")
+    parser.add_argument("--keep-names", action="store_true",
+                        help="Keep Moodle question names as variant names instead of stripping them from student-facing output.")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (default: number of CPUs).")
+    args = parser.parse_args()
+
+    inputs = _expand_inputs(args.inputs)
+    if not inputs:
+        print("No input files found.", file=sys.stderr)
+        return 1
+    outputs = _output_paths(inputs, Path(args.output_dir))
+
+    started = time.perf_counter()
+    failures = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        futures = {
+            executor.submit(convert_file, path, outputs[path], args.converter, args.keep_names, args.per_category): path
+            for path in inputs
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                written, elapsed = future.result()
+            except Exception as exc:
+                failures += 1
+                print(f"FAILED {path}: {exc}", file=sys.stderr)
+                continue
+            total = sum(count for _, count in written)
+            print(f"{elapsed:8.2f}s  {total:6d} variant(s)  {path} -> {', '.join(output for output, _ in written)}")
+
+    print(f"Converted {len(inputs) - failures}/{len(inputs)} file(s) in {time.perf_counter() - started:.2f}s")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
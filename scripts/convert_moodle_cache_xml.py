@@ -4,22 +4,36 @@ from __future__ import annotations
 import argparse
 import json
 import re
-from dataclasses import dataclass, field
 from html.parser import HTMLParser
 from pathlib import Path
-from typing import Union
+from typing import Iterator, Union
 
-from convert_moodle_cloze_xml import _read_quiz_root, _sanitize_moodle_html
+from convert_moodle_cloze_xml import _sanitize_moodle_html, iter_cloze_variants, write_variants_file
 
 
 Node = Union[str, "ElementNode"]
 
 
-@dataclass
 class ElementNode:
-    tag: str
-    attrs: list[tuple[str, str | None]] = field(default_factory=list)
-    children: list[Node] = field(default_factory=list)
+    __slots__ = ("tag", "attrs", "children")
+
+    def __init__(
+        self,
+        tag: str,
+        attrs: list[tuple[str, str | None]] | None = None,
+        children: list[Node] | None = None,
+    ) -> None:
+        self.tag = tag
+        self.attrs = [] if attrs is None else attrs
+        self.children = [] if children is None else children
+
+    def __repr__(self) -> str:
+        return f"ElementNode(tag={self.tag!r}, attrs={self.attrs!r}, children={self.children!r})"
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ElementNode):
+            return NotImplemented
+        return (self.tag, self.attrs, self.children) == (other.tag, other.attrs, other.children)
 
 
 class _HtmlTreeBuilder(HTMLParser):
@@ -73,26 +87,58 @@ def _render_attrs(attrs: list[tuple[str, str | None]]) -> str:
     return (" " + " ".join(rendered)) if rendered else ""
 
 
-def _render_node(node: Node) -> str:
-    if isinstance(node, str):
-        return node
-    attrs = _render_attrs(node.attrs)
-    inner = "".join(_render_node(child) for child in node.children)
-    if node.tag in _HtmlTreeBuilder.VOID_TAGS:
-        return f"<{node.tag}{attrs}>"
-    return f"<{node.tag}{attrs}>{inner}</{node.tag}>"
+# The tree passes below walk the tree with explicit stacks: Moodle exports nest tables deeply
+# enough to hit the recursion limit, and one shared output buffer avoids a string per level.
+def _render_into(nodes: list[Node], out: list[str]) -> None:
+    stack: list[Node] = list(reversed(nodes))
+    while stack:
+        node = stack.pop()
+        if isinstance(node, str):
+            # Text nodes and the closing tags pushed below.
+            out.append(node)
+            continue
+        out.append(f"<{node.tag}{_render_attrs(node.attrs)}>")
+        if node.tag in _HtmlTreeBuilder.VOID_TAGS:
+            continue
+        stack.append(f"</{node.tag}>")
+        stack.extend(reversed(node.children))
+
+
+def _render_nodes(nodes: list[Node]) -> str:
+    out: list[str] = []
+    _render_into(nodes, out)
+    return "".join(out)
 
 
 def _text_content(node: Node) -> str:
     if isinstance(node, str):
         return node
-    return "".join(_text_content(child) for child in node.children)
+    out: list[str] = []
+    stack: list[Node] = list(reversed(node.children))
+    while stack:
+        child = stack.pop()
+        if isinstance(child, str):
+            out.append(child)
+        else:
+            stack.extend(reversed(child.children))
+    return "".join(out)
 
 
 def _clone_node(node: Node) -> Node:
     if isinstance(node, str):
         return node
-    return ElementNode(node.tag, list(node.attrs), [_clone_node(child) for child in node.children])
+    clone = ElementNode(node.tag, list(node.attrs))
+    stack = [(node, clone)]
+    while stack:
+        source, target = stack.pop()
+        for child in source.children:
+            if isinstance(child, str):
+                target.children.append(child)
+            else:
+                copy = ElementNode(child.tag, list(child.attrs))
+                target.children.append(copy)
+                stack.append((child, copy))
+    return clone
 
 
 def _children_with_tag(node: ElementNode, tag: str) -> list[ElementNode]:
@@ -152,7 +198,7 @@ def _append_class(attrs: list[tuple[str, str | None]], class_name: str) -> list[
 def _rewrite_cache_cell_content(node: ElementNode) -> ElementNode:
     if node.tag != "td":
         return node
-    raw = "".join(_render_node(child) for child in node.children).strip()
+    raw = _render_nodes(node.children).strip()
     if not raw or "<table" in raw.lower() or "class=\"cloze-input\"" in raw:
         return node
 
@@ -188,17 +234,27 @@ def _rewrite_cache_cell_content(node: ElementNode) -> ElementNode:
 
 
 def _transform_nodes(nodes: list[Node]) -> list[Node]:
+    # Post-order walk: an element is rewritten once all of its children have been transformed.
     transformed: list[Node] = []
-    for node in nodes:
-        transformed.extend(_transform_node(node))
+    stack: list[tuple[ElementNode | None, Iterator[Node], list[Node], list[Node]]] = [
+        (None, iter(nodes), transformed, transformed)
+    ]
+    while stack:
+        node, children, collected, parent_collected = stack[-1]
+        for child in children:
+            if isinstance(child, str):
+                collected.append(child)
+            else:
+                stack.append((child, iter(child.children), [], collected))
+                break
+        else:
+            stack.pop()
+            if node is not None:
+                parent_collected.extend(_transform_element(node, collected))
     return transformed
 
 
-def _transform_node(node: Node) -> list[Node]:
-    if isinstance(node, str):
-        return [node]
-
-    transformed_children = _transform_nodes(node.children)
+def _transform_element(node: ElementNode, transformed_children: list[Node]) -> list[Node]:
     current = ElementNode(node.tag, list(node.attrs), transformed_children)
 
     if current.tag == "span":
@@ -256,7 +312,7 @@ def _cleanup_cache_html(text: str) -> str:
     parser.feed(cleaned)
     parser.close()
     transformed = _transform_nodes(parser.root.children)
-    rendered = "".join(_render_node(node) for node in transformed)
+    rendered = _render_nodes(transformed)
 
     rendered = re.sub(r"(<li>\s*(?:<p>)?)\s*\.\s*", r"\1", rendered, flags=re.IGNORECASE)
     rendered = re.sub(r"<p>\s*</p>", "", rendered, flags=re.IGNORECASE)
@@ -265,29 +321,7 @@ def _cleanup_cache_html(text: str) -> str:
 
 
 def convert_moodle_cache_xml(path: Path, keep_names: bool = False) -> dict[str, list[dict[str, str]]]:
-    root = _read_quiz_root(path)
-    variants: list[dict[str, str]] = []
-
-    cloze_index = 0
-    for question in root.findall("question"):
-        if question.get("type") != "cloze":
-            continue
-
-        cloze_index += 1
-        name = (question.findtext("name/text") or "").strip() or f"Question {cloze_index}"
-        text = question.findtext("questiontext/text")
-        if text is None or not text.strip():
-            raise ValueError(f"Question {cloze_index} ({name!r}) is missing questiontext/text.")
-
-        variants.append(
-            {
-                "id": str(cloze_index - 1),
-                "name": name if keep_names else "",
-                "text": _cleanup_cache_html(text),
-            }
-        )
-
-    return {"variants": variants}
+    return {"variants": list(iter_cloze_variants(path, _cleanup_cache_html, keep_names=keep_names))}
 
 
 def main() -> int:
@@ -305,10 +339,22 @@ def main() -> int:
         action="store_true",
         help="Keep Moodle question names as variant names instead of stripping them from student-facing output.",
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Parse the export incrementally and write variants as they are converted, for very large banks.",
+    )
     args = parser.parse_args()
 
     input_path = Path(args.input)
     output_path = Path(args.output) if args.output else input_path.with_suffix(".json")
+    if args.stream:
+        count = write_variants_file(
+            iter_cloze_variants(input_path, _cleanup_cache_html, keep_names=args.keep_names), output_path
+        )
+        print(f"Wrote {count} variant(s) to {output_path}")
+        return 0
+
     payload = convert_moodle_cache_xml(input_path, keep_names=args.keep_names)
     output_path.write_text(json.dumps(payload, indent=2), encoding="utf-8")
     print(f"Wrote {len(payload['variants'])} variant(s) to {output_path}")
@@ -3,77 +3,68 @@ from __future__ import annotations
 
 import argparse
 import json
-import re
+import os
+import sys
+import textwrap
 import xml.etree.ElementTree as ET
 from pathlib import Path
-
-
-def _read_quiz_root(path: Path) -> ET.Element:
-    # Some exported quiz banks have blank lines before the XML declaration.
-    text = path.read_text(encoding="utf-8").lstrip()
-    return ET.fromstring(text)
-
-
-def _sanitize_moodle_html(text: str) -> str:
-    cleaned = text.strip()
-    cleaned = re.sub(r"<style\b[^>]*>.*?</style>", "", cleaned, flags=re.IGNORECASE | re.DOTALL)
-    cleaned = re.sub(r"</span>", "", cleaned, flags=re.IGNORECASE)
-    cleaned = re.sub(r'\salign="left"', "", cleaned, flags=re.IGNORECASE)
-    cleaned = re.sub(r'\swidth=(["\'])?100%\1?', "", cleaned, flags=re.IGNORECASE)
-    cleaned = re.sub(r'\s(width|height)="[^"]*"', "", cleaned, flags=re.IGNORECASE)
-    cleaned = re.sub(r"<p>\s*<p>", "<p>", cleaned, flags=re.IGNORECASE)
-    cleaned = re.sub(r"</p>\s*</p>", "</p>", cleaned, flags=re.IGNORECASE)
-    cleaned = re.sub(r"<br\s*/?>", "<div class=\"cloze-converted-break\"></div>", cleaned, flags=re.IGNORECASE)
-    cleaned = _normalize_moodle_cloze_tokens(cleaned)
-    cleaned = re.sub(r"<table\b([^>]*)>", _decorate_table_tag, cleaned, flags=re.IGNORECASE)
-    cleaned = re.sub(r"<pre\b([^>]*)>", _decorate_pre_tag, cleaned, flags=re.IGNORECASE)
-    return cleaned
-
-
-def _append_html_class(attrs: str, class_name: str) -> str:
-    class_match = re.search(r'class="([^"]*)"', attrs, flags=re.IGNORECASE)
-    if class_match:
-        existing = class_match.group(1).strip()
-        replacement = 'class="{} {}"'.format(existing, class_name).strip()
-        return attrs[:class_match.start()] + replacement + attrs[class_match.end():]
-    return '{} class="{}"'.format(attrs, class_name)
-
-
-def _decorate_table_tag(match: re.Match[str]) -> str:
-    attrs = _append_html_class(match.group(1), "cloze-converted-table")
-    return "<table{}>".format(attrs)
-
-
-def _decorate_pre_tag(match: re.Match[str]) -> str:
-    attrs = _append_html_class(match.group(1), "cloze-converted-code")
-    return "<pre{}>".format(attrs)
-
-
-def _normalize_moodle_cloze_tokens(text: str) -> str:
-    shorthand_map = {
-        "MC": "MULTICHOICE",
-        "MCH": "MULTICHOICE",
-        "NM": "NUMERICAL",
-        "SA": "SHORTANSWER",
-    }
-
-    def repl(match: re.Match[str]) -> str:
-        kind = shorthand_map.get(match.group(1).upper())
-        if not kind:
-            return match.group(0)
-        rhs = match.group(2).strip()
-        return "{1:%s:%s}" % (kind, rhs)
-
-    return re.sub(r"\{:(MC|MCH|NM|SA):?((?:\\.|[^{}])*)\}", repl, text)
-
-
-def convert_moodle_cloze_xml(path: Path, keep_names: bool = False) -> dict[str, list[dict[str, str]]]:
-    root = _read_quiz_root(path)
-    variants = []
-
+from typing import Callable, Iterable, Iterator, TextIO
+
+try:
+    from inginious_cloze_plugin.cloze_sanitize import sanitize_moodle_html
+except ModuleNotFoundError:  # running from a source checkout
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+    from inginious_cloze_plugin.cloze_sanitize import sanitize_moodle_html
+
+_READ_CHUNK_SIZE = 1 << 20
+
+
+def _iter_quiz_questions(path: Path) -> Iterator[ET.Element]:
+    # Top-level <question> elements are yielded as soon as they are complete and dropped
+    # afterwards, so memory stays bounded by one question. Some exported quiz banks have blank
+    # lines before the XML declaration, hence the lstrip() of the first chunk.
+    parser = ET.XMLPullParser(events=("start", "end"))
+    root = None
+    depth = 0
+    started = False
+    with path.open("rb") as handle:
+        while True:
+            data = handle.read(_READ_CHUNK_SIZE)
+            chunk = data if started else data.lstrip()
+            started = started or bool(chunk)
+            if chunk:
+                parser.feed(chunk)
+            elif not data:
+                parser.close()
+            for event, element in parser.read_events():
+                if event == "start":
+                    depth += 1
+                    if root is None:
+                        root = element
+                    continue
+                depth -= 1
+                if depth == 1:
+                    if element.tag == "question":
+                        yield element
+                    # Everything below the root that has been closed is no longer needed.
+                    root.clear()
+            if not data:
+                return
+
+
+# The plugin ships the sanitizer so that prompts pasted in the task editor get the same cleanup.
+_sanitize_moodle_html = sanitize_moodle_html
+
+
+def iter_cloze_questions(path: Path) -> Iterator[tuple[str, int, str, str]]:
+    """Yield ``(category, cloze_index, name, text)`` for every cloze question of an export."""
+    category = ""
     cloze_index = 0
-    for index, question in enumerate(root.findall("question"), start=1):
+    for question in _iter_quiz_questions(path):
         question_type = question.get("type")
+        if question_type == "category":
+            category = (question.findtext("category/text") or "").strip()
+            continue
         if question_type != "cloze":
             continue
 
@@ -82,14 +73,48 @@ def convert_moodle_cloze_xml(path: Path, keep_names: bool = False) -> dict[str,
         text = question.findtext("questiontext/text")
         if text is None or not text.strip():
             raise ValueError(f"Question {cloze_index} ({name!r}) is missing questiontext/text.")
+        yield category, cloze_index, name, text
+
 
-        variants.append({
+def iter_cloze_variants(
+    path: Path,
+    clean_html: Callable[[str], str],
+    keep_names: bool = False,
+) -> Iterator[dict[str, str]]:
+    for _, cloze_index, name, text in iter_cloze_questions(path):
+        yield {
             "id": str(cloze_index - 1),
             "name": name if keep_names else "",
-            "text": _sanitize_moodle_html(text),
-        })
+            "text": clean_html(text),
+        }
+
+
+def write_variants_json(variants: Iterable[dict[str, str]], handle: TextIO) -> int:
+    """Write ``{"variants": [...]}`` exactly as ``json.dumps(payload, indent=2)`` would, one variant at a time."""
+    count = 0
+    for variant in variants:
+        handle.write('{\n  "variants": [\n' if count == 0 else ",\n")
+        handle.write(textwrap.indent(json.dumps(variant, indent=2), "    "))
+        count += 1
+    handle.write('{\n  "variants": []\n}' if count == 0 else "\n  ]\n}")
+    return count
+
+
+def write_variants_file(variants: Iterable[dict[str, str]], output_path: Path) -> int:
+    # Stream into a sibling temporary file so a failed conversion never leaves a truncated output.
+    partial_path = output_path.with_name(output_path.name + ".partial")
+    try:
+        with partial_path.open("w", encoding="utf-8") as handle:
+            count = write_variants_json(variants, handle)
+        os.replace(partial_path, output_path)
+    except BaseException:
+        partial_path.unlink(missing_ok=True)
+        raise
+    return count
 
-    return {"variants": variants}
+
+def convert_moodle_cloze_xml(path: Path, keep_names: bool = False) -> dict[str, list[dict[str, str]]]:
+    return {"variants": list(iter_cloze_variants(path, _sanitize_moodle_html, keep_names=keep_names))}
 
 
 def main() -> int:
@@ -107,11 +132,23 @@ def main() -> int:
         action="store_true",
         help="Keep Moodle question names as variant names instead of stripping them from student-facing output.",
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Parse the export incrementally and write variants as they are converted, for very large banks.",
+    )
     args = parser.parse_args()
 
     input_path = Path(args.input)
     output_path = Path(args.output) if args.output else input_path.with_suffix(".json")
 
+    if args.stream:
+        count = write_variants_file(
+            iter_cloze_variants(input_path, _sanitize_moodle_html, keep_names=args.keep_names), output_path
+        )
+        print(f"Wrote {count} variant(s) to {output_path}")
+        return 0
+
     payload = convert_moodle_cloze_xml(input_path, keep_names=args.keep_names)
     output_path.write_text(json.dumps(payload, indent=2), encoding="utf-8")
     print(f"Wrote {len(payload['variants'])} variant(s) to {output_path}")
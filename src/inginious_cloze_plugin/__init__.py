@@ -2,8 +2,11 @@
 from __future__ import annotations
 
 import asyncio
+import copy
+import hashlib
 import json
 import os
+import time
 from pathlib import Path
 
 try:
@@ -11,14 +14,41 @@ try:
 except Exception:  # pragma: no cover - yaml is available on the target server
     yaml = None
 
+# The libyaml-backed loader is several times faster on large task descriptors.
+_YAML_LOADER = None if yaml is None else getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 from .cloze_problem_backend import ClozeProblem  # noqa: F401
 from .cloze_agent import ClozeAgent  # noqa: F401
+from .cloze_cache import LRUCache, TTLCache
 from .cloze_env import ClozeFrontendEnv  # noqa: F401
-from .cloze_problem_frontend import DisplayableClozeProblem  # noqa: F401
-from .cloze_problem_backend import _read_task_file
+from .cloze_metrics import histogram
+from .cloze_problem_frontend import DisplayableClozeProblem, configure_frontend  # noqa: F401
+from .cloze_problem_backend import _read_task_file, _task_file_signature, configure_variants_cache
+from .cloze_user_tasks import configure_write_behind, user_task_operations, write_behind, write_user_task_operations
+from .pages import configure_metrics, configure_static, json_script_tag, register_pages, script_tag
 
 _AGENT_TASKS = []
 
+EVALUATION_MODE_CACHE_TTL = 60.0
+_EVALUATION_MODE_CACHE = TTLCache(4096, EVALUATION_MODE_CACHE_TTL)
+_NOT_CACHED = object()
+DESCRIPTOR_CACHE_SIZE = 256
+_DESCRIPTOR_CACHE = LRUCache(DESCRIPTOR_CACHE_SIZE)
+_DESCRIPTOR_NAMES = ("task.yaml", "task.yml", "task.json")
+_KNOWN_TASK_ROOTS = (
+    "/var/www/inginious/tasks",
+    "/var/lib/inginious/tasks",
+    "/srv/inginious/tasks",
+    "./tasks",
+)
+_KNOWN_ROOT_BY_COURSE = {}
+_COURSE_UPDATE_METHODS = ("update_course_descriptor_content", "update_course_descriptor_element", "delete_course")
+_SUBMISSION_DONE_SECONDS = histogram(
+    "cloze_submission_done_duration_seconds",
+    "Time spent in the submission_done hook updating the user_tasks cache, by outcome.",
+    ("outcome",),
+)
+
 
 async def _restart_on_cancel(agent):
     while True:
@@ -46,73 +76,91 @@ def _get_task_fs(course_factory, courseid, taskid):
         return None
 
 
+def _parse_task_descriptor(descriptor_name, raw, simple_fallback=False):
+    if descriptor_name.endswith(".json"):
+        parsed = json.loads(raw)
+        return parsed if isinstance(parsed, dict) else {}
+
+    if yaml is not None:
+        parsed = yaml.load(raw, Loader=_YAML_LOADER)
+        return parsed if isinstance(parsed, dict) else {}
+
+    if simple_fallback:
+        parsed = _parse_simple_task_yaml(raw)
+        if isinstance(parsed, dict) and parsed:
+            return parsed
+    raise ValueError("Cannot parse {} without PyYAML.".format(descriptor_name))
+
+
+def _load_task_descriptor_file(task_fs, descriptor_name, simple_fallback=False):
+    # Same scheme as the variants cache: local files are revalidated by mtime/size, other task
+    # filesystems are keyed by content. Callers merge into the result, so they get a copy.
+    signature = _task_file_signature(task_fs, descriptor_name)
+    if signature is not None:
+        key, stamp = signature
+        cached = _DESCRIPTOR_CACHE.get(key, valid=lambda entry: entry[0] == stamp)
+        if cached is not None:
+            return copy.deepcopy(cached[1])
+
+    raw = _read_task_file(task_fs, descriptor_name)
+    if signature is None:
+        key = (descriptor_name, hashlib.sha256(raw.encode("utf-8")).hexdigest())
+        cached = _DESCRIPTOR_CACHE.get(key)
+        if cached is not None:
+            return copy.deepcopy(cached[1])
+        stamp = None
+
+    parsed = _parse_task_descriptor(descriptor_name, raw, simple_fallback)
+    _DESCRIPTOR_CACHE.put(key, (stamp, parsed))
+    return copy.deepcopy(parsed)
+
+
 def _load_task_descriptor_from_task_fs(task_fs):
     if task_fs is None:
         return {}
 
-    for descriptor_name in ("task.yaml", "task.yml", "task.json"):
+    for descriptor_name in _DESCRIPTOR_NAMES:
         try:
-            raw = _read_task_file(task_fs, descriptor_name)
+            return _load_task_descriptor_file(task_fs, descriptor_name)
         except Exception:
             continue
 
-        if descriptor_name.endswith(".json"):
-            try:
-                return json.loads(raw)
-            except Exception:
-                continue
+    return {}
 
-        if yaml is not None:
-            try:
-                parsed = yaml.safe_load(raw)
-                return parsed if isinstance(parsed, dict) else {}
-            except Exception:
-                continue
 
-    return {}
+def _known_task_roots(courseid):
+    remembered = _KNOWN_ROOT_BY_COURSE.get(courseid)
+    if remembered is not None:
+        return (remembered,)
+    for root in _KNOWN_TASK_ROOTS:
+        if (Path(root) / courseid).is_dir():
+            _KNOWN_ROOT_BY_COURSE[courseid] = root
+            return (root,)
+    return ()
 
 
 def _load_task_descriptor_from_known_paths(courseid, taskid):
-    candidate_roots = [
-        "/var/www/inginious/tasks",
-        "/var/lib/inginious/tasks",
-        "/srv/inginious/tasks",
-        "./tasks",
-    ]
-
-    for root in candidate_roots:
-        task_dir = Path(root) / courseid / taskid
-        for descriptor_name in ("task.yaml", "task.yml", "task.json"):
-            descriptor_path = task_dir / descriptor_name
-            if not descriptor_path.exists():
-                continue
+    for root in _known_task_roots(courseid):
+        task_dir = str(Path(root) / courseid / taskid)
+        for descriptor_name in _DESCRIPTOR_NAMES:
             try:
-                raw = descriptor_path.read_text(encoding="utf-8")
+                return _load_task_descriptor_file(task_dir, descriptor_name, simple_fallback=True)
             except Exception:
                 continue
 
-            if descriptor_name.endswith(".json"):
-                try:
-                    parsed = json.loads(raw)
-                    return parsed if isinstance(parsed, dict) else {}
-                except Exception:
-                    continue
+    return {}
 
-            if yaml is not None:
-                try:
-                    parsed = yaml.safe_load(raw)
-                    return parsed if isinstance(parsed, dict) else {}
-                except Exception:
-                    continue
 
-            try:
-                parsed = _parse_simple_task_yaml(raw)
-                if isinstance(parsed, dict) and parsed:
-                    return parsed
-            except Exception:
-                continue
+def _load_source_task_descriptor(course_factory, courseid, taskid):
+    # The on-disk scan is only a fallback for setups whose task filesystem cannot be read.
+    source_task_data = _load_task_descriptor_from_task_fs(_get_task_fs(course_factory, courseid, taskid))
+    if source_task_data:
+        return source_task_data
+    return _load_task_descriptor_from_known_paths(courseid, taskid)
 
-    return {}
+
+def descriptor_cache_stats():
+    return _DESCRIPTOR_CACHE.stats()
 
 
 def _parse_yaml_scalar(value):
@@ -197,13 +245,7 @@ def _merge_cloze_problem_fields(target_task_data, source_task_data):
 
 
 def _restore_cloze_editor_data(course_factory, course, taskid, task_data, template_helper=None):
-    task_fs = _get_task_fs(course_factory, course.get_id(), taskid)
-    source_task_data = _load_task_descriptor_from_task_fs(task_fs)
-    known_path_task_data = _load_task_descriptor_from_known_paths(course.get_id(), taskid)
-    if isinstance(source_task_data, dict) and isinstance(known_path_task_data, dict):
-        _merge_cloze_problem_fields(source_task_data, known_path_task_data)
-    elif not source_task_data:
-        source_task_data = known_path_task_data
+    source_task_data = _load_source_task_descriptor(course_factory, course.get_id(), taskid)
     if isinstance(task_data, dict) and isinstance(source_task_data, dict):
         _merge_cloze_problem_fields(task_data, source_task_data)
     return None
@@ -242,7 +284,7 @@ def _patch_task_editor_get_auth():
             raise NotFound()
 
         task_data = _migrate_from_v_0_6(task_data)
-        source_task_data = _load_task_descriptor_from_known_paths(courseid, taskid)
+        source_task_data = _load_source_task_descriptor(getattr(self, "course_factory", None), courseid, taskid)
         if isinstance(source_task_data, dict):
             _merge_cloze_problem_fields(task_data, source_task_data)
 
@@ -288,7 +330,7 @@ def _patch_task_editor_get_auth():
     CourseEditTask.GET_AUTH = patched_get_auth
 
 
-def _start_cloze_agent(client, course_factory):
+def _start_cloze_agent(client, course_factory, entry=None):
     context = getattr(client, "_context", None)
     backend_addr = getattr(client, "_router_addr", None)
     tasks_fs = _get_tasks_fs(course_factory)
@@ -305,32 +347,82 @@ def _start_cloze_agent(client, course_factory):
     if any(not task.done() for task in _AGENT_TASKS):
         return
 
-    agent = ClozeAgent(context, backend_addr, "Cloze - Local agent", 1, tasks_fs)
+    entry = entry or {}
+    concurrency = int(entry.get("agent_concurrency", 1) or 1)
+    raw_grading_workers = entry.get("agent_grading_workers")
+    grading_workers = concurrency if raw_grading_workers is None else int(raw_grading_workers)
+    agent = ClozeAgent(context, backend_addr, "Cloze - Local agent", concurrency, tasks_fs, grading_workers)
     task = asyncio.ensure_future(_restart_on_cancel(agent))
     _AGENT_TASKS.append(task)
 
 
+def _lookup_evaluation_mode(course_factory, courseid, taskid):
+    get_course = getattr(course_factory, "get_course", None)
+    if callable(get_course):
+        course = get_course(courseid)
+        if course is not None:
+            dispenser = course.get_task_dispenser()
+            if dispenser is not None:
+                return dispenser.get_evaluation_mode(taskid)
+    return None
+
+
 def _get_evaluation_mode(course_factory, courseid, taskid):
     if course_factory is None:
         return None
 
+    key = (courseid, taskid)
+    cached = _EVALUATION_MODE_CACHE.get(key, _NOT_CACHED)
+    if cached is not _NOT_CACHED:
+        return cached
+
     try:
-        get_course = getattr(course_factory, "get_course", None)
-        if callable(get_course):
-            course = get_course(courseid)
-            if course is not None:
-                dispenser = course.get_task_dispenser()
-                if dispenser is not None:
-                    return dispenser.get_evaluation_mode(taskid)
+        evaluation_mode = _lookup_evaluation_mode(course_factory, courseid, taskid)
     except Exception:
+        # Not cached: a transient failure should not pin the fallback heuristic for a whole TTL.
         return None
 
-    return None
+    _EVALUATION_MODE_CACHE.put(key, evaluation_mode)
+    return evaluation_mode
+
+
+def invalidate_evaluation_mode_cache(courseid=None) -> int:
+    return _EVALUATION_MODE_CACHE.invalidate(lambda key: courseid is None or key[0] == courseid)
+
+
+def evaluation_mode_cache_stats():
+    return _EVALUATION_MODE_CACHE.stats()
+
+
+def _watch_course_updates(course_factory):
+    # Course descriptor edits (including task dispenser settings) go through these methods.
+    for method_name in _COURSE_UPDATE_METHODS:
+        method = getattr(course_factory, method_name, None)
+        if not callable(method) or getattr(method, "_cloze_patched", False):
+            continue
+
+        def invalidating(courseid, *args, _original=method, **kwargs):
+            try:
+                return _original(courseid, *args, **kwargs)
+            finally:
+                invalidate_evaluation_mode_cache(courseid)
+
+        invalidating._cloze_patched = True  # type: ignore[attr-defined]
+        try:
+            setattr(course_factory, method_name, invalidating)
+        except Exception:
+            continue
 
 
 def _looks_like_cloze_state(raw_state):
+    # Cheap rejection of non-cloze submissions before paying for json.loads.
+    if not isinstance(raw_state, str) or not raw_state.lstrip().startswith("{"):
+        return False
+    if '"correct"' not in raw_state or '"total"' not in raw_state:
+        return False
+
     try:
-        state = json.loads(raw_state or "")
+        state = json.loads(raw_state)
     except Exception:
         return False
 
@@ -346,152 +438,29 @@ def _looks_like_cloze_state(raw_state):
 
 
 def _sync_cloze_user_task_cache(database, course_factory, submission):
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        outcome = _sync_cloze_user_task_cache_now(database, course_factory, submission)
+    finally:
+        _SUBMISSION_DONE_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+
+
+def _sync_cloze_user_task_cache_now(database, course_factory, submission) -> str:
     if database is None or not _looks_like_cloze_state(submission.get("state")):
-        return
+        return "skipped"
 
     evaluation_mode = _get_evaluation_mode(course_factory, submission["courseid"], submission["taskid"])
-    for username in submission.get("username", []):
-        query = {
-            "username": username,
-            "courseid": submission["courseid"],
-            "taskid": submission["taskid"],
-        }
-        current = database.user_tasks.find_one(query) or {}
-
-        should_update = current.get("submissionid") in (None, submission["_id"])
-        if evaluation_mode == "last":
-            should_update = True
-        elif evaluation_mode == "best":
-            should_update = current.get("grade", 0.0) <= submission.get("grade", 0.0)
-        elif evaluation_mode is None:
-            # Fall back to a conservative heuristic for plugin-managed cloze tasks:
-            # update the cache unless it already points to a strictly better submission.
-            should_update = current.get("grade", 0.0) <= submission.get("grade", 0.0) or current.get("submissionid") in (None, submission["_id"])
-
-        if should_update:
-            database.user_tasks.find_one_and_update(
-                query,
-                {
-                    "$set": {
-                        "succeeded": submission.get("result") == "success",
-                        "grade": submission.get("grade", 0.0),
-                        "state": submission.get("state", ""),
-                        "submissionid": submission["_id"],
-                    }
-                },
-                upsert=True,
-            )
+    writer = write_behind()
+    if writer is not None:
+        writer.submit(submission, evaluation_mode)
+        return "queued"
+    write_user_task_operations(database.user_tasks, user_task_operations(submission, evaluation_mode))
+    return "written"
 
 
 def _inject_task_status_fix(course, task, template_helper):
-    return """
-<script>
-(function () {
-    "use strict";
-
-    if (typeof window.load_feedback_cloze !== "function") {
-        window.load_feedback_cloze = function () {
-            return;
-        };
-    }
-
-    if (typeof window.load_input_cloze !== "function") {
-        window.load_input_cloze = function () {
-            return;
-        };
-    }
-
-    function normalizeText(node) {
-        return (node && node.textContent ? node.textContent : "").replace(/\\s+/g, " ").trim();
-    }
-
-    function extractFeedbackText() {
-        var alerts = document.querySelectorAll(".alert");
-        for (var i = 0; i < alerts.length; i += 1) {
-            var text = normalizeText(alerts[i]);
-            if (text.indexOf("Your score is ") !== -1 || text.indexOf("Your submission timed out.") !== -1) {
-                return text;
-            }
-        }
-        return "";
-    }
-
-    function inferStatus(text) {
-        if (!text) {
-            return null;
-        }
-        if (text.indexOf("Your answer passed the tests!") !== -1) {
-            return "Succeeded";
-        }
-        if (
-            text.indexOf("There are some errors in your answer.") !== -1 ||
-            text.indexOf("Your submission timed out.") !== -1 ||
-            text.indexOf("Your submission made an overflow.") !== -1 ||
-            text.indexOf("Your submission was killed.") !== -1
-        ) {
-            return "Failed";
-        }
-        return null;
-    }
-
-    function inferGrade(text) {
-        var match = text.match(/Your score is ([0-9]+(?:\\.[0-9]+)?)%/);
-        return match ? match[1] : null;
-    }
-
-    function syncSidebarFromFeedback() {
-        var feedbackText = extractFeedbackText();
-        if (!feedbackText) {
-            return;
-        }
-
-        var status = inferStatus(feedbackText);
-        var grade = inferGrade(feedbackText);
-
-        var statusNode = document.getElementById("task_status");
-        if (statusNode && status) {
-            statusNode.textContent = status;
-        }
-
-        var gradeNode = document.getElementById("task_grade");
-        if (gradeNode && grade !== null) {
-            gradeNode.textContent = grade;
-        }
-    }
-
-    function init() {
-        syncSidebarFromFeedback();
-
-        var observer = new MutationObserver(function () {
-            syncSidebarFromFeedback();
-        });
-
-        observer.observe(document.body, {
-            childList: true,
-            subtree: true,
-            characterData: true
-        });
-
-        var taskForm = document.getElementById("task");
-        if (taskForm) {
-            taskForm.addEventListener("submit", function () {
-                window.setTimeout(syncSidebarFromFeedback, 250);
-                window.setTimeout(syncSidebarFromFeedback, 1000);
-                window.setTimeout(syncSidebarFromFeedback, 2500);
-            });
-        }
-
-        window.setInterval(syncSidebarFromFeedback, 1000);
-    }
-
-    if (document.readyState === "loading") {
-        document.addEventListener("DOMContentLoaded", init);
-    } else {
-        init();
-    }
-})();
-</script>
-"""
+    return script_tag("cloze_task_status.js")
 
 
 def _inject_task_editor_cloze_hydrator(source_task_data=None):
@@ -505,188 +474,10 @@ def _inject_task_editor_cloze_hydrator(source_task_data=None):
                 if isinstance(problem, dict) and problem.get("type") == "cloze"
             }
 
-    return """
-<script>
-(function () {
-    "use strict";
-
-    window.__clozeSourceProblems = __SOURCE_PROBLEMS__;
-
-    function getProblemData() {
-        if (window.__clozeHydratorProblemData) {
-            return window.__clozeHydratorProblemData;
-        }
-
-        var raw = window.problem_data;
-        if (!raw) {
-            return null;
-        }
-
-        if (typeof raw === "string") {
-            try {
-                raw = JSON.parse(raw);
-            } catch (err) {
-                return null;
-            }
-        }
-
-        if (!raw || typeof raw !== "object") {
-            return null;
-        }
-
-        window.__clozeHydratorProblemData = raw;
-        return raw;
-    }
-
-    function getClozeProblems() {
-        var problems = {};
-        var renderedProblems = getProblemData();
-        var sourceProblems = window.__clozeSourceProblems || {};
-        var pid;
-
-        if (renderedProblems) {
-            Object.keys(renderedProblems).forEach(function (key) {
-                problems[key] = renderedProblems[key];
-            });
-        }
-
-        Object.keys(sourceProblems).forEach(function (key) {
-            problems[key] = sourceProblems[key];
-        });
-
-        for (pid in problems) {
-            if (!Object.prototype.hasOwnProperty.call(problems, pid)) {
-                continue;
-            }
-            if (!problems[pid] || problems[pid].type !== "cloze") {
-                delete problems[pid];
-            }
-        }
-
-        return problems;
-    }
-
-    function hasProblemCard(pid) {
-        return document.querySelector('[name="problem[' + pid + '][text]"]') !== null;
-    }
-
-    function ensureProblemsExist(problems, count) {
-        if (typeof window.studio_create_from_template !== "function") {
-            return false;
-        }
-
-        // Give the native editor a chance to instantiate existing problems first.
-        if (count < 5 && !Object.keys(problems).some(hasProblemCard)) {
-            return false;
-        }
-
-        var missing = Object.keys(problems).filter(function (pid) {
-            return !hasProblemCard(pid);
-        });
-
-        if (!missing.length) {
-            return true;
-        }
-
-        missing.forEach(function (pid) {
-            if (hasProblemCard(pid)) {
-                return;
-            }
-            window.studio_create_from_template("#subproblem_cloze", pid);
-        });
-
-        return Object.keys(problems).every(function (pid) {
-            return hasProblemCard(pid);
-        });
-    }
-
-    function hydrate() {
-        var problems = getClozeProblems();
-        var attemptCount = arguments.length > 0 ? arguments[0] : 0;
-        if (!Object.keys(problems).length) {
-            return true;
-        }
-
-        if (!ensureProblemsExist(problems, attemptCount)) {
-            return false;
-        }
-
-        var foundAll = true;
-        Object.keys(problems).forEach(function (pid) {
-            var problem = problems[pid];
-
-            [
-                ["name", typeof problem.name === "string" ? problem.name : ""],
-                ["text", typeof problem.text === "string" ? problem.text : ""],
-                ["variants_file", typeof problem.variants_file === "string" ? problem.variants_file : ""],
-                ["random_problem_count", problem.random_problem_count == null ? "" : String(problem.random_problem_count)]
-            ].forEach(function (entry) {
-                var field = entry[0];
-                var value = entry[1];
-                var node = document.querySelector('[name="problem[' + pid + '][' + field + ']"]');
-                if (!node) {
-                    foundAll = false;
-                    return;
-                }
-                node.value = value;
-            });
-        });
-
-        return foundAll;
-    }
-
-    function scheduleHydrateSoon() {
-        window.setTimeout(function () {
-            hydrate(40);
-        }, 0);
-    }
-
-    function attempt(count) {
-        if (hydrate(count) || count >= 40) {
-            return;
-        }
-        window.setTimeout(function () {
-            attempt(count + 1);
-        }, 100);
-    }
-
-    function installObserver() {
-        if (typeof MutationObserver !== "function") {
-            return;
-        }
-
-        var root = document.getElementById("tab_subproblems") || document.body;
-        if (!root) {
-            return;
-        }
-
-        var observer = new MutationObserver(function (mutations) {
-            var shouldHydrate = mutations.some(function (mutation) {
-                return mutation.addedNodes && mutation.addedNodes.length > 0;
-            });
-            if (shouldHydrate) {
-                scheduleHydrateSoon();
-            }
-        });
-
-        observer.observe(root, {
-            childList: true,
-            subtree: true
-        });
-    }
-
-    if (document.readyState === "loading") {
-        document.addEventListener("DOMContentLoaded", function () {
-            installObserver();
-            attempt(0);
-        });
-    } else {
-        installObserver();
-        attempt(0);
-    }
-})();
-</script>
-""".replace("__SOURCE_PROBLEMS__", json.dumps(source_problems))
+    return "{}\n{}".format(
+        json_script_tag(source_problems, id="cloze-editor-source-problems"),
+        script_tag("cloze_editor_hydrator.js"),
+    )
 
 
 def init(plugin_manager, course_factory, client, entry):
@@ -698,7 +489,21 @@ def init(plugin_manager, course_factory, client, entry):
     if callable(register_env_type):
         register_env_type(ClozeFrontendEnv())
 
+    if entry.get("variants_cache_max_bytes") is not None:
+        configure_variants_cache(max_bytes=int(entry["variants_cache_max_bytes"]))
+    configure_static(gzip_assets=entry.get("static_gzip"))
+    configure_metrics(token=entry.get("metrics_token"))
+    configure_frontend(
+        lazy_variants=bool(entry.get("lazy_variants", False)),
+        prompt_cache_size=entry.get("prompt_cache_size"),
+    )
+
+    if entry.get("evaluation_mode_cache_ttl") is not None:
+        _EVALUATION_MODE_CACHE.set_ttl(float(entry["evaluation_mode_cache_ttl"]))
+    _watch_course_updates(course_factory)
+
     database = getattr(plugin_manager, "get_database", lambda: None)()
+    configure_write_behind(database, entry.get("user_task_write_delay"))
     plugin_manager.add_hook(
         "submission_done",
         lambda submission, archive, newsub: _sync_cloze_user_task_cache(database, course_factory, submission),
@@ -710,6 +515,7 @@ def init(plugin_manager, course_factory, client, entry):
             course_factory, course, taskid, task_data, template_helper
         ),
     )
+    register_pages(plugin_manager)
     _patch_task_editor_get_auth()
-    _start_cloze_agent(client, course_factory)
+    _start_cloze_agent(client, course_factory, entry)
     return
@@ -3,6 +3,15 @@ from __future__ import annotations
 
 import argparse
 import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from typing import Any
+
+from inginious_cloze_plugin.cloze_metrics import REGISTRY, render_merged, start_metrics_server
 
 try:
     import zmq.asyncio
@@ -11,6 +20,11 @@ except ModuleNotFoundError:  # pragma: no cover - local tests without INGInious
     zmq = None
     ClozeAgent = None
 
+_LOGGER = logging.getLogger("inginious.agent.cloze.supervisor")
+_RESTART_BACKOFF_SECONDS = (1.0, 2.0, 5.0, 10.0, 30.0)
+_STABLE_WORKER_SECONDS = 60.0
+_METRICS_REPORT_SECONDS = 5.0
+
 
 def _load_local_fs_provider():
     candidates = [
@@ -27,18 +41,208 @@ def _load_local_fs_provider():
     raise ImportError("Could not locate INGInious LocalFSProvider implementation.")
 
 
+def aggregate_worker_stats(stats_by_worker: dict[str, dict[str, Any]]) -> dict[str, Any]:
+    totals: dict[str, Any] = {}
+    for stats in stats_by_worker.values():
+        for key, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def _report_stats(agent, name, stats_queue, interval, with_metrics=False):
+    while True:
+        time.sleep(interval)
+        try:
+            metrics = REGISTRY.snapshot() if with_metrics else None
+            stats_queue.put_nowait((name, dict(agent.job_stats), metrics))
+        except Exception:
+            pass
+
+
+def _run_agent(args, name, stats_queue=None, metrics_port=None):
+    grading_workers = args.concurrency if args.grading_workers is None else args.grading_workers
+    local_fs_provider = _load_local_fs_provider()
+    context = zmq.asyncio.Context()
+    agent = ClozeAgent(
+        context, args.backend, name, args.concurrency, local_fs_provider(args.tasks_dir), grading_workers
+    )
+    if stats_queue is not None:
+        # Under a supervisor serving metrics, snapshots are sent often enough to keep scrapes fresh.
+        with_metrics = args.metrics_port is not None
+        interval = min(args.stats_interval, _METRICS_REPORT_SECONDS) if with_metrics else args.stats_interval
+        threading.Thread(
+            target=_report_stats,
+            args=(agent, name, stats_queue, interval, with_metrics),
+            name="cloze-stats-reporter",
+            daemon=True,
+        ).start()
+    if metrics_port is not None:
+        start_metrics_server(metrics_port, args.metrics_host)
+    asyncio.run(agent.run())
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def _worker_name(base_name, index):
+    return "{} #{}".format(base_name, index + 1)
+
+
+class WorkerSupervisor(object):
+    """Keep ``count`` worker processes alive, restarting exited ones with a capped backoff.
+
+    ``start_worker(index)`` must return a started process-like object (``is_alive``, ``join``,
+    ``terminate``, ``exitcode``, ``pid``). ``poll()`` is called periodically by the owner.
+    """
+
+    def __init__(self, count: int, start_worker, clock=time.monotonic):
+        self._count = count
+        self._start_worker = start_worker
+        self._clock = clock
+        self.processes: dict[int, Any] = {}
+        self._started_at: dict[int, float] = {}
+        self._restart_at: dict[int, float] = {}
+        self._crash_streak: dict[int, int] = {}
+        self.restarts = 0
+
+    def start(self) -> None:
+        for index in range(self._count):
+            self._start(index)
+
+    def _start(self, index: int) -> None:
+        process = self._start_worker(index)
+        self.processes[index] = process
+        self._started_at[index] = self._clock()
+        _LOGGER.info("Started cloze agent worker %s (pid %s).", index + 1, process.pid)
+
+    def poll(self) -> None:
+        now = self._clock()
+        for index, process in list(self.processes.items()):
+            if process is None:
+                if now >= self._restart_at.get(index, now):
+                    self._start(index)
+                continue
+            if process.is_alive():
+                if now - self._started_at[index] >= _STABLE_WORKER_SECONDS:
+                    self._crash_streak[index] = 0
+                continue
+
+            process.join()
+            streak = self._crash_streak.get(index, 0)
+            delay = _RESTART_BACKOFF_SECONDS[min(streak, len(_RESTART_BACKOFF_SECONDS) - 1)]
+            self._crash_streak[index] = streak + 1
+            self.restarts += 1
+            _LOGGER.warning(
+                "Cloze agent worker %s exited with code %s; restarting in %.0fs.",
+                index + 1, process.exitcode, delay,
+            )
+            self.processes[index] = None
+            self._restart_at[index] = now + delay
+
+    def alive(self) -> int:
+        return sum(1 for process in self.processes.values() if process is not None and process.is_alive())
+
+    def stop(self) -> None:
+        for process in self.processes.values():
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self.processes.values():
+            if process is not None:
+                process.join(timeout=10)
+
+
+class WorkerMetrics(object):
+    """Latest registry snapshot of every worker, rendered as one summed exposition."""
+
+    def __init__(self):
+        self._snapshots: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def update(self, name: str, snapshot) -> None:
+        with self._lock:
+            self._snapshots[name] = snapshot
+
+    def render(self) -> str:
+        with self._lock:
+            snapshots = list(self._snapshots.values())
+        return render_merged(snapshots)
+
+
+def _supervise(args):
+    # Spawn rather than fork: every worker builds its own ZeroMQ context and event loop.
+    mp_context = multiprocessing.get_context("spawn")
+    stats_queue = mp_context.Queue()
+    latest_stats: dict[str, dict[str, Any]] = {}
+    worker_metrics = WorkerMetrics()
+
+    def start_worker(index):
+        process = mp_context.Process(
+            target=_run_agent,
+            args=(args, _worker_name(args.name, index), stats_queue),
+            name="cloze-agent-{}".format(index + 1),
+            daemon=False,
+        )
+        process.start()
+        return process
+
+    supervisor = WorkerSupervisor(args.workers, start_worker)
+    signal.signal(signal.SIGTERM, _interrupt)
+    if args.metrics_port is not None:
+        # Workers do not listen themselves; the supervisor serves the sum of their registries.
+        start_metrics_server(args.metrics_port, args.metrics_host, worker_metrics)
+    supervisor.start()
+
+    next_report = time.monotonic() + args.stats_interval
+    try:
+        while True:
+            try:
+                name, stats, metrics = stats_queue.get(timeout=1.0)
+                latest_stats[name] = stats
+                if metrics is not None:
+                    worker_metrics.update(name, metrics)
+            except queue.Empty:
+                pass
+
+            supervisor.poll()
+            now = time.monotonic()
+            if now >= next_report:
+                next_report = now + args.stats_interval
+                _LOGGER.info(
+                    "Cloze agent workers: %s alive, %s restarts, totals %s",
+                    supervisor.alive(), supervisor.restarts, aggregate_worker_stats(latest_stats),
+                )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+
+
 def main(argv=None):
     parser = argparse.ArgumentParser(description="Run the INGInious cloze grading agent.")
     parser.add_argument("--backend", required=True, help="ZeroMQ backend address, for example tcp://127.0.0.1:2000")
     parser.add_argument("--tasks-dir", required=True, help="Root directory containing courses and tasks")
     parser.add_argument("--name", default="Cloze - Local agent", help="Friendly agent name")
     parser.add_argument("--concurrency", type=int, default=1, help="Maximum concurrent jobs")
+    parser.add_argument("--grading-workers", type=int, default=None,
+                        help="Size of the grading thread pool (default: same as --concurrency, 0 grades inline)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of agent processes to run; more than 1 starts a supervisor that restarts crashed workers")
+    parser.add_argument("--stats-interval", type=float, default=60.0,
+                        help="Seconds between aggregated worker statistics reports in supervisor mode")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve Prometheus metrics on this port; with --workers, the supervisor serves "
+                             "the sum of all workers' metrics, refreshed every 5 seconds")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="Address the metrics server binds to")
     args = parser.parse_args(argv)
 
-    local_fs_provider = _load_local_fs_provider()
-    context = zmq.asyncio.Context()
-    agent = ClozeAgent(context, args.backend, args.name, args.concurrency, local_fs_provider(args.tasks_dir))
-    asyncio.run(agent.run())
+    if args.workers > 1:
+        logging.basicConfig(level=logging.INFO)
+        _supervise(args)
+        return
+
+    _run_agent(args, args.name, metrics_port=args.metrics_port)
 
 
 if __name__ == "__main__":  # pragma: no cover
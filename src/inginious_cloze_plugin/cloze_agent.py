@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
 try:
@@ -15,8 +18,21 @@ except ModuleNotFoundError:  # pragma: no cover - local tests without INGInious
     BackendNewJob = object
 
 from .cloze_core import grade_answers
+from .cloze_metrics import counter, gauge, histogram
 from .cloze_problem_backend import build_variant
 
+_JOBS = counter("cloze_agent_jobs_total", "Grading jobs handled by the cloze agent, by result.", ("result",))
+_JOB_SECONDS = histogram("cloze_agent_job_duration_seconds", "Time from job receipt to result, per grading job.")
+_JOB_SLOT_WAIT_SECONDS = histogram(
+    "cloze_agent_job_slot_wait_seconds", "Time a grading job waited for a free grading slot."
+)
+_JOBS_IN_FLIGHT = gauge("cloze_agent_jobs_in_flight", "Grading jobs currently being handled by the cloze agent.")
+_GRADE_SECONDS = histogram(
+    "cloze_grade_problem_duration_seconds",
+    "Time to grade one cloze subproblem, including variant loading, by status.",
+    ("status",),
+)
+
 
 def parse_submission_payload(raw_value: Any) -> dict[str, str]:
     if raw_value is None:
@@ -38,9 +54,20 @@ def parse_submission_payload(raw_value: Any) -> dict[str, str]:
 
 
 def grade_cloze_problem(problem_content: dict[str, Any], task_fs: Any, raw_submission: Any) -> dict[str, Any]:
+    started = time.perf_counter()
+    status = "error"
+    try:
+        result = _grade_cloze_problem(problem_content, task_fs, raw_submission)
+        status = result["status"]
+        return result
+    finally:
+        _GRADE_SECONDS.observe(time.perf_counter() - started, status=status)
+
+
+def _grade_cloze_problem(problem_content: dict[str, Any], task_fs: Any, raw_submission: Any) -> dict[str, Any]:
     answers = parse_submission_payload(raw_submission)
     variant = build_variant(problem_content, task_fs, submitted_variant=answers.get("__variant"))
-    result = grade_answers(variant["solutions"], answers)
+    result = grade_answers(variant["solutions"], answers, plan=variant.get("grading_plan"), details=True)
 
     if result["valid"]:
         message = "Correct. You got {}/{} blanks right.".format(result["correct"], result["total"])
@@ -49,7 +76,7 @@ def grade_cloze_problem(problem_content: dict[str, Any], task_fs: Any, raw_submi
         message = "Some answers are incorrect. You got {}/{} blanks right.".format(
             result["correct"], result["total"]
         )
-        feedback_messages = [text for _, text in sorted(result.get("feedback", {}).items()) if text]
+        feedback_messages = [slot_result["feedback"] for slot_result in result["slots"] if slot_result["feedback"]]
         if feedback_messages:
             message = "{} {}".format(message, " ".join(feedback_messages))
         status = "failed"
@@ -65,36 +92,108 @@ def grade_cloze_problem(problem_content: dict[str, Any], task_fs: Any, raw_submi
     }
 
 
+def effective_concurrency(concurrency: Any, grading_workers: Any) -> int:
+    # Inline grading blocks the event loop, so only one job can make progress at a time.
+    # With a pool, each concurrent job needs at least one worker.
+    try:
+        requested = max(int(concurrency), 1)
+    except (TypeError, ValueError):
+        requested = 1
+    try:
+        workers = int(grading_workers or 0)
+    except (TypeError, ValueError):
+        workers = 0
+    return min(requested, workers) if workers > 0 else 1
+
+
 class ClozeAgent(Agent):
-    def __init__(self, context, backend_addr, friendly_name, concurrency, tasks_filesystem):
-        super().__init__(context, backend_addr, friendly_name, concurrency, tasks_filesystem)
+    def __init__(self, context, backend_addr, friendly_name, concurrency, tasks_filesystem, grading_workers=0):
+        # The backend never sends more jobs than the advertised concurrency, so only advertise
+        # the capacity the grading pool can actually serve.
+        capacity = effective_concurrency(concurrency, grading_workers)
+        super().__init__(context, backend_addr, friendly_name, capacity, tasks_filesystem)
         self._logger = logging.getLogger("inginious.agent.cloze")
+        if capacity < concurrency:
+            self._logger.info(
+                "Cloze agent concurrency lowered from %s to %s to match grading workers.", concurrency, capacity
+            )
+        self.grading_capacity = capacity
+        self.job_stats = {"jobs": 0, "success": 0, "failed": 0, "crashed": 0, "errors": 0, "grading_seconds": 0.0}
+        self._job_slots = None
+        # With grading_workers > 0, subproblems are graded on a bounded thread pool so variants
+        # file reads overlap and parsing stays off the event loop. 0 keeps grading inline.
+        self._grading_workers = grading_workers if grading_workers and grading_workers > 0 else 0
+        self._grading_executor = None
 
     @property
     def environments(self):
         return {"cloze": {"cloze": {"id": "cloze", "created": 0}}}
 
+    async def run(self):
+        try:
+            await super().run()
+        finally:
+            # Also reached when the run is cancelled; the pool is recreated if the agent is restarted.
+            self.close()
+
+    def close(self) -> None:
+        executor, self._grading_executor = self._grading_executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _grading_pool(self) -> ThreadPoolExecutor | None:
+        if self._grading_executor is None and self._grading_workers:
+            self._grading_executor = ThreadPoolExecutor(
+                max_workers=self._grading_workers,
+                thread_name_prefix="cloze-grader",
+            )
+        return self._grading_executor
+
     async def new_job(self, msg: BackendNewJob):
+        started = time.perf_counter()
+        self.job_stats["jobs"] += 1
+        _JOBS_IN_FLIGHT.inc()
+        result = "error"
+        try:
+            result = await self._run_job(msg)
+        except Exception:
+            self.job_stats["errors"] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.job_stats["grading_seconds"] += elapsed
+            _JOBS_IN_FLIGHT.dec()
+            _JOB_SECONDS.observe(elapsed)
+            _JOBS.inc(result=result)
+        self.job_stats[result] = self.job_stats.get(result, 0) + 1
+
+    async def _run_job(self, msg: BackendNewJob) -> str:
         course_fs = self._fs.from_subfolder(msg.course_id)
         task_fs = course_fs.from_subfolder(msg.task_id)
         task_problems = msg.task_problems or {}
 
         if not task_problems:
             await self.send_job_result(msg.job_id, "crashed", "No cloze subproblems defined.", 0.0, {}, {}, {}, "", None)
-            return
+            return "crashed"
 
-        problem_feedback = {}
-        states = {}
-        total_correct = 0
-        total_blanks = 0
-        total_earned = 0.0
         for problem_id, problem_content in task_problems.items():
             if problem_content.get("type") != "cloze":
                 raise CannotCreateJobException(
                     "Task uses non-cloze subproblem '{}' with the cloze environment.".format(problem_id)
                 )
 
-            graded = grade_cloze_problem(problem_content, task_fs, msg.inputdata.get(problem_id))
+        problem_feedback = {}
+        states = {}
+        total_correct = 0
+        total_blanks = 0
+        total_earned = 0.0
+        if self._job_slots is None:
+            self._job_slots = asyncio.Semaphore(self.grading_capacity)
+        waiting = time.perf_counter()
+        async with self._job_slots:
+            _JOB_SLOT_WAIT_SECONDS.observe(time.perf_counter() - waiting)
+            graded_problems = await self._grade_problems(task_fs, task_problems, msg.inputdata)
+        for problem_id, graded in graded_problems:
             total_correct += graded["correct"]
             total_blanks += graded["total"]
             total_earned += graded["score"] * graded["total"]
@@ -120,6 +219,30 @@ class ClozeAgent(Agent):
             json.dumps(states),
             None,
         )
+        return result
+
+    async def _grade_problems(self, task_fs, task_problems, inputdata):
+        problem_ids = list(task_problems)
+        executor = self._grading_pool()
+        if executor is None:
+            return [
+                (problem_id, grade_cloze_problem(task_problems[problem_id], task_fs, inputdata.get(problem_id)))
+                for problem_id in problem_ids
+            ]
+
+        loop = asyncio.get_event_loop()
+        # gather() keeps submission order, so the merged feedback is the same as inline grading.
+        results = await asyncio.gather(*(
+            loop.run_in_executor(
+                executor,
+                grade_cloze_problem,
+                task_problems[problem_id],
+                task_fs,
+                inputdata.get(problem_id),
+            )
+            for problem_id in problem_ids
+        ))
+        return list(zip(problem_ids, results))
 
     async def kill_job(self, message: BackendKillJob):
         return
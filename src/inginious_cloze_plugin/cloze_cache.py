@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    def __init__(self, maxsize: int = 128, max_weight: int | None = None):
+        self._maxsize = max(int(maxsize), 0)
+        self._max_weight = None if max_weight is None else max(int(max_weight), 0)
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self._weights: dict[Hashable, int] = {}
+        self._total_weight = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def maxsize(self) -> int:
+        return self._maxsize
+
+    @property
+    def max_weight(self) -> int | None:
+        return self._max_weight
+
+    def resize(self, maxsize: int | None = None, max_weight: int | None = None) -> None:
+        with self._lock:
+            if maxsize is not None:
+                self._maxsize = max(int(maxsize), 0)
+            if max_weight is not None:
+                self._max_weight = max(int(max_weight), 0)
+            self._evict()
+
+    def get(self, key: Hashable, default: Any = None, valid: Callable[[Any], bool] | None = None) -> Any:
+        # An entry rejected by ``valid`` (e.g. a stale file stamp) counts as a miss; callers replace it.
+        with self._lock:
+            value = self._entries.get(key, _MISSING)
+            if value is _MISSING or (valid is not None and not valid(value)):
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, weight: int = 1) -> None:
+        with self._lock:
+            self._total_weight -= self._weights.pop(key, 0)
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._weights[key] = weight
+            self._total_weight += weight
+            self._evict()
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        # Build outside the lock: concurrent misses on the same key may both compute, which is
+        # cheaper than serializing every miss behind one parser.
+        value = factory()
+        self.put(key, value)
+        return value
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            self._total_weight -= self._weights.pop(key, 0)
+            return self._entries.pop(key, default)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._weights.clear()
+            self._total_weight = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            stats = {
+                "size": len(self._entries),
+                "maxsize": self._maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+            if self._max_weight is not None:
+                stats["weight"] = self._total_weight
+                stats["max_weight"] = self._max_weight
+            return stats
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def _over_capacity(self) -> bool:
+        if len(self._entries) > self._maxsize:
+            return True
+        return self._max_weight is not None and self._total_weight > self._max_weight
+
+    def _evict(self) -> None:
+        while self._entries and self._over_capacity():
+            key, _ = self._entries.popitem(last=False)
+            self._total_weight -= self._weights.pop(key, 0)
+            self.evictions += 1
+
+
+class TTLCache(LRUCache):
+    """LRU cache whose entries also expire ``ttl`` seconds after they were stored."""
+
+    def __init__(self, maxsize: int = 128, ttl: float = 60.0, clock: Callable[[], float] = time.monotonic):
+        super().__init__(maxsize)
+        self._ttl = max(float(ttl), 0.0)
+        self._clock = clock
+        self.expirations = 0
+
+    @property
+    def ttl(self) -> float:
+        return self._ttl
+
+    def set_ttl(self, ttl: float) -> None:
+        with self._lock:
+            self._ttl = max(float(ttl), 0.0)
+
+    def get(self, key: Hashable, default: Any = None, valid: Callable[[Any], bool] | None = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] <= self._clock():
+                del self._entries[key]
+                self._total_weight -= self._weights.pop(key, 0)
+                self.expirations += 1
+                entry = _MISSING
+            if entry is _MISSING or (valid is not None and not valid(entry[1])):
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any, weight: int = 1) -> None:
+        super().put(key, (self._clock() + self._ttl, value), weight)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = super().pop(key, _MISSING)
+        return default if entry is _MISSING else entry[1]
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+                self._total_weight -= self._weights.pop(key, 0)
+            return len(keys)
+
+    def clear(self) -> None:
+        super().clear()
+        self.expirations = 0
+
+    def stats(self) -> dict[str, Any]:
+        stats = super().stats()
+        stats["ttl"] = self._ttl
+        stats["expirations"] = self.expirations
+        return stats
@@ -4,13 +4,64 @@ from __future__ import annotations
 import hashlib
 import html
 import json
+import math
 import random
 import secrets
 import re
-from typing import Any
+import time
+from bisect import bisect_right
+from typing import Any, Iterable, NamedTuple
+
+try:
+    import numpy as np
+except Exception:  # pragma: no cover - numpy is optional and only speeds up batch regrading
+    np = None
+
+from .cloze_cache import LRUCache
+from .cloze_metrics import histogram
 
 TOKEN_RE = re.compile(r"\{(\d+):(SHORTANSWER|NUMERICAL|MULTICHOICE):((?:\\.|[^}])*)\}")
 SUPPORTED_VARIANT_KEYS = {"id", "name", "text"}
+SOLUTION_CACHE_SIZE = 512
+
+_SOLUTION_CACHE = LRUCache(SOLUTION_CACHE_SIZE)
+_COMPILE_SECONDS = histogram(
+    "cloze_compile_duration_seconds", "Time to parse a cloze text into its solutions and grading plan."
+)
+
+
+class ClozeToken(NamedTuple):
+    """One span of a cloze text: literal markup, or a blank when ``kind`` is set."""
+
+    start: int
+    end: int
+    text: str
+    slot: str | None = None
+    kind: str | None = None
+    rhs: str | None = None
+
+    @property
+    def is_blank(self) -> bool:
+        return self.kind is not None
+
+
+def tokenize_cloze(text: str) -> tuple[ClozeToken, ...]:
+    text = text or ""
+    tokens = []
+    last = 0
+    for match in TOKEN_RE.finditer(text):
+        start, end = match.span()
+        if start > last:
+            tokens.append(ClozeToken(last, start, text[last:start]))
+        tokens.append(ClozeToken(start, end, match.group(0), match.group(1), match.group(2), match.group(3)))
+        last = end
+    if last < len(text):
+        tokens.append(ClozeToken(last, len(text), text[last:]))
+    return tuple(tokens)
+
+
+def cloze_text_from_tokens(tokens: tuple[ClozeToken, ...]) -> str:
+    return "".join(token.text for token in tokens)
 
 
 def _split_unescaped(text: str, separator: str) -> list[str]:
@@ -45,6 +96,10 @@ def _unescape_moodle_text(text: str) -> str:
     return re.sub(r"\\([~#}:=%\\\\])", r"\1", text)
 
 
+def _escape_moodle_text(text: str) -> str:
+    return re.sub(r"([~#}:=%\\\\])", r"\\\1", text)
+
+
 def _parse_weighted_option(raw_option: str) -> tuple[float, str, str | None]:
     option = raw_option.strip()
     if not option:
@@ -86,9 +141,15 @@ def coerce_problem_mapping(problem_content: Any) -> dict[str, Any]:
 
 
 def parse_solutions_from_text(text: str) -> dict[str, tuple[str, Any]]:
+    return parse_solutions_from_tokens(tokenize_cloze(text))
+
+
+def parse_solutions_from_tokens(tokens: tuple[ClozeToken, ...]) -> dict[str, tuple[str, Any]]:
     solutions: dict[str, tuple[str, Any]] = {}
-    for slot, kind, rhs in TOKEN_RE.findall(text or ""):
-        rhs = rhs.strip()
+    for token in tokens:
+        if not token.is_blank:
+            continue
+        slot, kind, rhs = token.slot, token.kind, token.rhs.strip()
         if kind == "SHORTANSWER":
             options = []
             for raw_option in _split_unescaped(rhs, "~"):
@@ -143,18 +204,94 @@ def parse_solutions_from_text(text: str) -> dict[str, tuple[str, Any]]:
 
 
 def expected_slots_from_text(text: str) -> list[str]:
-    return [match.group(1) for match in TOKEN_RE.finditer(text or "")]
+    return expected_slots_from_tokens(tokenize_cloze(text))
+
+
+def expected_slots_from_tokens(tokens: tuple[ClozeToken, ...]) -> list[str]:
+    return [token.slot for token in tokens if token.is_blank]
 
 
 def renumber_cloze_slots(text: str) -> str:
+    return cloze_text_from_tokens(renumber_cloze_tokens(tokenize_cloze(text)))
+
+
+def renumber_cloze_tokens(tokens: tuple[ClozeToken, ...]) -> tuple[ClozeToken, ...]:
+    renumbered = []
+    offset = 0
     next_slot = 0
+    for token in tokens:
+        if token.is_blank:
+            next_slot += 1
+            slot = str(next_slot)
+            raw = "{" + "{}:{}:{}".format(slot, token.kind, token.rhs) + "}"
+            token = ClozeToken(offset, offset + len(raw), raw, slot, token.kind, token.rhs)
+        elif token.start != offset:
+            token = token._replace(start=offset, end=offset + len(token.text))
+        renumbered.append(token)
+        offset = token.end
+    return tuple(renumbered)
+
+
+def _compile_cloze_text(text: str) -> dict[str, Any]:
+    started = time.perf_counter()
+    tokens = renumber_cloze_tokens(tokenize_cloze(text))
+    solutions = parse_solutions_from_tokens(tokens)
+    _COMPILE_SECONDS.observe(time.perf_counter() - started)
+    return {
+        "text": cloze_text_from_tokens(tokens),
+        "tokens": tokens,
+        "slots": expected_slots_from_tokens(tokens),
+        "solutions": solutions,
+        "grading_plan": compile_grading_plan(solutions),
+    }
+
+
+def compile_cloze_text(text: str) -> dict[str, Any]:
+    """Renumber and parse a cloze text, reusing the shared compiled-solution cache.
+
+    The returned record is shared between callers and must be treated as read-only.
+    """
+    text = text or ""
+    key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return _SOLUTION_CACHE.get_or_create(key, lambda: _compile_cloze_text(text))
+
+
+def solution_cache_stats() -> dict[str, Any]:
+    return _SOLUTION_CACHE.stats()
+
+
+def configure_solution_cache(maxsize: int) -> None:
+    _SOLUTION_CACHE.resize(maxsize)
+
 
-    def repl(match: re.Match[str]) -> str:
-        nonlocal next_slot
-        next_slot += 1
-        return "{" + "{}:{}:{}".format(next_slot, match.group(2), match.group(3)) + "}"
+def clear_solution_cache() -> None:
+    _SOLUTION_CACHE.clear()
 
-    return TOKEN_RE.sub(repl, text or "")
+
+def redact_cloze_text(text: str) -> str:
+    """Strip answer keys from a cloze text while keeping every blank renderable.
+
+    SHORTANSWER and NUMERICAL blanks lose their right-hand side; MULTICHOICE blanks keep only
+    their choice labels, without weights or feedback.
+    """
+    parts = []
+    for token in tokenize_cloze(text):
+        if not token.is_blank:
+            parts.append(token.text)
+            continue
+        rhs = ""
+        if token.kind == "MULTICHOICE":
+            try:
+                choices = parse_solutions_from_tokens((token,))[token.slot][1]["choices"]
+            except ValueError:
+                choices = []
+            rhs = "~".join(_escape_moodle_text(choice) for choice in choices)
+        parts.append("{" + "{}:{}:{}".format(token.slot, token.kind, rhs) + "}")
+    return "".join(parts)
+
+
+def redact_variant(variant: dict[str, Any]) -> dict[str, Any]:
+    return {"id": variant.get("id"), "name": variant.get("name"), "text": redact_cloze_text(variant.get("text", ""))}
 
 
 def normalize_variant(index: int, variant: Any) -> dict[str, Any]:
@@ -332,18 +469,102 @@ def build_variant_record(variants: list[dict[str, Any]], seed: str | None = None
         selection = [0]
 
     selected_variants = [dict(variants[index]) for index in selection]
+    compiled = compile_cloze_text(_combine_variant_texts(selected_variants))
     variant = dict(selected_variants[0])
-    variant["text"] = renumber_cloze_slots(_combine_variant_texts(selected_variants))
+    variant["text"] = compiled["text"]
     variant["index"] = selection[0] if len(selection) == 1 else ",".join(str(index) for index in selection)
     variant["selection"] = variant["index"]
-    variant["slots"] = expected_slots_from_text(variant["text"])
-    variant["solutions"] = parse_solutions_from_text(variant["text"])
+    variant["tokens"] = compiled["tokens"]
+    variant["slots"] = compiled["slots"]
+    variant["solutions"] = compiled["solutions"]
+    variant["grading_plan"] = compiled["grading_plan"]
     return variant
 
 
-def grade_answers(solutions: dict[str, tuple[str, Any]], value: Any) -> dict[str, Any]:
+class _TextMatcher(object):
+    __slots__ = ("_answers",)
+
+    def __init__(self, options: list[dict[str, Any]]):
+        best: dict[str, dict[str, Any]] = {}
+        for option in options:
+            key = option["answer"].casefold()
+            current = best.get(key)
+            # Later options win ties, matching the first-to-last scan this replaces.
+            if current is None or option["weight"] >= current["weight"]:
+                best[key] = option
+        # A slot starts at zero credit, so negative-only matches never change the outcome.
+        self._answers = {key: option for key, option in best.items() if option["weight"] >= 0.0}
+
+    def match(self, answer: str) -> tuple[float, dict[str, Any] | None]:
+        option = self._answers.get(answer.casefold())
+        if option is None:
+            return 0.0, None
+        return option["weight"], option
+
+
+class _NumericMatcher(object):
+    __slots__ = ("_options", "_bounds", "_candidates")
+
+    def __init__(self, options: list[dict[str, Any]]):
+        self._options = options
+        intervals = []
+        unbounded = []
+        for index, option in enumerate(options):
+            value, tolerance = option["answer"], option["tolerance"]
+            if not (math.isfinite(value) and math.isfinite(tolerance)):
+                unbounded.append(index)
+                continue
+            if tolerance < 0:
+                continue
+            # Widen each interval slightly so rounding at the edges never hides a candidate;
+            # match() re-checks every candidate with the exact tolerance test.
+            margin = 1e-9 * max(1.0, abs(value), tolerance)
+            intervals.append((value - tolerance - margin, value + tolerance + margin, index))
+
+        self._bounds = sorted({bound for low, high, _ in intervals for bound in (low, high)})
+        self._candidates = [tuple(unbounded)]
+        for point in self._bounds:
+            covering = [index for low, high, index in intervals if low <= point <= high]
+            self._candidates.append(tuple(sorted(covering + unbounded)))
+
+    def match(self, answer: str) -> tuple[float, dict[str, Any] | None]:
+        try:
+            submitted = float(answer)
+        except (TypeError, ValueError):
+            return 0.0, None
+
+        slot_score = 0.0
+        matched = None
+        for index in self._candidates[bisect_right(self._bounds, submitted)]:
+            option = self._options[index]
+            if abs(submitted - option["answer"]) <= option["tolerance"] and option["weight"] >= slot_score:
+                slot_score = option["weight"]
+                matched = option
+        return slot_score, matched
+
+
+def compile_grading_plan(solutions: dict[str, tuple[str, Any]]) -> tuple[tuple[str, Any], ...]:
+    plan = []
+    for slot, (kind, rhs) in solutions.items():
+        if kind == "SHORTANSWER":
+            plan.append((slot, _TextMatcher(rhs)))
+        elif kind == "MULTICHOICE":
+            plan.append((slot, _TextMatcher(rhs["answers"])))
+        else:
+            plan.append((slot, _NumericMatcher(rhs)))
+    return tuple(plan)
+
+
+def grade_answers(solutions: dict[str, tuple[str, Any]], value: Any,
+                  plan: tuple[tuple[str, Any], ...] | None = None, details: bool = False) -> dict[str, Any]:
+    """Grade submitted answers against parsed solutions.
+
+    With ``details=True`` the result also carries ``slots``: one entry per blank, in slot order,
+    with its clamped ``score``, the ``matched`` option (or None), its ``feedback`` and whether the
+    answer was ``missing``.
+    """
     if not isinstance(value, dict):
-        return {
+        result = {
             "correct": 0,
             "total": max(len(solutions), 1),
             "errors": len(solutions),
@@ -351,38 +572,25 @@ def grade_answers(solutions: dict[str, tuple[str, Any]], value: Any) -> dict[str
             "score": 0.0,
             "feedback": {},
         }
+        if details:
+            result["slots"] = [
+                {"slot": slot, "score": 0.0, "matched": None, "feedback": None, "missing": True}
+                for slot in solutions
+            ]
+        return result
+
+    if plan is None:
+        plan = compile_grading_plan(solutions)
 
     correct = 0
     errors = 0
     slot_scores = []
     slot_feedback = {}
-    for slot, (kind, rhs) in solutions.items():
+    slot_results = []
+    for slot, matcher in plan:
         answer = (value.get(slot) or "").strip()
-        slot_score = 0.0
-        matched_feedback = None
-
-        if kind == "SHORTANSWER":
-            for option in rhs:
-                if answer.lower() == option["answer"].lower():
-                    if option["weight"] >= slot_score:
-                        slot_score = option["weight"]
-                        matched_feedback = option["feedback"]
-        elif kind == "MULTICHOICE":
-            for option in rhs["answers"]:
-                if answer.lower() == option["answer"].lower():
-                    if option["weight"] >= slot_score:
-                        slot_score = option["weight"]
-                        matched_feedback = option["feedback"]
-        else:
-            try:
-                submitted = float(answer)
-                for option in rhs:
-                    if abs(submitted - option["answer"]) <= option["tolerance"]:
-                        if option["weight"] >= slot_score:
-                            slot_score = option["weight"]
-                            matched_feedback = option["feedback"]
-            except (TypeError, ValueError):
-                slot_score = 0.0
+        slot_score, matched = matcher.match(answer)
+        matched_feedback = matched["feedback"] if matched is not None else None
 
         slot_score = max(min(slot_score, 1.0), -1.0)
         slot_scores.append(slot_score)
@@ -392,10 +600,18 @@ def grade_answers(solutions: dict[str, tuple[str, Any]], value: Any) -> dict[str
             correct += 1
         else:
             errors += 1
+        if details:
+            slot_results.append({
+                "slot": slot,
+                "score": slot_score,
+                "matched": matched,
+                "feedback": matched_feedback,
+                "missing": not answer,
+            })
 
     total = max(len(solutions), 1)
     total_score = max(sum(slot_scores), 0.0)
-    return {
+    result = {
         "correct": correct,
         "total": total,
         "errors": errors,
@@ -403,3 +619,130 @@ def grade_answers(solutions: dict[str, tuple[str, Any]], value: Any) -> dict[str
         "score": min(total_score / total, 1.0),
         "feedback": slot_feedback,
     }
+    if details:
+        result["slots"] = slot_results
+    return result
+
+
+def _parse_float(answer: str) -> float:
+    try:
+        return float(answer)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _grade_slot_column(kind: str, rhs: Any, matcher: Any, column: list[str]) -> Any:
+    if np is not None and kind == "NUMERICAL":
+        submitted = np.array([_parse_float(answer) for answer in column], dtype=float)
+        scores = np.zeros(len(column))
+        with np.errstate(invalid="ignore"):
+            # Options are applied in order with ">=" so ties resolve exactly like matcher.match().
+            for option in rhs:
+                hit = (np.abs(submitted - option["answer"]) <= option["tolerance"]) & (option["weight"] >= scores)
+                scores[hit] = option["weight"]
+        return np.clip(scores, -1.0, 1.0)
+
+    scores = [max(min(matcher.match(answer)[0], 1.0), -1.0) for answer in column]
+    return np.array(scores, dtype=float) if np is not None else scores
+
+
+def grade_answers_batch(solutions: dict[str, tuple[str, Any]], answer_sets: Iterable[Any],
+                        plan: tuple[tuple[str, Any], ...] | None = None) -> dict[str, Any]:
+    """Grade many answer dicts against one compiled variant, one slot column at a time.
+
+    Returns ``scores`` and ``correct`` per answer set plus ``slot_correct``, a matrix with one row
+    per answer set and one column per entry of ``slots``. These are NumPy arrays when NumPy is
+    installed and plain lists otherwise; scores match grade_answers() exactly.
+    """
+    if plan is None:
+        plan = compile_grading_plan(solutions)
+
+    answer_sets = list(answer_sets)
+    count = len(answer_sets)
+    total = max(len(solutions), 1)
+    slots = [slot for slot, _ in plan]
+    columns = []
+    for slot, matcher in plan:
+        kind, rhs = solutions[slot]
+        column = [
+            (answers.get(slot) or "").strip() if isinstance(answers, dict) else ""
+            for answers in answer_sets
+        ]
+        columns.append(_grade_slot_column(kind, rhs, matcher, column))
+    invalid = [index for index, answers in enumerate(answer_sets) if not isinstance(answers, dict)]
+
+    if np is not None:
+        matrix = np.column_stack(columns) if columns else np.zeros((count, 0))
+        if invalid:
+            matrix[invalid, :] = 0.0
+        slot_correct = matrix >= 1.0
+        # Accumulate column by column: matrix.sum() uses pairwise summation, which can differ
+        # from grade_answers() in the last bit on wide variants.
+        totals = np.zeros(count)
+        for column in range(matrix.shape[1]):
+            totals += matrix[:, column]
+        scores = np.minimum(np.maximum(totals, 0.0) / total, 1.0)
+        return {
+            "slots": slots,
+            "total": total,
+            "scores": scores,
+            "correct": slot_correct.sum(axis=1),
+            "slot_correct": slot_correct,
+        }
+
+    invalid_rows = set(invalid)
+    scores = []
+    correct = []
+    slot_correct = []
+    for row in range(count):
+        row_scores = [0.0 if row in invalid_rows else column[row] for column in columns]
+        row_correct = [score >= 1.0 for score in row_scores]
+        scores.append(min(max(sum(row_scores), 0.0) / total, 1.0))
+        correct.append(sum(row_correct))
+        slot_correct.append(row_correct)
+    return {"slots": slots, "total": total, "scores": scores, "correct": correct, "slot_correct": slot_correct}
+
+
+def regrade_submissions(variants: list[dict[str, Any]], answer_sets: Iterable[dict[str, Any]],
+                        problem_count: int = 1) -> dict[str, Any]:
+    """Regrade answer dicts for one problem, grouping them by the variant selection they carry.
+
+    ``scores``, ``correct``, ``total`` and ``selection`` follow the input order. ``groups`` maps
+    each selection to the input ``indices`` it covers and its grade_answers_batch() result.
+    """
+    answer_sets = list(answer_sets)
+    grouped: dict[Any, list[int]] = {}
+    records: dict[Any, dict[str, Any]] = {}
+    records_by_raw: dict[Any, dict[str, Any]] = {}
+    selections = []
+    for index, answers in enumerate(answer_sets):
+        submitted_variant = answers.get("__variant") if isinstance(answers, dict) else None
+        raw_key = submitted_variant if isinstance(submitted_variant, (str, int, type(None))) else repr(submitted_variant)
+        record = records_by_raw.get(raw_key)
+        if record is None:
+            record = build_variant_record(variants, submitted_variant=submitted_variant, problem_count=problem_count)
+            records_by_raw[raw_key] = record
+        selection = record["selection"]
+        records.setdefault(selection, record)
+        grouped.setdefault(selection, []).append(index)
+        selections.append(selection)
+
+    scores = [0.0] * len(answer_sets)
+    correct = [0] * len(answer_sets)
+    total = [0] * len(answer_sets)
+    groups = {}
+    for selection, indices in grouped.items():
+        record = records[selection]
+        batch = grade_answers_batch(record["solutions"], [answer_sets[index] for index in indices],
+                                    plan=record.get("grading_plan"))
+        for position, index in enumerate(indices):
+            scores[index] = float(batch["scores"][position])
+            correct[index] = int(batch["correct"][position])
+            total[index] = batch["total"]
+        groups[selection] = dict(batch, indices=indices)
+
+    if np is not None:
+        scores = np.array(scores, dtype=float)
+        correct = np.array(correct, dtype=int)
+        total = np.array(total, dtype=int)
+    return {"selection": selections, "scores": scores, "correct": correct, "total": total, "groups": groups}
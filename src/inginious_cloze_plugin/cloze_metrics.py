@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Any, Callable, Iterable, Iterator, NamedTuple
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds; grading a blank takes microseconds, a cold variants file or a Mongo round-trip milliseconds.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, _escape_label(value)) for name, value in zip(names, values)) + "}"
+
+
+class MetricSnapshot(NamedTuple):
+    name: str
+    kind: str
+    documentation: str
+    labelnames: tuple[str, ...]
+    samples: list[tuple[str, tuple[str, ...], float]]
+
+
+def _render_metric(name: str, kind: str, documentation: str, labelnames: tuple[str, ...],
+                   samples: Iterable[tuple[str, tuple[str, ...], float]]) -> list[str]:
+    lines = [
+        "# HELP {} {}".format(name, documentation.replace("\\", "\\\\").replace("\n", "\\n")),
+        "# TYPE {} {}".format(name, kind),
+    ]
+    bucket_labelnames = labelnames + ("le",)
+    for sample_name, key, value in samples:
+        # Histogram buckets carry one extra label value, the upper bound.
+        names = bucket_labelnames if len(key) > len(labelnames) else labelnames
+        lines.append("{}{} {}".format(sample_name, _format_labels(names, key), _format_value(value)))
+    return lines
+
+
+class _Metric(object):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 function: Callable[[], dict[tuple[str, ...], float]] | None = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # A function metric is read when scraped, e.g. the size of a cache, instead of being updated.
+        self._function = function
+        self._values: dict[tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError("{} expects labels {}".format(self.name, ", ".join(self.labelnames) or "(none)"))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[tuple[str, tuple[str, ...], float]]:
+        if self._function is not None:
+            values = self._function()
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, key, value
+
+    def render(self) -> list[str]:
+        return _render_metric(self.name, self.kind, self.documentation, self.labelnames, self.samples())
+
+    def snapshot(self) -> MetricSnapshot:
+        return MetricSnapshot(self.name, self.kind, self.documentation, self.labelnames, list(self.samples()))
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), then the sum of observations.
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: Any) -> int:
+        state = self._values.get(self._key(labels))
+        return sum(state[:-1]) if state else 0
+
+    def samples(self) -> Iterator[tuple[str, tuple[str, ...], float]]:
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+        for key, state in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, state[:-1]):
+                cumulative += bucket_count
+                yield self.name + "_bucket", key + (bound,), cumulative
+            yield self.name + "_sum", key, state[-1]
+            yield self.name + "_count", key, cumulative
+
+
+class MetricsRegistry(object):
+    """Process-wide set of metrics, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError("Metric {} is already registered as a {}.".format(name, metric.kind))
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                function: Callable[[], dict[tuple[str, ...], float]] | None = None) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames, function)
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+              function: Callable[[], dict[tuple[str, ...], float]] | None = None) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames, function)
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets)
+
+    def get(self, name: str) -> _Metric | None:
+        return self._metrics.get(name)
+
+    def _sorted_metrics(self) -> list[_Metric]:
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda metric: metric.name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._sorted_metrics():
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                # A failing function metric must not take the whole scrape down.
+                continue
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> list[MetricSnapshot]:
+        """Return the current samples in a picklable form, e.g. to send them to another process."""
+        snapshots = []
+        for metric in self._sorted_metrics():
+            try:
+                snapshots.append(metric.snapshot())
+            except Exception:
+                continue
+        return snapshots
+
+
+REGISTRY = MetricsRegistry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+def render_prometheus(registry: MetricsRegistry = REGISTRY) -> str:
+    return registry.render()
+
+
+def render_merged(snapshots: Iterable[list[MetricSnapshot]]) -> str:
+    """Render several registry snapshots as one, summing samples that share name and labels.
+
+    Used by the agent supervisor: counters and histograms add up across worker processes, and
+    gauges become totals (jobs in flight, cache entries).
+    """
+    merged: dict[str, tuple[MetricSnapshot, dict[tuple[str, tuple[str, ...]], float]]] = {}
+    for snapshot in snapshots:
+        for metric in snapshot:
+            _, values = merged.setdefault(metric.name, (metric, {}))
+            for sample_name, key, value in metric.samples:
+                values[(sample_name, key)] = values.get((sample_name, key), 0.0) + value
+    lines = []
+    for name in sorted(merged):
+        metric, values = merged[name]
+        # Insertion order keeps each histogram's buckets together and in bound order.
+        lines.extend(_render_metric(name, metric.kind, metric.documentation, metric.labelnames,
+                                    [(sample_name, key, value) for (sample_name, key), value in values.items()]))
+    return "\n".join(lines) + "\n"
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1", registry: MetricsRegistry = REGISTRY) -> HTTPServer:
+    """Serve ``/metrics`` from a daemon thread and return the server (``server_address`` has the bound port).
+
+    ``registry`` only needs a ``render()`` method returning the exposition text.
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):  # noqa: N802 - http.server naming
+            if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # noqa: A002 - scrapes are too frequent to log
+            return
+
+    server = _ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="cloze-metrics", daemon=True).start()
+    return server
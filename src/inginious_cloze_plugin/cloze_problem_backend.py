@@ -5,7 +5,7 @@ import hashlib
 import json
 import os
 import secrets
-from typing import Any
+from typing import Any, Callable
 
 try:
     from inginious.frontend.task_problems import Problem
@@ -20,6 +20,7 @@ except ModuleNotFoundError:  # pragma: no cover - local tests without INGInious
             return self._id
 
 
+from .cloze_cache import LRUCache
 from .cloze_core import (
     build_variant_record,
     coerce_problem_mapping,
@@ -30,94 +31,147 @@ from .cloze_core import (
     normalize_inline_variants,
     parse_solutions_from_text,
 )
+from .cloze_metrics import histogram
 
+VARIANTS_CACHE_MAX_BYTES = 64 * 1024 * 1024
+VARIANTS_CACHE_MAX_ENTRIES = 1024
 
-def _read_task_file(task_fs: Any, path: str) -> str:
-    if task_fs is None:
-        raise ValueError("A variants_file was configured but no task filesystem is available.")
-
-    for method_name in ("get",):
-        method = getattr(task_fs, method_name, None)
-        if callable(method):
-            try:
-                data = method(path)
-                if hasattr(data, "read"):
-                    data = data.read()
-                return data.decode("utf-8") if isinstance(data, bytes) else str(data)
-            except Exception:
-                pass
+_ROOT_PATH_ATTRS = (
+    "path", "root", "root_path", "base_path", "prefix", "_path", "_root", "_root_path", "_folder", "_dir"
+)
 
-    for method_name in ("get_fd",):
-        method = getattr(task_fs, method_name, None)
-        if callable(method):
-            try:
-                handle = method(path)
-                try:
-                    data = handle.read()
-                finally:
-                    close = getattr(handle, "close", None)
-                    if callable(close):
-                        close()
-                return data.decode("utf-8") if isinstance(data, bytes) else str(data)
-            except Exception:
-                pass
+_VARIANTS_CACHE = LRUCache(VARIANTS_CACHE_MAX_ENTRIES, max_weight=VARIANTS_CACHE_MAX_BYTES)
+_LOAD_VARIANTS_SECONDS = histogram(
+    "cloze_load_variants_duration_seconds", "Time to load the variants of a cloze problem, cache hits included."
+)
 
-    for method_name in ("read", "read_file", "get_content"):
-        method = getattr(task_fs, method_name, None)
-        if callable(method):
-            data = method(path)
-            return data.decode("utf-8") if isinstance(data, bytes) else str(data)
 
-    if hasattr(task_fs, "open"):
-        for mode in ("r", "rt", "rb"):
-            try:
-                with task_fs.open(path, mode) as handle:
-                    data = handle.read()
-                    return data.decode("utf-8") if isinstance(data, bytes) else str(data)
-            except Exception:
-                pass
-
-    for method_name in ("opentext", "open_text"):
-        method = getattr(task_fs, method_name, None)
-        if callable(method):
-            with method(path) as handle:
-                return handle.read()
-
-    for method_name in ("openbin", "open_bin"):
-        method = getattr(task_fs, method_name, None)
-        if callable(method):
-            with method(path) as handle:
-                data = handle.read()
-                return data.decode("utf-8") if isinstance(data, bytes) else str(data)
-
-    for method_name in ("get_path", "get_absolute_path", "realpath", "getsyspath", "get_sys_path"):
-        method = getattr(task_fs, method_name, None)
-        if callable(method):
-            file_path = method(path)
-            with open(file_path, "r", encoding="utf-8") as handle:
-                return handle.read()
-
-    root_path = None
-    for attr_name in (
-        "path", "root", "root_path", "base_path", "prefix", "_path", "_root", "_root_path", "_folder", "_dir"
-    ):
+def _task_fs_root(task_fs: Any) -> str | None:
+    for attr_name in _ROOT_PATH_ATTRS:
         candidate = getattr(task_fs, attr_name, None)
         if isinstance(candidate, str) and candidate:
-            root_path = candidate
-            break
+            return candidate
+    return None
 
+
+def _task_file_signature(task_fs: Any, path: str) -> tuple[str, tuple[Any, ...]] | None:
+    root_path = task_fs if isinstance(task_fs, str) else _task_fs_root(task_fs)
     if root_path is not None:
-        with open(os.path.join(root_path, path), "r", encoding="utf-8") as handle:
-            return handle.read()
+        file_path = os.path.join(root_path, path)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return os.path.abspath(file_path), (stat.st_mtime_ns, stat.st_size)
 
-    if isinstance(task_fs, str):
-        with open(os.path.join(task_fs, path), "r", encoding="utf-8") as handle:
-            return handle.read()
+    return None
 
-    fspath = getattr(task_fs, "__fspath__", None)
-    if callable(fspath):
-        with open(os.path.join(os.fspath(task_fs), path), "r", encoding="utf-8") as handle:
+
+def _as_bytes(data: Any) -> bytes:
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, bytearray):
+        return bytes(data)
+    return str(data).encode("utf-8")
+
+
+def _reader_get(method_name: str) -> Callable[[Any, str], bytes]:
+    def read(task_fs: Any, path: str) -> bytes:
+        data = getattr(task_fs, method_name)(path)
+        if hasattr(data, "read"):
+            data = data.read()
+        return _as_bytes(data)
+    return read
+
+
+def _reader_fd(method_name: str) -> Callable[[Any, str], bytes]:
+    def read(task_fs: Any, path: str) -> bytes:
+        handle = getattr(task_fs, method_name)(path)
+        try:
+            return _as_bytes(handle.read())
+        finally:
+            close = getattr(handle, "close", None)
+            if callable(close):
+                close()
+    return read
+
+
+def _reader_context(method_name: str) -> Callable[[Any, str], bytes]:
+    def read(task_fs: Any, path: str) -> bytes:
+        with getattr(task_fs, method_name)(path) as handle:
+            return _as_bytes(handle.read())
+    return read
+
+
+def _reader_sys_path(method_name: str) -> Callable[[Any, str], bytes]:
+    def read(task_fs: Any, path: str) -> bytes:
+        with open(getattr(task_fs, method_name)(path), "rb") as handle:
             return handle.read()
+    return read
+
+
+def _read_via_open(task_fs: Any, path: str) -> bytes:
+    error: Exception | None = None
+    for mode in ("rb", "r", "rt"):
+        try:
+            with task_fs.open(path, mode) as handle:
+                return _as_bytes(handle.read())
+        except Exception as exc:
+            error = exc
+    raise error if error is not None else OSError(path)
+
+
+def _read_via_root(task_fs: Any, path: str) -> bytes:
+    root_path = _task_fs_root(task_fs)
+    if root_path is None:
+        raise ValueError("Task filesystem has no root path.")
+    with open(os.path.join(root_path, path), "rb") as handle:
+        return handle.read()
+
+
+def _read_via_str(task_fs: Any, path: str) -> bytes:
+    with open(os.path.join(task_fs, path), "rb") as handle:
+        return handle.read()
+
+
+def _read_via_fspath(task_fs: Any, path: str) -> bytes:
+    with open(os.path.join(os.fspath(task_fs), path), "rb") as handle:
+        return handle.read()
+
+
+def _has_method(name: str) -> Callable[[Any], bool]:
+    return lambda task_fs: callable(getattr(task_fs, name, None))
+
+
+# Probed in order: (name, applies to this filesystem?, reader, keep probing when the reader fails?).
+_TASK_FILE_READERS: tuple[tuple[str, Callable[[Any], bool], Callable[[Any, str], bytes], bool], ...] = (
+    ("get", _has_method("get"), _reader_get("get"), True),
+    ("get_fd", _has_method("get_fd"), _reader_fd("get_fd"), True),
+    *((name, _has_method(name), _reader_get(name), False) for name in ("read", "read_file", "get_content")),
+    ("open", lambda task_fs: hasattr(task_fs, "open"), _read_via_open, True),
+    *((name, _has_method(name), _reader_context(name), False) for name in (
+        "opentext", "open_text", "openbin", "open_bin"
+    )),
+    *((name, _has_method(name), _reader_sys_path(name), False) for name in (
+        "get_path", "get_absolute_path", "realpath", "getsyspath", "get_sys_path"
+    )),
+    ("root", lambda task_fs: _task_fs_root(task_fs) is not None, _read_via_root, False),
+    ("str", lambda task_fs: isinstance(task_fs, str), _read_via_str, False),
+    ("fspath", _has_method("__fspath__"), _read_via_fspath, False),
+)
+
+_TASK_FILE_READER_BY_TYPE: dict[type, Callable[[Any, str], bytes]] = {}
+
+
+def _probe_task_file(task_fs: Any, path: str) -> tuple[bytes, Callable[[Any, str], bytes]]:
+    for _name, applies, reader, keep_probing in _TASK_FILE_READERS:
+        if not applies(task_fs):
+            continue
+        try:
+            return reader(task_fs, path), reader
+        except Exception:
+            if not keep_probing:
+                raise
 
     raise ValueError(
         "Task filesystem does not expose a readable API for variants_file "
@@ -128,13 +182,78 @@ def _read_task_file(task_fs: Any, path: str) -> str:
     )
 
 
+def _read_task_file_bytes(task_fs: Any, path: str) -> bytes:
+    if task_fs is None:
+        raise ValueError("A variants_file was configured but no task filesystem is available.")
+
+    fs_type = type(task_fs)
+    reader = _TASK_FILE_READER_BY_TYPE.get(fs_type)
+    if reader is not None:
+        try:
+            return reader(task_fs, path)
+        except Exception:
+            pass
+
+    data, reader = _probe_task_file(task_fs, path)
+    _TASK_FILE_READER_BY_TYPE[fs_type] = reader
+    return data
+
+
+def _read_task_file(task_fs: Any, path: str) -> str:
+    return _read_task_file_bytes(task_fs, path).decode("utf-8")
+
+
+def _load_variants_file(task_fs: Any, path: str) -> list[dict[str, Any]]:
+    # Files are revalidated by mtime/size when the task filesystem maps to a local directory.
+    # Other filesystems are content-addressed: the bytes are still read, but parsing is skipped.
+    signature = _task_file_signature(task_fs, path) if task_fs is not None else None
+    if signature is not None:
+        key, stamp = signature
+        cached = _VARIANTS_CACHE.get(key, valid=lambda entry: entry[0] == stamp)
+        if cached is not None:
+            return cached[1]
+
+    raw = _read_task_file_bytes(task_fs, path)
+    if signature is None:
+        key = "sha256:" + hashlib.sha256(raw).hexdigest()
+        cached = _VARIANTS_CACHE.get(key)
+        if cached is not None:
+            return cached[1]
+        stamp = None
+
+    variants = load_variants_payload(json.loads(raw))
+    _VARIANTS_CACHE.put(key, (stamp, variants), weight=len(raw))
+    return variants
+
+
+def configure_variants_cache(max_bytes: int | None = None, max_entries: int | None = None) -> None:
+    _VARIANTS_CACHE.resize(maxsize=max_entries, max_weight=max_bytes)
+
+
+def variants_cache_stats() -> dict[str, Any]:
+    return _VARIANTS_CACHE.stats()
+
+
+def clear_variants_cache() -> None:
+    _VARIANTS_CACHE.clear()
+
+
 def load_variants(problem_content: Any, task_fs: Any = None) -> list[dict[str, Any]]:
+    """Return the normalized variants of a problem.
+
+    Variants read from a variants_file come from a process-wide cache and are shared between
+    callers, so they must not be mutated.
+    """
+    with _LOAD_VARIANTS_SECONDS.time():
+        return _load_variants(problem_content, task_fs)
+
+
+def _load_variants(problem_content: Any, task_fs: Any) -> list[dict[str, Any]]:
     data = coerce_problem_mapping(problem_content)
     variants: list[dict[str, Any]] = []
 
     if data.get("variants_file"):
-        payload = json.loads(_read_task_file(task_fs, data["variants_file"]))
-        variants.extend(load_variants_payload(payload))
+        variants.extend(_load_variants_file(task_fs, data["variants_file"]))
 
     if data.get("variants"):
         variants.extend(load_variants_payload(data["variants"]))
@@ -168,8 +287,9 @@ def select_variant_index(problem_content: Any, task_fs: Any = None, seed: str |
 
 
 def build_variant(problem_content: Any, task_fs: Any = None, seed: str | None = None,
-                  submitted_variant: Any = None) -> dict[str, Any]:
-    variants = load_variants(problem_content, task_fs)
+                  submitted_variant: Any = None, variants: list[dict[str, Any]] | None = None) -> dict[str, Any]:
+    if variants is None:
+        variants = load_variants(problem_content, task_fs)
     data = coerce_problem_mapping(problem_content)
     return build_variant_record(
         variants,
@@ -275,7 +395,7 @@ class ClozeProblem(Problem):
             self._get_problem_input_str(task_input)
         )
         variant = self._current_variant(answers)
-        result = grade_answers(variant["solutions"], answers)
+        result = grade_answers(variant["solutions"], answers, plan=variant.get("grading_plan"), details=True)
 
         if result["valid"]:
             return True, "Correct. You got {}/{} blanks right.".format(result["correct"], result["total"]), [], 0, {
@@ -288,14 +408,11 @@ class ClozeProblem(Problem):
             "Some answers are incorrect. You got {}/{} blanks right.".format(result["correct"], result["total"])
         )
         secondary = []
-        for slot in variant["slots"]:
-            answer = (answers.get(slot) or "").strip()
-            if not answer:
-                secondary.append("Blank {}: missing answer.".format(slot))
-                continue
-            slot_result = grade_answers({slot: variant["solutions"][slot]}, {slot: answer})
-            if not slot_result["valid"]:
-                secondary.append("Blank {}: incorrect.".format(slot))
+        for slot_result in result["slots"]:
+            if slot_result["missing"]:
+                secondary.append("Blank {}: missing answer.".format(slot_result["slot"]))
+            elif slot_result["score"] < 1.0:
+                secondary.append("Blank {}: incorrect.".format(slot_result["slot"]))
 
         return False, main, secondary, result["errors"], {
             "variant": variant["index"],
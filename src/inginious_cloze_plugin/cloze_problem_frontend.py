@@ -3,7 +3,9 @@ from __future__ import annotations
 
 import html
 import json
-import re
+import os
+from typing import Any
+from urllib.parse import quote
 from uuid import uuid4
 
 try:
@@ -18,9 +20,88 @@ except ModuleNotFoundError:  # pragma: no cover - local tests without INGInious
         def get_id(self):
             return self._id
 
-from .cloze_problem_backend import ClozeProblem, build_variant, expected_slots_from_text, load_variants
+from .cloze_cache import LRUCache
+from .cloze_core import parse_variant_selection, redact_variant, tokenize_cloze
+from .cloze_metrics import histogram
+from .cloze_problem_backend import ClozeProblem, _task_fs_root, build_variant, load_variants
+from .pages import PLUGIN_ROUTE, json_script_tag, script_root, script_tag, stylesheet_tag
+
+PROMPT_CACHE_SIZE = 1024
+
+_LAZY_VARIANTS = False
+_PROMPT_CACHE = LRUCache(PROMPT_CACHE_SIZE)
+_UNIQ_PLACEHOLDER = "\x00uniq\x00"
+_SHOW_INPUT_SECONDS = histogram("cloze_show_input_duration_seconds", "Time to render a cloze problem for a student.")
+
+
+def configure_frontend(lazy_variants: bool | None = None, prompt_cache_size: int | None = None) -> None:
+    global _LAZY_VARIANTS
+    if lazy_variants is not None:
+        _LAZY_VARIANTS = bool(lazy_variants)
+    if prompt_cache_size is not None:
+        _PROMPT_CACHE.resize(maxsize=prompt_cache_size)
+
+
+def _render_prompt_template(text, tokens=None) -> str:
+    parts = []
+
+    for token in tokens if tokens is not None else tokenize_cloze(text):
+        if not token.is_blank:
+            parts.append(token.text)
+            continue
+
+        slot = token.slot
+        input_type = "text"
+        step_attr = ""
+        if token.kind == "NUMERICAL":
+            input_type = "number"
+            step_attr = ' step="any"'
+
+        label_text = "Blank {}".format(slot)
+        parts.append(
+            '<span class="cloze-slot-wrapper" style="display:inline-block; min-width:140px; vertical-align:middle; margin:0 4px;">'
+            '<input type="{input_type}" class="form-control cloze-input" '
+            'data-slot="{slot}" id="{element_id}" aria-label="{label_text}"{step_attr} '
+            'style="display:block; width:100%; min-width:140px; vertical-align:middle;">'
+            '<span class="cloze-slot-feedback text-muted" data-slot-feedback="{slot}" aria-live="polite" '
+            'style="display:block; font-size:0.85em; margin-top:4px;"></span>'
+            '</span>'.format(
+                input_type=input_type,
+                slot=html.escape(slot),
+                element_id=_UNIQ_PLACEHOLDER + html.escape("_slot_{}".format(slot)),
+                label_text=html.escape(label_text),
+                step_attr=step_attr,
+            )
+        )
+
+    return "".join(parts)
+
+
+def prompt_cache_stats() -> dict[str, Any]:
+    return _PROMPT_CACHE.stats()
+
+
+def clear_prompt_cache() -> None:
+    _PROMPT_CACHE.clear()
+
+
+def task_route_ids(task_fs) -> tuple[str, str] | None:
+    root_path = _task_fs_root(task_fs)
+    if root_path is None:
+        return None
+    parts = [part for part in os.path.normpath(root_path).split(os.sep) if part]
+    if len(parts) < 2:
+        return None
+    return parts[-2], parts[-1]
 
-_TOKEN_RE = re.compile(r"\{(\d+):(SHORTANSWER|NUMERICAL|MULTICHOICE):((?:\\.|[^}])*)\}")
+
+def variants_endpoint_url(task_fs, problem_id) -> str | None:
+    ids = task_route_ids(task_fs)
+    if ids is None:
+        return None
+    return "{}{}/variants/{}/{}/{}".format(
+        script_root(), PLUGIN_ROUTE, quote(ids[0], safe=""), quote(ids[1], safe=""), quote(str(problem_id), safe="")
+    )
 
 
 class DisplayableClozeProblem(ClozeProblem, DisplayableProblem):
@@ -88,59 +169,44 @@ class DisplayableClozeProblem(ClozeProblem, DisplayableProblem):
     def get_type_name(cls, language):
         return "Cloze"
 
-    def _render_prompt_with_inputs(self, text, uniq_prefix):
-        parts = []
-        last = 0
-
-        for match in _TOKEN_RE.finditer(text or ""):
-            parts.append((text or "")[last:match.start()])
-
-            slot = match.group(1)
-            kind = match.group(2)
-            input_type = "text"
-            step_attr = ""
-            if kind == "NUMERICAL":
-                input_type = "number"
-                step_attr = ' step="any"'
-
-            label_text = "Blank {}".format(slot)
-            parts.append(
-                '<span class="cloze-slot-wrapper" style="display:inline-block; min-width:140px; vertical-align:middle; margin:0 4px;">'
-                '<input type="{input_type}" class="form-control cloze-input" '
-                'data-slot="{slot}" id="{element_id}" aria-label="{label_text}"{step_attr} '
-                'style="display:block; width:100%; min-width:140px; vertical-align:middle;">'
-                '<span class="cloze-slot-feedback text-muted" data-slot-feedback="{slot}" aria-live="polite" '
-                'style="display:block; font-size:0.85em; margin-top:4px;"></span>'
-                '</span>'.format(
-                    input_type=input_type,
-                    slot=html.escape(slot),
-                    element_id=html.escape("{}_slot_{}".format(uniq_prefix, slot)),
-                    label_text=html.escape(label_text),
-                    step_attr=step_attr,
-                )
-            )
-            last = match.end()
-
-        parts.append((text or "")[last:])
-        return "".join(parts)
+    def _render_prompt_with_inputs(self, text, uniq_prefix, tokens=None):
+        # The markup only depends on the text; the per-page prefix is substituted afterwards.
+        template = _PROMPT_CACHE.get(text)
+        if template is None:
+            template = _render_prompt_template(text, tokens)
+            _PROMPT_CACHE.put(text, template)
+        return template.replace(_UNIQ_PLACEHOLDER, html.escape(uniq_prefix))
 
     def show_input(self, template_helper, language, seed):
+        with _SHOW_INPUT_SECONDS.time():
+            return self._show_input()
+
+    def _show_input(self):
         pid = self.get_id()
         load_error = None
         try:
             variants = load_variants(self._data, self._task_fs)
-            default_variant = build_variant(self._data, self._task_fs, seed=None)
+            default_variant = build_variant(self._data, self._task_fs, seed=None, variants=variants)
         except Exception as exc:
             load_error = str(exc)
             fallback_data = dict(self._data)
             fallback_data["variants_file"] = ""
             variants = load_variants(fallback_data, self._task_fs)
-            default_variant = build_variant(fallback_data, self._task_fs, seed=None)
+            default_variant = build_variant(fallback_data, self._task_fs, seed=None, variants=variants)
         uniq = "cloze_{}_{}".format(pid, uuid4().hex)
 
-        variant_payload = json.dumps(variants)
+        variants_url = None
+        if _LAZY_VARIANTS and not load_error:
+            variants_url = variants_endpoint_url(self._task_fs, pid)
+        if variants_url is None:
+            variant_payload = variants
+        else:
+            # Only the rendered selection ships with the page, without answer keys; other
+            # variants (e.g. when reviewing an older submission) are fetched on demand.
+            selected = parse_variant_selection(default_variant["selection"], len(variants))
+            variant_payload = {str(index): redact_variant(variants[index]) for index in selected}
 
-        prompt_html = self._render_prompt_with_inputs(default_variant["text"], uniq)
+        prompt_html = self._render_prompt_with_inputs(default_variant["text"], uniq, default_variant.get("tokens"))
         if load_error:
             prompt_html = (
                 '<div class="alert alert-warning" role="alert">'
@@ -159,664 +225,18 @@ class DisplayableClozeProblem(ClozeProblem, DisplayableProblem):
             value=html.escape(json.dumps({"__variant": default_variant["selection"]})),
         )
 
-        script = """
-<script>
-(function() {{
-  window.__clozeProblemInstances = window.__clozeProblemInstances || {{}};
-
-  var hidden = document.getElementById("{uniq}_json");
-  if (!hidden) return;
-
-  var variants = {variants_json};
-  var problemCount = {problem_count};
-  var tokenRe = /\\{{(\\d+):(SHORTANSWER|NUMERICAL|MULTICHOICE):((?:\\\\.|[^}}])*)\\}}/g;
-  var textRoot = document.getElementById("{uniq}_text");
-  var titleRoot = document.getElementById("{uniq}_title");
-  var lastHiddenValue = hidden.value;
-  var lastInlineFeedback = null;
-
-  function escapeHtml(value) {{
-    return String(value)
-      .replace(/&/g, "&amp;")
-      .replace(/</g, "&lt;")
-      .replace(/>/g, "&gt;")
-      .replace(/"/g, "&quot;")
-      .replace(/'/g, "&#39;");
-  }}
-
-  function normalizeProblemCount(value) {{
-    var parsed = Number(value);
-    if (!Number.isFinite(parsed) || parsed < 1) {{
-      return 1;
-    }}
-    return Math.max(1, Math.floor(parsed));
-  }}
-
-  function parseSelection(selection) {{
-    var values = [];
-    if (Array.isArray(selection)) {{
-      values = selection;
-    }} else if (selection !== null && selection !== undefined) {{
-      if (typeof selection === "string") {{
-        var trimmed = selection.trim();
-        if (!trimmed) {{
-          values = [];
-        }} else {{
-          try {{
-            var parsed = JSON.parse(trimmed);
-            if (Array.isArray(parsed)) {{
-              values = parsed;
-            }} else {{
-              values = trimmed.split(",");
-            }}
-          }} catch (err) {{
-            values = trimmed.split(",");
-          }}
-        }}
-      }} else {{
-        values = [selection];
-      }}
-    }}
-
-    var unique = [];
-    var seen = {{}};
-    values.forEach(function(value) {{
-      var index = Number(value);
-      if (!Number.isInteger(index) || index < 0 || index >= variants.length || seen[index]) {{
-        return;
-      }}
-      seen[index] = true;
-      unique.push(index);
-    }});
-    return unique;
-  }}
-
-  function selectionToken(selection) {{
-    return selection.length === 1 ? String(selection[0]) : selection.join(",");
-  }}
-
-  function renumberSlots(text) {{
-    var nextSlot = 0;
-    tokenRe.lastIndex = 0;
-    return String(text || "").replace(tokenRe, function (_, __, kind, rhs) {{
-      nextSlot += 1;
-      return '{{' + nextSlot + ':' + kind + ':' + rhs + '}}';
-    }});
-  }}
-
-  function composeVariant(selection) {{
-    var count = Math.min(normalizeProblemCount(problemCount), Math.max(variants.length, 1));
-    var indices = parseSelection(selection).slice(0, count);
-    if (!indices.length && variants.length) {{
-      indices = [0];
-    }}
-
-    var chosen = indices.map(function(index) {{
-      return variants[index];
-    }}).filter(Boolean);
-
-    var combinedText = chosen.map(function(variant, idx) {{
-      var parts = [];
-      if (chosen.length > 1 && variant.name) {{
-        parts.push('<p><strong>' + escapeHtml(variant.name) + '</strong></p>');
-      }}
-      parts.push(variant.text || '');
-      return '<div class="cloze-random-problem" data-cloze-variant-id="' +
-        escapeHtml(String(variant.id == null ? indices[idx] : variant.id)) + '">' +
-        parts.join('') +
-        '</div>';
-    }}).join('<hr class="cloze-random-problem-separator">');
-
-    if (chosen.length === 1) {{
-      combinedText = chosen[0].text || "";
-    }}
-
-    return {{
-      index: selectionToken(indices),
-      name: chosen.length === 1 ? chosen[0].name : null,
-      text: renumberSlots(combinedText)
-    }};
-  }}
-
-  function renderMultichoice(slot, rhs) {{
-    var options = rhs.split("~").map(function (item) {{
-      item = item.trim();
-      if (!item) return null;
-      if (item.charAt(0) === "=") {{
-        item = item.slice(1).trim();
-      }} else {{
-        var weightedMatch = item.match(/^%-?\\d+(?:\\.\\d+)?%(.*)$/);
-        if (weightedMatch) {{
-          item = weightedMatch[1].trim();
-        }}
-      }}
-      item = item.split("#", 1)[0].trim();
-      return item || null;
-    }}).filter(Boolean);
-
-    var labelText = 'Blank ' + slot;
-    var html = '<span class="cloze-slot-wrapper" style="display:inline-block; min-width:140px; vertical-align:middle; margin:0 4px;">';
-    html += '<select class="form-control cloze-input" data-slot="' + slot + '" id="{uniq}_slot_' + slot + '"' +
-      ' aria-label="' + escapeHtml(labelText) + '"' +
-      ' style="display:block; width:100%; min-width:140px; vertical-align:middle;">';
-    html += '<option value=""></option>';
-    options.forEach(function (option) {{
-      html += '<option value="' + escapeHtml(option) + '">' + escapeHtml(option) + '</option>';
-    }});
-    html += '</select>';
-    html += '<span class="cloze-slot-feedback text-muted" data-slot-feedback="' + escapeHtml(slot) + '" aria-live="polite" style="display:block; font-size:0.85em; margin-top:4px;"></span>';
-    html += '</span>';
-    return html;
-  }}
-
-  function clearInlineFeedback() {{
-    var feedbackNodes = textRoot.querySelectorAll('[data-slot-feedback]');
-    feedbackNodes.forEach(function(node) {{
-      node.textContent = '';
-    }});
-  }}
-
-  function renderInlineFeedback(feedbackMap) {{
-    clearInlineFeedback();
-    if (!feedbackMap || typeof feedbackMap !== "object") {{
-      lastInlineFeedback = null;
-      return;
-    }}
-    lastInlineFeedback = feedbackMap;
-    Object.keys(feedbackMap).forEach(function(slot) {{
-      var node = textRoot.querySelector('[data-slot-feedback="' + slot + '"]');
-      if (node) {{
-        var text = feedbackMap[slot] || '';
-        text = String(text).replace(/<[^>]*>/g, ' ').replace(/\\s+/g, ' ').trim();
-        node.textContent = text;
-      }}
-    }});
-  }}
-
-  function extractInlineMessage(problemMessage) {{
-    if (!problemMessage || typeof problemMessage !== "string") {{
-      return "";
-    }}
-    var message = problemMessage.replace(/<[^>]*>/g, ' ').replace(/\\s+/g, ' ').trim();
-    var summaryMatch = message.match(/^.*?You got \\d+\\/\\d+ blanks right\\.?(?:\\s+|$)(.*)$/);
-    if (summaryMatch) {{
-      return (summaryMatch[1] || "").trim();
-    }}
-    return "";
-  }}
-
-  function normalizeInlineFeedback(problemFeedback) {{
-    if (Array.isArray(problemFeedback)) {{
-      if (problemFeedback.length > 2 && problemFeedback[2] && typeof problemFeedback[2] === "object") {{
-        var mappedFeedback = problemFeedback[2];
-        if (Object.keys(mappedFeedback).length > 0) {{
-          return mappedFeedback;
-        }}
-      }}
-
-      var fallbackMessage = extractInlineMessage(problemFeedback[1]);
-      if (fallbackMessage) {{
-        var inputs = textRoot.querySelectorAll("input.cloze-input, select.cloze-input");
-        if (inputs.length === 1) {{
-          var onlySlot = inputs[0].getAttribute("data-slot");
-          if (onlySlot) {{
-            var fallbackMap = {{}};
-            fallbackMap[onlySlot] = fallbackMessage;
-            return fallbackMap;
-          }}
-        }}
-      }}
-      return null;
-    }}
-
-    if (problemFeedback && typeof problemFeedback === "object") {{
-      return Object.keys(problemFeedback).length > 0 ? problemFeedback : null;
-    }}
-
-    return null;
-  }}
-
-  function enhanceConvertedTables() {{
-    if (!textRoot) {{
-      return;
-    }}
-
-    var comparisonTables = textRoot.querySelectorAll('.cloze-converted-table');
-    comparisonTables.forEach(function(table) {{
-      if (table.dataset.clozeEnhanced === '1') {{
-        return;
-      }}
-
-      var rows = Array.prototype.slice.call(table.rows || []);
-      if (rows.length < 2) {{
-        return;
-      }}
-
-      var headerCells = Array.prototype.slice.call(rows[0].cells || []);
-      var headers = headerCells.map(function(cell) {{
-        return (cell.textContent || '').replace(/\\s+/g, ' ').trim().toLowerCase();
-      }});
-
-      if (headers.length === 2 && headers[0] === 'tlb' && headers[1] === 'page table') {{
-        var contentCells = Array.prototype.slice.call(rows[1].cells || []);
-        if (contentCells.length === 2) {{
-          var wrapper = document.createElement('div');
-          wrapper.className = 'cloze-comparison-sections';
-
-          ['TLB', 'Page Table'].forEach(function(title, index) {{
-            var section = document.createElement('section');
-            section.className = 'cloze-comparison-section';
-
-            var heading = document.createElement('h4');
-            heading.className = 'cloze-comparison-heading';
-            heading.textContent = title;
-            section.appendChild(heading);
-
-            var body = document.createElement('div');
-            body.className = 'cloze-comparison-body';
-            body.innerHTML = contentCells[index].innerHTML;
-            section.appendChild(body);
-            wrapper.appendChild(section);
-          }});
-
-          table.dataset.clozeEnhanced = '1';
-          table.parentNode.replaceChild(wrapper, table);
-        }}
-      }}
-    }});
-
-    textRoot.querySelectorAll('.cloze-converted-table').forEach(function(table) {{
-      var text = (table.textContent || '').replace(/\\s+/g, ' ').trim();
-      if (table.querySelector('.cloze-input')) {{
-        table.classList.add('cloze-answer-table');
-      }}
-      if (/Tag=|PPN=|VPN|Way #|Set #|Page Table|TLB|Data =/.test(text)) {{
-        table.classList.add('cloze-data-table');
-      }}
-    }});
-  }}
-
-  function collect() {{
-    var current = {{}};
-    try {{
-      current = JSON.parse(hidden.value || "{{}}");
-    }} catch (err) {{
-      current = {{}};
-    }}
-
-    var inputs = document.querySelectorAll('input.cloze-input[id^="{uniq}_slot_"]');
-    var selects = document.querySelectorAll('select.cloze-input[id^="{uniq}_slot_"]');
-    inputs.forEach(function(inp) {{
-      current[inp.getAttribute("data-slot")] = inp.value;
-    }});
-    selects.forEach(function(inp) {{
-      current[inp.getAttribute("data-slot")] = inp.value;
-    }});
-    hidden.value = JSON.stringify(current);
-    lastHiddenValue = hidden.value;
-    return current;
-  }}
-
-  function renderVariant(index, current) {{
-    var variant = composeVariant(index);
-    if (!variant || !textRoot) return;
-
-    if (!current) {{
-      try {{
-        current = JSON.parse(hidden.value || "{{}}");
-      }} catch (err) {{
-        current = {{}};
-      }}
-    }}
-    current.__variant = String(variant.index);
-
-    if (titleRoot && variant.name) {{
-      titleRoot.textContent = variant.name;
-    }}
-
-    var text = variant.text || "";
-    textRoot.innerHTML = text.replace(tokenRe, function (_, slot, kind, rhs) {{
-      if (kind === "MULTICHOICE") {{
-        return renderMultichoice(slot, rhs);
-      }}
-      var inputType = kind === "NUMERICAL" ? "number" : "text";
-      var stepAttr = inputType === "number" ? ' step="any"' : "";
-      var labelText = 'Blank ' + slot;
-      return '<span class="cloze-slot-wrapper" style="display:inline-block; min-width:140px; vertical-align:middle; margin:0 4px;">' +
-        '<input type="' + inputType + '" class="form-control cloze-input" data-slot="' + slot + '"' +
-        ' id="{uniq}_slot_' + slot + '" aria-label="' + escapeHtml(labelText) + '"' + stepAttr +
-        ' style="display:block; width:100%; min-width:140px; vertical-align:middle;">' +
-        '<span class="cloze-slot-feedback text-muted" data-slot-feedback="' + escapeHtml(slot) + '" aria-live="polite" style="display:block; font-size:0.85em; margin-top:4px;"></span>' +
-        '</span>';
-    }});
-
-    var inputs = textRoot.querySelectorAll("input.cloze-input, select.cloze-input");
-    inputs.forEach(function(input) {{
-      var slot = input.getAttribute("data-slot");
-      input.value = current[slot] || "";
-    }});
-
-    hidden.value = JSON.stringify(current);
-    lastHiddenValue = hidden.value;
-    enhanceConvertedTables();
-    clearInlineFeedback();
-    if (lastInlineFeedback) {{
-      renderInlineFeedback(lastInlineFeedback);
-    }}
-  }}
-
-  function normalizeAnswers(rawValue) {{
-    if (!rawValue) {{
-      return {{}};
-    }}
-    if (typeof rawValue === "string") {{
-      try {{
-        rawValue = JSON.parse(rawValue);
-      }} catch (err) {{
-        return {{}};
-      }}
-    }}
-    if (Array.isArray(rawValue)) {{
-      for (var i = 0; i < rawValue.length; i += 1) {{
-        var nested = normalizeAnswers(rawValue[i]);
-        if (Object.keys(nested).length > 0) {{
-          return nested;
-        }}
-      }}
-      return {{}};
-    }}
-    if (!rawValue || typeof rawValue !== "object") {{
-      return {{}};
-    }}
-    var wrapperKeys = ["value", "answer", "data", "raw"];
-    for (var j = 0; j < wrapperKeys.length; j += 1) {{
-      if (Object.prototype.hasOwnProperty.call(rawValue, wrapperKeys[j])) {{
-        var unwrapped = normalizeAnswers(rawValue[wrapperKeys[j]]);
-        if (Object.keys(unwrapped).length > 0) {{
-          return unwrapped;
-        }}
-      }}
-    }}
-    var normalized = {{}};
-    Object.keys(rawValue).forEach(function (key) {{
-      var value = rawValue[key];
-      normalized[String(key)] = value == null ? "" : String(value);
-    }});
-    return normalized;
-  }}
-
-  function getVariantFromState() {{
-    if (!window.input || !window.input['@state']) {{
-      return null;
-    }}
-    try {{
-      var parsedState = window.input['@state'];
-      if (typeof parsedState === "string") {{
-        parsedState = JSON.parse(parsedState);
-      }}
-      if (parsedState && parsedState["{pid}"] && parsedState["{pid}"].variant !== undefined) {{
-        return parsedState["{pid}"].variant;
-      }}
-    }} catch (err) {{
-      return null;
-    }}
-    return null;
-  }}
-
-  function setAnswers(rawValue) {{
-    var current = normalizeAnswers(rawValue);
-    var variantIndex = current.__variant;
-    if (variantIndex === undefined || variantIndex === null || variantIndex === "") {{
-      variantIndex = getVariantFromState();
-    }}
-    if (variantIndex === undefined || variantIndex === null || variantIndex === "") {{
-      variantIndex = {default_index};
-    }}
-    renderVariant(variantIndex, current);
-  }}
-
-  var instance = {{
-    collect: collect,
-    setAnswers: setAnswers
-  }};
-  window.__clozeProblemInstances["{pid}"] = instance;
-
-  window.load_input_cloze = function (submissionId, problemId, allInputs) {{
-    var target = window.__clozeProblemInstances[String(problemId)];
-    if (target) {{
-      var rawValue = allInputs && Object.prototype.hasOwnProperty.call(allInputs, problemId) ? allInputs[problemId] : null;
-      target.setAnswers(rawValue);
-    }}
-  }};
-
-  window.load_feedback_cloze = function (problemId, rawFeedback) {{
-    var target = window.__clozeProblemInstances[String(problemId)];
-    if (!target) {{
-      return;
-    }}
-    renderInlineFeedback(normalizeInlineFeedback(rawFeedback));
-  }};
-
-  var initialAnswers = {{}};
-  if (window.input && Object.prototype.hasOwnProperty.call(window.input, "{pid}")) {{
-    initialAnswers = normalizeAnswers(window.input["{pid}"]);
-    if (Object.keys(initialAnswers).length > 0) {{
-      setAnswers(initialAnswers);
-      return;
-    }}
-  }}
-
-  var variantIndex = {default_index};
-  if (normalizeProblemCount(problemCount) <= 1 && window.input && Array.isArray(window.input['@random']) && window.input['@random'].length > 0) {{
-    var numeric = Number(window.input['@random'][0]);
-    if (!Number.isNaN(numeric) && variants.length > 0) {{
-      variantIndex = Math.floor(Math.abs(numeric) * variants.length) % variants.length;
-    }}
-  }}
-
-  document.addEventListener("input", function(ev) {{
-    if (ev.target && ev.target.classList && ev.target.classList.contains("cloze-input")
-        && ev.target.id.indexOf("{uniq}_slot_") === 0) {{
-      collect();
-    }}
-  }});
-
-  var form = hidden.closest("form");
-  if (form) {{
-    form.addEventListener("submit", function() {{
-      collect();
-    }});
-  }}
-
-  window.setInterval(function () {{
-    if (hidden.value !== lastHiddenValue) {{
-      setAnswers(hidden.value);
-    }}
-  }}, 250);
-
-  renderVariant(variantIndex);
-}})();
-</script>
-""".format(
-            uniq=uniq,
-            pid=pid,
-            variants_json=variant_payload,
-            default_index=json.dumps(default_variant["selection"]),
-            problem_count=json.dumps(self._data.get("random_problem_count", "")),
-        )
+        config = json_script_tag({
+            "uniq": uniq,
+            "pid": pid,
+            "variants": variant_payload,
+            "variantCount": len(variants),
+            "variantsUrl": variants_url,
+            "defaultIndex": default_variant["selection"],
+            "problemCount": self._data.get("random_problem_count", ""),
+        }, data_cloze_problem=pid)
 
         return """
-<style>
-  .cloze-problem .cloze-text-scroll {{
-    overflow-x: auto;
-    overflow-y: visible;
-    -webkit-overflow-scrolling: touch;
-  }}
-
-  .cloze-problem .cloze-text {{
-    line-height: 2.2;
-    min-width: max-content;
-  }}
-
-  .cloze-problem .cloze-text p,
-  .cloze-problem .cloze-text li {{
-    font-size: 16px;
-    line-height: 1.65;
-  }}
-
-  .cloze-problem .cloze-text ul {{
-    padding-left: 28px;
-    margin: 12px 0 20px;
-  }}
-
-  .cloze-problem .cloze-text li {{
-    margin-bottom: 10px;
-  }}
-
-  .cloze-problem .cloze-text table {{
-    max-width: none;
-  }}
-
-  .cloze-problem .cloze-text .cloze-converted-table {{
-    border-collapse: collapse;
-    margin: 20px 0;
-    width: auto !important;
-    max-width: none;
-    table-layout: auto;
-    background: #fff;
-    border: 1px solid #cfd8e3;
-    box-shadow: 0 1px 2px rgba(15, 23, 42, 0.06);
-  }}
-
-  .cloze-problem .cloze-text .cloze-data-table {{
-    font-family: ui-monospace, SFMono-Regular, Menlo, Monaco, Consolas, "Liberation Mono", "Courier New", monospace;
-    font-size: 14px;
-  }}
-
-  .cloze-problem .cloze-text .cloze-converted-table td,
-  .cloze-problem .cloze-text .cloze-converted-table th {{
-    padding: 10px 12px;
-    font-size: 15px;
-    line-height: 1.45;
-    vertical-align: top;
-    white-space: nowrap;
-    border: 1px solid #dbe3ec;
-  }}
-
-  .cloze-problem .cloze-text .cloze-converted-table th {{
-    background: #f6f8fb;
-    font-weight: 600;
-    text-align: center;
-  }}
-
-  .cloze-problem .cloze-text .cloze-converted-table td:first-child,
-  .cloze-problem .cloze-text .cloze-converted-table th:first-child {{
-    text-align: left;
-  }}
-
-  .cloze-problem .cloze-text .cloze-converted-table td > .cloze-converted-table {{
-    margin: 0;
-    box-shadow: none;
-  }}
-
-  .cloze-problem .cloze-text .cloze-answer-table {{
-    font-family: inherit;
-  }}
-
-  .cloze-problem .cloze-text .cloze-answer-table td:first-child {{
-    font-weight: 600;
-    white-space: normal;
-    min-width: 220px;
-    background: #fbfcfe;
-  }}
-
-  .cloze-problem .cloze-text .cloze-converted-table .cloze-input {{
-    min-width: 88px;
-  }}
-
-  .cloze-problem .cloze-text .cloze-converted-code {{
-    margin: 16px 0;
-    padding: 14px 16px;
-    border: 1px solid #d9dee3;
-    border-radius: 6px;
-    background: #f8fafc;
-    line-height: 1.5;
-  }}
-
-  .cloze-problem .cloze-text .cloze-converted-break {{
-    display: block;
-    height: 12px;
-  }}
-
-  .cloze-problem .cloze-text .cloze-cache-meta {{
-    font-family: ui-monospace, SFMono-Regular, Menlo, Monaco, Consolas, "Liberation Mono", "Courier New", monospace;
-    font-size: 14px;
-    line-height: 1.45;
-  }}
-
-  .cloze-problem .cloze-text .cloze-cache-bytes {{
-    margin: 8px 0 0;
-    white-space: pre-wrap;
-    font-size: 14px;
-    line-height: 1.6;
-  }}
-
-  .cloze-problem .cloze-text .cloze-comparison-sections {{
-    display: flex;
-    flex-direction: column;
-    gap: 20px;
-    margin: 20px 0 24px;
-  }}
-
-  .cloze-problem .cloze-text .cloze-comparison-section {{
-    display: block;
-  }}
-
-  .cloze-problem .cloze-text .cloze-comparison-heading {{
-    margin: 0 0 10px;
-    font-size: 18px;
-    font-weight: 700;
-    line-height: 1.3;
-  }}
-
-  .cloze-problem .cloze-text .cloze-comparison-body {{
-    display: block;
-  }}
-
-  .cloze-problem .cloze-random-problem {{
-    display: block;
-    width: 100%;
-    clear: both;
-    margin: 0 0 24px;
-  }}
-
-  .cloze-problem .cloze-random-problem > *:first-child {{
-    margin-top: 0;
-  }}
-
-  .cloze-problem .cloze-random-problem > *:last-child {{
-    margin-bottom: 0;
-  }}
-
-  .cloze-problem .cloze-random-problem-separator {{
-    display: block;
-    width: 100%;
-    clear: both;
-    border: 0;
-    border-top: 1px solid #ddd;
-    margin: 20px 0 24px;
-  }}
-
-  @media (max-width: 767px) {{
-    .cloze-problem .cloze-slot-wrapper {{
-      min-width: 96px !important;
-    }}
-
-    .cloze-problem .cloze-input {{
-      min-width: 96px !important;
-    }}
-  }}
-</style>
+{stylesheet}
 <div class="panel panel-default cloze-problem">
   <div class="panel-heading" id="{uniq}_title">{label}</div>
   <div class="panel-body">
@@ -826,13 +246,16 @@ class DisplayableClozeProblem(ClozeProblem, DisplayableProblem):
     {hidden}
   </div>
 </div>
+{config}
 {script}
 """.format(
+            stylesheet=stylesheet_tag("cloze_problem.css"),
             uniq=html.escape(uniq),
             label=label,
             prompt_html=prompt_html,
             hidden=hidden,
-            script=script,
+            config=config,
+            script=script_tag("cloze_problem.js"),
         )
 
     def input_is_consistent(self, task_input, default_allowed_extension=None, default_max_size=None):
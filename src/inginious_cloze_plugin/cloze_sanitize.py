@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import re
+
+# One scanner over the HTML. It only stops at constructs a rule applies to: style blocks,
+# shorthand cloze tokens (matched before tags so that answers containing markup stay whole), and
+# tags that are removed, rewritten or collapsed. Everything in between is copied as is.
+_TOKEN_RE = re.compile(
+    r"(?=[<{])(?:(?P<style>(?is:<style\b[^>]*>.*?</style>))"
+    r"|(?P<cloze>\{:(?P<kind>MC|MCH|NM|SA):?(?P<rhs>(?:\\.|[^{}])*)\})"
+    r"|(?P<tag>(?i:</?p>|</span>|<br\s*/?>|<(?:table|pre)\b[^<>]*>"
+    r"|<[^<>]*?(?:\salign=|\swidth=|\sheight=|\{:)[^<>]*>)))"
+)
+_CLOZE_SHORTHAND_RE = re.compile(r"\{:(MC|MCH|NM|SA):?((?:\\.|[^{}])*)\}")
+_ALIGN_LEFT_RE = re.compile(r'\salign="left"', re.IGNORECASE)
+_FULL_WIDTH_RE = re.compile(r'\swidth=(["\'])?100%\1?', re.IGNORECASE)
+_DIMENSION_RE = re.compile(r'\s(width|height)="[^"]*"', re.IGNORECASE)
+_BR_RE = re.compile(r"<br\s*/?>", re.IGNORECASE)
+_TABLE_RE = re.compile(r"<table\b([^>]*)>", re.IGNORECASE)
+_PRE_RE = re.compile(r"<pre\b([^>]*)>", re.IGNORECASE)
+_CLASS_ATTR_RE = re.compile(r'class="([^"]*)"', re.IGNORECASE)
+
+_SHORTHAND_KINDS = {
+    "MC": "MULTICHOICE",
+    "MCH": "MULTICHOICE",
+    "NM": "NUMERICAL",
+    "SA": "SHORTANSWER",
+}
+_BREAK_HTML = '<div class="cloze-converted-break"></div>'
+# Repeated paragraph tags collapse pairwise, like a left-to-right substitution would.
+_COLLAPSIBLE_TAGS = {"<p>": "<p>", "</p>": "</p>"}
+# Bare tags that need no attribute rewriting, looked up before the general tag rewrite.
+_SIMPLE_TAGS = {"<p>": "<p>", "</p>": "</p>", "</span>": None, "<br>": _BREAK_HTML, "<br/>": _BREAK_HTML}
+
+
+def append_html_class(attrs: str, class_name: str) -> str:
+    class_match = _CLASS_ATTR_RE.search(attrs)
+    if class_match:
+        existing = class_match.group(1).strip()
+        replacement = 'class="{} {}"'.format(existing, class_name).strip()
+        return attrs[:class_match.start()] + replacement + attrs[class_match.end():]
+    return '{} class="{}"'.format(attrs, class_name)
+
+
+def _expand_shorthand(kind: str, rhs: str) -> str:
+    return "{1:%s:%s}" % (_SHORTHAND_KINDS[kind.upper()], rhs.strip())
+
+
+def normalize_moodle_cloze_tokens(text: str) -> str:
+    return _CLOZE_SHORTHAND_RE.sub(lambda match: _expand_shorthand(match.group(1), match.group(2)), text)
+
+
+def _rewrite_tag(tag: str) -> str | None:
+    lowered = tag.lower()
+    if lowered == "</span>":
+        return None
+    if "align" in lowered:
+        tag = _ALIGN_LEFT_RE.sub("", tag)
+    if "width" in lowered or "height" in lowered:
+        tag = _DIMENSION_RE.sub("", _FULL_WIDTH_RE.sub("", tag))
+    if "{:" in tag:
+        tag = normalize_moodle_cloze_tokens(tag)
+    if _BR_RE.fullmatch(tag):
+        return _BREAK_HTML
+    match = _TABLE_RE.fullmatch(tag)
+    if match:
+        return "<table{}>".format(append_html_class(match.group(1), "cloze-converted-table"))
+    match = _PRE_RE.fullmatch(tag)
+    if match:
+        return "<pre{}>".format(append_html_class(match.group(1), "cloze-converted-code"))
+    return tag
+
+
+def _sanitize_fragment(text: str) -> str:
+    out: list[str] = []
+    collapse_at = -1
+    collapse_tag = None
+    position = 0
+
+    for match in _TOKEN_RE.finditer(text):
+        start = match.start()
+        if start > position:
+            gap = text[position:start]
+            if collapse_tag is not None and not gap.isspace():
+                collapse_tag = None
+            out.append(gap)
+        position = match.end()
+
+        group = match.lastgroup
+        if group == "style":
+            continue
+
+        if group == "cloze":
+            collapse_tag = None
+            out.append(_expand_shorthand(match.group("kind"), _sanitize_fragment(match.group("rhs"))))
+            continue
+
+        tag = match.group()
+        value = _SIMPLE_TAGS[tag] if tag in _SIMPLE_TAGS else _rewrite_tag(tag)
+        if value is None:
+            continue
+        canonical = _COLLAPSIBLE_TAGS.get(value.lower())
+        if canonical is not None and canonical == collapse_tag:
+            del out[collapse_at + 1:]
+            out[collapse_at] = canonical
+            collapse_tag = None
+            continue
+        collapse_at = len(out)
+        collapse_tag = canonical
+        out.append(value)
+
+    out.append(text[position:])
+    return "".join(out)
+
+
+def sanitize_moodle_html(text: str) -> str:
+    """Clean Moodle question HTML for cloze variants in a single pass over its tokens.
+
+    Drops style blocks, closing spans, left alignment and fixed sizes; collapses doubled
+    paragraph tags; turns line breaks into block spacers; expands shorthand cloze tokens
+    ({:SA:...}, {:NM:...}, {:MC:...}); and tags tables and preformatted blocks with the classes
+    the cloze stylesheet expects.
+    """
+    return _sanitize_fragment(text.strip())
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+from .cloze_metrics import gauge, histogram
+
+try:
+    from pymongo import UpdateOne
+except ModuleNotFoundError:  # pragma: no cover - pymongo is available on the target server
+    UpdateOne = None
+
+_LOGGER = logging.getLogger("inginious.webapp.plugin.cloze")
+_WRITE_SECONDS = histogram(
+    "cloze_user_tasks_write_duration_seconds", "Time of one user_tasks cache write to the database."
+)
+
+
+def _update_condition(submission: dict[str, Any], evaluation_mode: str | None) -> dict[str, Any]:
+    grade = submission.get("grade", 0.0)
+    # A missing grade on the cached entry counts as 0.0, as it does for INGInious itself.
+    best = [{"grade": {"$lte": grade}}]
+    if grade >= 0.0:
+        best.append({"grade": {"$exists": False}})
+    same_submission = [{"submissionid": None}, {"submissionid": submission["_id"]}]
+
+    if evaluation_mode == "last":
+        return {}
+    if evaluation_mode == "best":
+        return {"$or": best}
+    if evaluation_mode is None:
+        # Conservative heuristic for plugin-managed cloze tasks: update the cache unless it
+        # already points to a strictly better submission.
+        return {"$or": best + same_submission}
+    return {"$or": same_submission}
+
+
+def user_task_operations(submission: dict[str, Any], evaluation_mode: str | None) -> list[tuple[dict, dict, bool]]:
+    """Return the (filter, update, upsert) operations that sync the user_tasks cache.
+
+    Each user gets an upsert that only fills a missing entry, followed by a conditional update
+    that encodes the evaluation mode in its filter, so the database decides in one round-trip.
+    """
+    fields = {
+        "succeeded": submission.get("result") == "success",
+        "grade": submission.get("grade", 0.0),
+        "state": submission.get("state", ""),
+        "submissionid": submission["_id"],
+    }
+    condition = _update_condition(submission, evaluation_mode)
+
+    operations = []
+    for username in submission.get("username", []):
+        query = {"username": username, "courseid": submission["courseid"], "taskid": submission["taskid"]}
+        operations.append((query, {"$setOnInsert": dict(fields)}, True))
+        operations.append((dict(query, **condition), {"$set": dict(fields)}, False))
+    return operations
+
+
+def write_user_task_operations(collection, operations: list[tuple[dict, dict, bool]]) -> None:
+    if not operations:
+        return
+    with _WRITE_SECONDS.time():
+        bulk_write = getattr(collection, "bulk_write", None)
+        if UpdateOne is not None and callable(bulk_write):
+            bulk_write(
+                [UpdateOne(query, update, upsert=upsert) for query, update, upsert in operations],
+                ordered=True,
+            )
+            return
+        for query, update, upsert in operations:
+            collection.update_one(query, update, upsert=upsert)
+
+
+def _coalesce(pending: list[tuple[dict, str | None]], submission: dict, evaluation_mode: str | None):
+    # Only collapse updates whose combined effect is known without reading the database.
+    if pending and all(mode == evaluation_mode for _, mode in pending):
+        previous = pending[-1][0]
+        if evaluation_mode == "last":
+            return [(submission, evaluation_mode)]
+        if evaluation_mode == "best":
+            if previous.get("grade", 0.0) <= submission.get("grade", 0.0):
+                return [(submission, evaluation_mode)]
+            return pending
+        if evaluation_mode is not None:
+            # The first submission claims the entry; later ones cannot match its filter.
+            return pending
+    return pending + [(submission, evaluation_mode)]
+
+
+class UserTaskWriteBehind(object):
+    """Buffer user_tasks updates and flush them from a daemon thread.
+
+    Updates for the same (user, course, task) received within one flush interval are coalesced
+    when their combined effect does not depend on the stored entry.
+    """
+
+    def __init__(self, database, delay: float = 0.5):
+        self._database = database
+        self._delay = max(float(delay), 0.0)
+        self._pending: OrderedDict[tuple, list[tuple[dict, str | None]]] = OrderedDict()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self.flushes = 0
+        self.coalesced = 0
+
+    def submit(self, submission: dict[str, Any], evaluation_mode: str | None) -> None:
+        with self._condition:
+            for username in submission.get("username", []):
+                key = (username, submission["courseid"], submission["taskid"])
+                single = dict(submission, username=[username])
+                pending = self._pending.get(key, [])
+                merged = _coalesce(pending, single, evaluation_mode)
+                self.coalesced += len(pending) + 1 - len(merged)
+                self._pending[key] = merged
+            closed = self._closed
+            if not closed and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="cloze-user-tasks", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        if closed:
+            # A hook that fetched this writer just before it was replaced still gets its update written.
+            self.flush()
+
+    def pending(self) -> int:
+        with self._condition:
+            return sum(len(entries) for entries in self._pending.values())
+
+    def flush(self) -> None:
+        with self._condition:
+            pending, self._pending = self._pending, OrderedDict()
+        operations = []
+        for entries in pending.values():
+            for submission, evaluation_mode in entries:
+                operations.extend(user_task_operations(submission, evaluation_mode))
+        if operations:
+            write_user_task_operations(self._database.user_tasks, operations)
+            self.flushes += 1
+
+    def close(self) -> None:
+        """Stop the flush thread after writing whatever is still buffered."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self.flush()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+            # Let the burst accumulate so repeated submissions collapse into one write.
+            time.sleep(self._delay)
+            try:
+                self.flush()
+            except Exception:
+                _LOGGER.exception("Could not update the cloze user_tasks cache.")
+
+
+_WRITE_BEHIND: UserTaskWriteBehind | None = None
+
+
+def configure_write_behind(database, delay: float | None) -> UserTaskWriteBehind | None:
+    global _WRITE_BEHIND
+    delay = float(delay or 0.0)
+    writer = UserTaskWriteBehind(database, delay) if database is not None and delay > 0 else None
+    previous, _WRITE_BEHIND = _WRITE_BEHIND, writer
+    if previous is not None:
+        previous.close()
+    return writer
+
+
+def write_behind() -> UserTaskWriteBehind | None:
+    return _WRITE_BEHIND
+
+
+def _flush_write_behind() -> None:
+    writer = _WRITE_BEHIND
+    if writer is not None:
+        writer.flush()
+
+
+atexit.register(_flush_write_behind)
+
+
+def _pending_user_tasks() -> dict[tuple[str, ...], float]:
+    writer = _WRITE_BEHIND
+    return {(): writer.pending() if writer is not None else 0}
+
+
+gauge("cloze_user_tasks_pending", "user_tasks updates buffered by the write-behind queue.", function=_pending_user_tasks)
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+from typing import Any, Iterator, NamedTuple, TextIO
+
+from .cloze_core import build_variant_record, load_variants_payload
+
+BLANK_KINDS = ("SHORTANSWER", "NUMERICAL", "MULTICHOICE")
+OUTCOMES = ("correct", "partial", "wrong")
+
+_WORDS = (
+    "cache", "page", "frame", "offset", "tag", "index", "block", "line", "miss", "hit",
+    "valid", "dirty", "victim", "set", "way", "entry", "walk", "fault", "swap", "table",
+)
+
+
+class AnswerMix(NamedTuple):
+    """Share of blanks answered correctly, with partial credit, and wrongly."""
+
+    correct: float = 0.6
+    partial: float = 0.25
+    wrong: float = 0.15
+
+
+def parse_answer_mix(raw_value: str) -> AnswerMix:
+    parts = [float(part) for part in raw_value.split(",")]
+    if len(parts) != 3 or any(part < 0 for part in parts) or not sum(parts):
+        raise ValueError("An answer mix needs three non-negative weights: correct,partial,wrong.")
+    return AnswerMix(*parts)
+
+
+def parse_kind_weights(raw_value: str) -> dict[str, float]:
+    weights = {}
+    for item in raw_value.split(","):
+        kind, _, weight = item.partition("=")
+        kind = kind.strip().upper()
+        if kind not in BLANK_KINDS:
+            raise ValueError("Unknown blank kind {!r}; expected one of {}.".format(kind, ", ".join(BLANK_KINDS)))
+        weights[kind] = float(weight) if weight else 1.0
+    return weights
+
+
+def _shortanswer(rng: random.Random, slot: int) -> str:
+    answer = rng.choice(_WORDS)
+    aliases = [answer, answer.capitalize()]
+    if rng.random() < 0.5:
+        aliases.append(answer + "s")
+    near = answer[:-1] if len(answer) > 3 else answer + answer[-1]
+    return "{%d:SHORTANSWER:%s~%%50%%%s#Almost: check the spelling.}" % (slot, "|".join(aliases), near)
+
+
+def _numerical(rng: random.Random, slot: int) -> str:
+    if rng.random() < 0.5:
+        value = rng.randint(0, 65535)
+        return "{%d:NUMERICAL:=%d#Exact~%%50%%%d:%d#Off by a little}" % (slot, value, value, rng.randint(2, 16))
+    value = round(rng.uniform(0.0, 100.0), 2)
+    tolerance = round(rng.uniform(0.01, 0.1), 2)
+    return "{%d:NUMERICAL:=%s:%s~%%25%%%s:%s#Rounded too early}" % (slot, value, tolerance, value, round(tolerance * 20, 2))
+
+
+def _multichoice(rng: random.Random, slot: int) -> str:
+    correct, partial, *distractors = rng.sample(_WORDS, rng.randint(3, 6))
+    options = ["=%s#Yes" % correct, "%%50%%%s#Partly" % partial] + distractors
+    rng.shuffle(options)
+    return "{%d:MULTICHOICE:%s}" % (slot, "~".join(options))
+
+
+_BLANK_BUILDERS = {"SHORTANSWER": _shortanswer, "NUMERICAL": _numerical, "MULTICHOICE": _multichoice}
+
+
+def _blanks(rng: random.Random, count: int, kind_weights: dict[str, float]) -> list[str]:
+    kinds = list(kind_weights)
+    weights = [kind_weights[kind] for kind in kinds]
+    return [_BLANK_BUILDERS[kind](rng, slot) for slot, kind in enumerate(rng.choices(kinds, weights, k=count), 1)]
+
+
+def _prose(rng: random.Random, blanks: list[str]) -> str:
+    paragraphs = []
+    for start in range(0, len(blanks), 4):
+        sentences = [
+            "The {} of the {} {} is {}.".format(rng.choice(_WORDS), rng.choice(_WORDS), index, blank)
+            for index, blank in enumerate(blanks[start:start + 4], start + 1)
+        ]
+        paragraphs.append("<p>{}</p>".format(" ".join(sentences)))
+    return "".join(paragraphs)
+
+
+def _hex_bytes(rng: random.Random, count: int = 8) -> str:
+    return " ".join("{:02X}".format(rng.randrange(256)) for _ in range(count))
+
+
+def _cache_table(rng: random.Random, rows: int, blanks: list[str]) -> str:
+    # Same markup as convert_moodle_cache_xml output: meta lines and byte dumps inside table cells.
+    body = []
+    for row in range(rows):
+        tag = "0x{:04X}".format(rng.randrange(1 << 16))
+        cell = blanks[row] if row < len(blanks) else tag
+        body.append(
+            "<tr><td>{}</td><td>{}</td><td>{}</td><td>"
+            '<div class="cloze-cache-meta">Tag={} Valid={}</div>'
+            '<pre class="cloze-converted-code cloze-cache-bytes">{}\n{}</pre></td></tr>'.format(
+                row, rng.randint(0, 1), cell, tag, rng.randint(0, 1), _hex_bytes(rng), _hex_bytes(rng)
+            )
+        )
+    return (
+        '<table class="cloze-converted-table"><tbody>'
+        "<tr><th>Set</th><th>Valid</th><th>Tag</th><th>Data</th></tr>{}</tbody></table>".format("".join(body))
+    )
+
+
+def _tlb_sections(rng: random.Random, rows: int) -> str:
+    sections = []
+    for heading in ("TLB", "Page Table"):
+        lines = "".join(
+            '<div class="cloze-cache-meta">VPN={} PPN={}</div>'.format(rng.randrange(256), rng.randrange(256))
+            for _ in range(rows)
+        )
+        sections.append(
+            '<section class="cloze-comparison-section"><h4 class="cloze-comparison-heading">{}</h4>'
+            '<div class="cloze-comparison-body">{}</div></section>'.format(heading, lines)
+        )
+    return '<div class="cloze-comparison-sections">{}</div>'.format("".join(sections))
+
+
+def generate_variant(rng: random.Random, index: int, blanks: int,
+                     kind_weights: dict[str, float] | None = None,
+                     table_ratio: float = 0.0, table_rows: int = 16) -> dict[str, str]:
+    tokens = _blanks(rng, blanks, kind_weights or {kind: 1.0 for kind in BLANK_KINDS})
+    if rng.random() < table_ratio:
+        in_table = min(len(tokens), table_rows)
+        text = _prose(rng, tokens[in_table:]) + _cache_table(rng, table_rows, tokens[:in_table])
+        text += _tlb_sections(rng, max(table_rows // 4, 1))
+    else:
+        text = _prose(rng, tokens)
+    return {"id": "v{}".format(index), "name": "Variant {}".format(index + 1), "text": text}
+
+
+def generate_variants(count: int, blanks: int, seed: Any = 0, kind_weights: dict[str, float] | None = None,
+                      table_ratio: float = 0.0, table_rows: int = 16) -> list[dict[str, str]]:
+    """Return ``count`` seeded variants in the variants JSON format read by ``load_variants_payload``.
+
+    Each variant has ``blanks`` slots mixing SHORTANSWER aliases, weighted MULTICHOICE choices and
+    NUMERICAL tolerances, each with a partial-credit option. About ``table_ratio`` of the variants
+    also carry a cache table and TLB sections shaped like the Moodle cache converter output.
+    """
+    rng = random.Random(seed)
+    return [generate_variant(rng, index, blanks, kind_weights, table_ratio, table_rows) for index in range(count)]
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _answer_for(kind: str, rhs: Any, outcome: str, rng: random.Random) -> str:
+    options = rhs["answers"] if kind == "MULTICHOICE" else rhs
+    best = max(options, key=lambda option: option["weight"])
+    partial = [option for option in options if 0.0 < option["weight"] < best["weight"]]
+
+    if kind == "NUMERICAL":
+        if outcome == "partial":
+            # Inside the partial option's tolerance but outside the full-credit one.
+            for option in partial:
+                candidate = option["answer"] + (option["tolerance"] + best["tolerance"]) / 2.0
+                if (abs(candidate - best["answer"]) > best["tolerance"]
+                        and abs(candidate - option["answer"]) <= option["tolerance"]):
+                    return _format_number(candidate)
+            outcome = "wrong"
+        if outcome == "wrong":
+            reach = max(abs(option["answer"]) + option["tolerance"] for option in options)
+            return _format_number(reach + 1 + rng.randint(0, 100))
+        return _format_number(best["answer"])
+
+    if outcome == "partial" and partial:
+        return rng.choice(partial)["answer"]
+    if outcome != "correct":
+        if kind == "MULTICHOICE":
+            distractors = [option["answer"] for option in options if option["weight"] <= 0.0]
+            return rng.choice(distractors) if distractors else ""
+        return rng.choice(_WORDS) + "zz"
+    return best["answer"]
+
+
+def answers_for_variant(variant: dict[str, Any], rng: random.Random, mix: AnswerMix = AnswerMix()) -> dict[str, str]:
+    """Answer every slot of a variant record built by ``build_variant_record``, drawing outcomes from ``mix``."""
+    answers = {"__variant": str(variant["selection"])}
+    for slot, (kind, rhs) in variant["solutions"].items():
+        outcome = rng.choices(OUTCOMES, mix)[0]
+        answers[slot] = _answer_for(kind, rhs, outcome, rng)
+    return answers
+
+
+def generate_submissions(variants: list[dict[str, Any]], count: int, seed: Any = 0,
+                         mix: AnswerMix = AnswerMix(), problem_count: int = 1) -> Iterator[dict[str, Any]]:
+    """Yield ``count`` seeded submissions as ``{"id": ..., "input": {...}}`` records.
+
+    ``input`` is accepted by ``parse_submission_payload`` and selects its variants through
+    ``__variant``, like the answers the cloze frontend submits.
+    """
+    rng = random.Random(seed)
+    variants = load_variants_payload(variants)
+    problem_count = max(min(problem_count, len(variants)), 1)
+    for index in range(count):
+        selection = ",".join(str(choice) for choice in rng.sample(range(len(variants)), problem_count))
+        variant = build_variant_record(variants, submitted_variant=selection, problem_count=problem_count)
+        yield {"id": "s{}".format(index), "input": answers_for_variant(variant, rng, mix)}
+
+
+def write_submissions(submissions: Iterator[dict[str, Any]], handle: TextIO) -> int:
+    count = 0
+    for count, submission in enumerate(submissions, 1):
+        handle.write(json.dumps(submission) + "\n")
+    return count
+
+
+_MOODLE_BODIES = (
+    '<p><span style="color: #c00">{word}</span> {{1:SHORTANSWER:={word}}} <br/> and {{:NM:={number}}}</p>'
+    "<style>p {{ margin: 0; }}</style>",
+    '<table width="100%" border="1"><tbody><tr><th>TLB</th><th>Page Table</th></tr>'
+    "<tr><td>VPN {{1:NUMERICAL:={number}}}</td><td>PPN={number}<br>PPN={other}</td></tr></tbody></table>",
+    '<table align="left"><tr><td>Tag={number}<br/>Data = {bytes}<br>{bytes}</td>'
+    "<td><span>{{:SA:={word}}}</span></td></tr></table><pre class=\"a\">lw $t0, {number}($sp)\n  nop</pre>",
+    "<ul><li><p> . {word} &amp; {{:MC:={word}~{other_word}}}</p></li></ul><p><p>{other_word}</p></p>",
+)
+
+
+def generate_moodle_xml(questions: int, seed: Any = 0, cloze_ratio: float = 0.8) -> str:
+    """Return a Moodle quiz XML export with ``questions`` questions for the converter scripts."""
+    rng = random.Random(seed)
+    parts = ['<question type="category"><category><text>$course$/workload</text></category></question>']
+    for index in range(questions):
+        body = rng.choice(_MOODLE_BODIES).format(
+            word=rng.choice(_WORDS), other_word=rng.choice(_WORDS), number=rng.randrange(4096),
+            other=rng.randrange(4096), bytes=_hex_bytes(rng, 4),
+        )
+        parts.append(
+            '<question type="{}"><name><text>Question {}</text></name><questiontext format="html">'
+            "<text><![CDATA[{}]]></text></questiontext></question>".format(
+                "cloze" if rng.random() < cloze_ratio else "multichoice", index + 1, body
+            )
+        )
+    return '<?xml version="1.0" encoding="UTF-8"?>\n<quiz>\n{}\n</quiz>\n'.format("\n".join(parts))
+
+
+def _open_output(path: str | None) -> TextIO:
+    return open(path, "w", encoding="utf-8") if path else sys.stdout
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate seeded synthetic cloze workloads.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    variants_parser = subparsers.add_parser("variants", help="Write a variants JSON file.")
+    variants_parser.add_argument("--count", type=int, default=100, help="Number of variants")
+    variants_parser.add_argument("--blanks", type=int, default=10, help="Blanks per variant")
+    variants_parser.add_argument("--kinds", type=parse_kind_weights, default=None,
+                                 help="Blank kind weights, for example SHORTANSWER=2,NUMERICAL=1,MULTICHOICE=1")
+    variants_parser.add_argument("--table-ratio", type=float, default=0.0,
+                                 help="Share of variants with a cache table and TLB sections")
+    variants_parser.add_argument("--table-rows", type=int, default=16, help="Rows per cache table")
+
+    submissions_parser = subparsers.add_parser("submissions", help="Write a JSON Lines submission stream.")
+    submissions_parser.add_argument("variants_file", help="Variants JSON file to answer")
+    submissions_parser.add_argument("--count", type=int, default=1000, help="Number of submissions")
+    submissions_parser.add_argument("--mix", type=parse_answer_mix, default=AnswerMix(),
+                                    help="Correct,partial,wrong weights per blank (default: 0.6,0.25,0.15)")
+    submissions_parser.add_argument("--problem-count", type=int, default=1,
+                                    help="Variants combined per submission, as random_problem_count")
+
+    moodle_parser = subparsers.add_parser("moodle", help="Write a Moodle quiz XML export.")
+    moodle_parser.add_argument("--questions", type=int, default=200, help="Number of questions")
+    moodle_parser.add_argument("--cloze-ratio", type=float, default=0.8, help="Share of cloze questions")
+
+    for subparser in (variants_parser, submissions_parser, moodle_parser):
+        subparser.add_argument("--seed", type=int, default=0, help="Random seed; the same seed gives the same output")
+        subparser.add_argument("-o", "--output", help="Output file. Defaults to standard output.")
+    args = parser.parse_args(argv)
+
+    output = _open_output(args.output)
+    try:
+        if args.command == "variants":
+            variants = generate_variants(
+                args.count, args.blanks, args.seed, args.kinds, args.table_ratio, args.table_rows
+            )
+            output.write(json.dumps({"variants": variants}, indent=2) + "\n")
+            written = "{} variant(s)".format(len(variants))
+        elif args.command == "submissions":
+            with open(args.variants_file, "r", encoding="utf-8") as handle:
+                variants = json.load(handle)
+            written = "{} submission(s)".format(write_submissions(
+                generate_submissions(variants, args.count, args.seed, args.mix, args.problem_count), output
+            ))
+        else:
+            output.write(generate_moodle_xml(args.questions, args.seed, args.cloze_ratio))
+            written = "{} question(s)".format(args.questions)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print("Wrote {}".format(written), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
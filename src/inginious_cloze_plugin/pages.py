@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import gzip
+import hashlib
+import hmac
+import html
+import json
+import os
+import threading
+from typing import Any, Iterable, NamedTuple
+
+try:
+    from flask import Response, request
+    from inginious.frontend.pages.utils import INGIniousAdministratorPage, INGIniousAuthPage, INGIniousPage
+    from werkzeug.exceptions import BadRequest, NotFound
+except ModuleNotFoundError:  # pragma: no cover - local tests without INGInious
+    Response = None
+    request = None
+    INGIniousAdministratorPage = object
+    INGIniousAuthPage = object
+    INGIniousPage = object
+    BadRequest = ValueError
+    NotFound = LookupError
+
+from .cloze_core import normalize_problem_count, redact_variant, solution_cache_stats
+from .cloze_metrics import PROMETHEUS_CONTENT_TYPE, counter, gauge, render_prometheus
+from .cloze_problem_backend import load_variants, variants_cache_stats
+
+PLUGIN_ROUTE = "/plugins/cloze"
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+_STATIC_CONTENT_TYPES = {
+    ".js": "application/javascript; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+}
+_STATIC_GZIP = True
+_STATIC_ASSETS: dict[str, "StaticAsset"] | None = None
+_STATIC_LOCK = threading.Lock()
+_METRICS_TOKEN: str | None = None
+
+
+class StaticAsset(NamedTuple):
+    name: str
+    fingerprinted_name: str
+    content_type: str
+    body: bytes
+    gzipped: bytes | None
+    etag: str
+
+
+def _load_static_asset(name: str) -> StaticAsset:
+    with open(os.path.join(STATIC_DIR, name), "rb") as handle:
+        body = handle.read()
+    digest = hashlib.sha256(body).hexdigest()[:16]
+    stem, extension = os.path.splitext(name)
+    return StaticAsset(
+        name=name,
+        fingerprinted_name="{}.{}{}".format(stem, digest, extension),
+        content_type=_STATIC_CONTENT_TYPES[extension],
+        body=body,
+        gzipped=gzip.compress(body, 9, mtime=0) if _STATIC_GZIP else None,
+        etag='"{}"'.format(digest),
+    )
+
+
+def _static_assets() -> dict[str, StaticAsset]:
+    global _STATIC_ASSETS
+    if _STATIC_ASSETS is None:
+        with _STATIC_LOCK:
+            if _STATIC_ASSETS is None:
+                assets = {}
+                for name in sorted(os.listdir(STATIC_DIR)):
+                    if os.path.splitext(name)[1] in _STATIC_CONTENT_TYPES:
+                        asset = _load_static_asset(name)
+                        assets[asset.name] = asset
+                        assets[asset.fingerprinted_name] = asset
+                _STATIC_ASSETS = assets
+    return _STATIC_ASSETS
+
+
+def configure_static(gzip_assets: bool | None = None) -> None:
+    global _STATIC_GZIP, _STATIC_ASSETS
+    if gzip_assets is not None and bool(gzip_assets) != _STATIC_GZIP:
+        with _STATIC_LOCK:
+            _STATIC_GZIP = bool(gzip_assets)
+            _STATIC_ASSETS = None
+
+
+def static_asset(name: str) -> StaticAsset | None:
+    return _static_assets().get(name)
+
+
+def script_root() -> str:
+    try:
+        from flask import has_request_context
+    except ModuleNotFoundError:  # pragma: no cover - local tests without INGInious
+        return ""
+    return request.script_root if has_request_context() else ""
+
+
+def static_asset_url(name: str) -> str:
+    return "{}{}/static/{}".format(script_root(), PLUGIN_ROUTE, static_asset(name).fingerprinted_name)
+
+
+def script_tag(name: str) -> str:
+    return '<script src="{}"></script>'.format(html.escape(static_asset_url(name)))
+
+
+def stylesheet_tag(name: str) -> str:
+    return '<link rel="stylesheet" href="{}">'.format(html.escape(static_asset_url(name)))
+
+
+def json_script_tag(payload: Any, **attributes: str) -> str:
+    # Escaped so that no payload can close the script element or open a comment.
+    data = json.dumps(payload).replace("<", "\\u003c").replace(">", "\\u003e").replace("&", "\\u0026")
+    attrs = "".join(
+        ' {}="{}"'.format(key.replace("_", "-"), html.escape(str(value))) for key, value in attributes.items()
+    )
+    return '<script type="application/json"{}>{}</script>'.format(attrs, data)
+
+
+def cache_stats_payload() -> dict[str, Any]:
+    from . import descriptor_cache_stats, evaluation_mode_cache_stats
+    from .cloze_problem_frontend import prompt_cache_stats
+
+    return {
+        "variants_cache": variants_cache_stats(),
+        "solution_cache": solution_cache_stats(),
+        "prompt_cache": prompt_cache_stats(),
+        "evaluation_mode_cache": evaluation_mode_cache_stats(),
+        "descriptor_cache": descriptor_cache_stats(),
+    }
+
+
+def _cache_stat(field: str):
+    def read() -> dict[tuple[str, ...], float]:
+        return {
+            (name[:-len("_cache")],): stats.get(field, 0)
+            for name, stats in cache_stats_payload().items()
+            if isinstance(stats, dict)
+        }
+    return read
+
+
+gauge("cloze_cache_entries", "Entries held by each cloze cache.", ("cache",), function=_cache_stat("size"))
+counter("cloze_cache_hits_total", "Lookups served by each cloze cache.", ("cache",), function=_cache_stat("hits"))
+counter("cloze_cache_misses_total", "Lookups missed by each cloze cache.", ("cache",), function=_cache_stat("misses"))
+counter(
+    "cloze_cache_evictions_total", "Entries evicted from each cloze cache.", ("cache",),
+    function=_cache_stat("evictions"),
+)
+
+
+def configure_metrics(token: str | None = None) -> None:
+    global _METRICS_TOKEN
+    _METRICS_TOKEN = str(token) if token else None
+
+
+def variants_payload(problem: dict[str, Any], task_fs, indices: Iterable[int] | None = None) -> dict[str, Any]:
+    variants = load_variants(problem, task_fs)
+    if indices is None:
+        selected = range(len(variants))
+    else:
+        selected = sorted({index for index in indices if 0 <= index < len(variants)})
+    return {
+        "count": len(variants),
+        "variants": {str(index): redact_variant(variants[index]) for index in selected},
+    }
+
+
+def _parse_indices(raw: str | None) -> list[int] | None:
+    if not raw:
+        return None
+    indices = []
+    for part in raw.split(","):
+        try:
+            indices.append(int(part))
+        except ValueError:
+            continue
+    return indices
+
+
+def _json_response(payload: Any, status: int = 200, headers: dict[str, str] | None = None):
+    return Response(response=json.dumps(payload), status=status, content_type="application/json", headers=headers)
+
+
+class ClozeCacheStatsPage(INGIniousAdministratorPage):
+    def GET_AUTH(self):  # pylint: disable=arguments-differ
+        return _json_response(cache_stats_payload())
+
+
+class ClozeMetricsPage(INGIniousPage):
+    def _authorized(self) -> bool:
+        if _METRICS_TOKEN is not None:
+            # Scrapers cannot log in, so a configured token is accepted as a bearer credential.
+            supplied = request.headers.get("Authorization", "")
+            if hmac.compare_digest(supplied.encode("utf-8"), "Bearer {}".format(_METRICS_TOKEN).encode("utf-8")):
+                return True
+        return self.user_manager.session_logged_in() and self.user_manager.user_is_superadmin()
+
+    def GET(self):  # pylint: disable=arguments-differ
+        if not self._authorized():
+            raise NotFound()
+        return Response(
+            response=render_prometheus(), status=200, content_type=PROMETHEUS_CONTENT_TYPE,
+            headers={"Cache-Control": "no-store"},
+        )
+
+
+def _task_is_accessible(user_manager, course, task) -> bool:
+    # Same gate as the task page: hidden tasks are invisible, and only staff see a task outside
+    # its accessibility period, so prompts of upcoming exams cannot be fetched early.
+    if not user_manager.task_is_visible_by_user(task):
+        return False
+    if user_manager.has_staff_rights_on_course(course):
+        return True
+    return task.get_accessible_time().is_open()
+
+
+def requested_variants_payload(course_factory, user_manager, courseid: str, taskid: str, problemid: str,
+                               raw_indices: str | None) -> dict[str, Any]:
+    """Return the redacted variants a student page asked for, or raise NotFound / BadRequest."""
+    from . import _get_task_fs, _load_task_descriptor_from_task_fs
+
+    try:
+        course = course_factory.get_course(courseid)
+        task = course.get_task(taskid)
+    except Exception:
+        raise NotFound()
+    if not user_manager.course_is_open_to_user(course) or not _task_is_accessible(user_manager, course, task):
+        raise NotFound()
+
+    task_fs = _get_task_fs(course_factory, courseid, taskid)
+    descriptor = _load_task_descriptor_from_task_fs(task_fs)
+    problems = descriptor.get("problems", {}) if isinstance(descriptor, dict) else {}
+    problem = problems.get(problemid) if isinstance(problems, dict) else None
+    if not isinstance(problem, dict) or problem.get("type") != "cloze":
+        raise NotFound()
+
+    # A page only ever needs the variants of one selection, never the whole bank.
+    indices = list(dict.fromkeys(_parse_indices(raw_indices) or []))
+    if not indices:
+        raise BadRequest()
+    return variants_payload(problem, task_fs, indices[:normalize_problem_count(problem.get("random_problem_count"))])
+
+
+class ClozeVariantsPage(INGIniousAuthPage):
+    def GET_AUTH(self, courseid, taskid, problemid):  # pylint: disable=arguments-differ
+        payload = requested_variants_payload(
+            self.course_factory, self.user_manager, courseid, taskid, problemid, request.args.get("indices")
+        )
+        etag = '"{}"'.format(hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:32])
+        headers = {"Cache-Control": "private, max-age=300", "ETag": etag}
+        if request.headers.get("If-None-Match") == etag:
+            return Response(status=304, headers=headers)
+        return _json_response(payload, headers=headers)
+
+
+class ClozeStaticPage(INGIniousPage):
+    def GET(self, filename):  # pylint: disable=arguments-differ
+        asset = static_asset(filename)
+        # Only fingerprinted names are served, so every response can be cached forever.
+        if asset is None or filename != asset.fingerprinted_name:
+            raise NotFound()
+
+        headers = {
+            "Cache-Control": "public, max-age={}, immutable".format(STATIC_MAX_AGE),
+            "ETag": asset.etag,
+            "Vary": "Accept-Encoding",
+        }
+        if request.headers.get("If-None-Match") == asset.etag:
+            return Response(status=304, headers=headers)
+
+        body = asset.body
+        if asset.gzipped is not None and "gzip" in request.headers.get("Accept-Encoding", ""):
+            body = asset.gzipped
+            headers["Content-Encoding"] = "gzip"
+        return Response(response=body, status=200, content_type=asset.content_type, headers=headers)
+
+
+def register_pages(plugin_manager) -> None:
+    add_page = getattr(plugin_manager, "add_page", None)
+    if Response is None or not callable(add_page):
+        return
+    add_page(PLUGIN_ROUTE + "/cache_stats", ClozeCacheStatsPage.as_view("clozecachestatspage"))
+    add_page(PLUGIN_ROUTE + "/metrics", ClozeMetricsPage.as_view("clozemetricspage"))
+    add_page(PLUGIN_ROUTE + "/static/<filename>", ClozeStaticPage.as_view("clozestaticpage"))
+    add_page(
+        PLUGIN_ROUTE + "/variants/<courseid>/<taskid>/<problemid>",
+        ClozeVariantsPage.as_view("clozevariantspage"),
+    )
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from typing import Any, Iterator, TextIO
+
+from .cloze_agent import parse_submission_payload
+from .cloze_core import coerce_problem_mapping, normalize_problem_count, regrade_submissions
+from .cloze_problem_backend import load_variants
+
+
+def _load_problem(task_dir: str, problem_id: str) -> dict[str, Any]:
+    from . import _load_task_descriptor_from_task_fs
+
+    descriptor = _load_task_descriptor_from_task_fs(task_dir)
+    problems = descriptor.get("problems", {}) if isinstance(descriptor, dict) else {}
+    problem = problems.get(problem_id) if isinstance(problems, dict) else None
+    if not isinstance(problem, dict) or problem.get("type") != "cloze":
+        raise ValueError("Task descriptor in {} has no cloze problem {!r}.".format(task_dir, problem_id))
+    return problem
+
+
+def _read_submissions(handle: TextIO) -> Iterator[tuple[Any, dict[str, str]]]:
+    for line_number, line in enumerate(handle, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if isinstance(record, dict) and "input" in record:
+            yield record.get("id", line_number), parse_submission_payload(record["input"])
+        else:
+            yield line_number, parse_submission_payload(record)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Regrade stored cloze submissions against the current answer key.")
+    parser.add_argument("submissions", help="JSON Lines file: one answers object, or {\"id\": ..., \"input\": ...}, per line")
+    parser.add_argument("--task-dir", required=True, help="Task directory containing task.yaml and its variants files")
+    parser.add_argument("--problem", required=True, help="Cloze subproblem id to regrade")
+    parser.add_argument("-o", "--output", help="Output JSON Lines file. Defaults to standard output.")
+    args = parser.parse_args(argv)
+
+    problem = _load_problem(args.task_dir, args.problem)
+    variants = load_variants(problem, args.task_dir)
+    problem_count = normalize_problem_count(coerce_problem_mapping(problem).get("random_problem_count"))
+
+    with open(args.submissions, "r", encoding="utf-8") as handle:
+        submission_ids, answer_sets = [], []
+        for submission_id, answers in _read_submissions(handle):
+            submission_ids.append(submission_id)
+            answer_sets.append(answers)
+
+    started = time.perf_counter()
+    regraded = regrade_submissions(variants, answer_sets, problem_count=problem_count)
+    elapsed = time.perf_counter() - started
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for index, submission_id in enumerate(submission_ids):
+            score = float(regraded["scores"][index])
+            output.write(json.dumps({
+                "id": submission_id,
+                "variant": regraded["selection"][index],
+                "correct": int(regraded["correct"][index]),
+                "total": int(regraded["total"][index]),
+                "score": score,
+                "grade": 100.0 * score,
+            }) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print("Regraded {} submission(s) in {:.3f}s".format(len(submission_ids), elapsed), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
@@ -0,0 +1,183 @@
+(function () {
+    "use strict";
+
+    var sourceNode = document.getElementById("cloze-editor-source-problems");
+    try {
+        window.__clozeSourceProblems = sourceNode ? JSON.parse(sourceNode.textContent || "{}") : {};
+    } catch (err) {
+        window.__clozeSourceProblems = {};
+    }
+
+    function getProblemData() {
+        if (window.__clozeHydratorProblemData) {
+            return window.__clozeHydratorProblemData;
+        }
+
+        var raw = window.problem_data;
+        if (!raw) {
+            return null;
+        }
+
+        if (typeof raw === "string") {
+            try {
+                raw = JSON.parse(raw);
+            } catch (err) {
+                return null;
+            }
+        }
+
+        if (!raw || typeof raw !== "object") {
+            return null;
+        }
+
+        window.__clozeHydratorProblemData = raw;
+        return raw;
+    }
+
+    function getClozeProblems() {
+        var problems = {};
+        var renderedProblems = getProblemData();
+        var sourceProblems = window.__clozeSourceProblems || {};
+        var pid;
+
+        if (renderedProblems) {
+            Object.keys(renderedProblems).forEach(function (key) {
+                problems[key] = renderedProblems[key];
+            });
+        }
+
+        Object.keys(sourceProblems).forEach(function (key) {
+            problems[key] = sourceProblems[key];
+        });
+
+        for (pid in problems) {
+            if (!Object.prototype.hasOwnProperty.call(problems, pid)) {
+                continue;
+            }
+            if (!problems[pid] || problems[pid].type !== "cloze") {
+                delete problems[pid];
+            }
+        }
+
+        return problems;
+    }
+
+    function hasProblemCard(pid) {
+        return document.querySelector('[name="problem[' + pid + '][text]"]') !== null;
+    }
+
+    function ensureProblemsExist(problems, count) {
+        if (typeof window.studio_create_from_template !== "function") {
+            return false;
+        }
+
+        // Give the native editor a chance to instantiate existing problems first.
+        if (count < 5 && !Object.keys(problems).some(hasProblemCard)) {
+            return false;
+        }
+
+        var missing = Object.keys(problems).filter(function (pid) {
+            return !hasProblemCard(pid);
+        });
+
+        if (!missing.length) {
+            return true;
+        }
+
+        missing.forEach(function (pid) {
+            if (hasProblemCard(pid)) {
+                return;
+            }
+            window.studio_create_from_template("#subproblem_cloze", pid);
+        });
+
+        return Object.keys(problems).every(function (pid) {
+            return hasProblemCard(pid);
+        });
+    }
+
+    function hydrate() {
+        var problems = getClozeProblems();
+        var attemptCount = arguments.length > 0 ? arguments[0] : 0;
+        if (!Object.keys(problems).length) {
+            return true;
+        }
+
+        if (!ensureProblemsExist(problems, attemptCount)) {
+            return false;
+        }
+
+        var foundAll = true;
+        Object.keys(problems).forEach(function (pid) {
+            var problem = problems[pid];
+
+            [
+                ["name", typeof problem.name === "string" ? problem.name : ""],
+                ["text", typeof problem.text === "string" ? problem.text : ""],
+                ["variants_file", typeof problem.variants_file === "string" ? problem.variants_file : ""],
+                ["random_problem_count", problem.random_problem_count == null ? "" : String(problem.random_problem_count)]
+            ].forEach(function (entry) {
+                var field = entry[0];
+                var value = entry[1];
+                var node = document.querySelector('[name="problem[' + pid + '][' + field + ']"]');
+                if (!node) {
+                    foundAll = false;
+                    return;
+                }
+                node.value = value;
+            });
+        });
+
+        return foundAll;
+    }
+
+    function scheduleHydrateSoon() {
+        window.setTimeout(function () {
+            hydrate(40);
+        }, 0);
+    }
+
+    function attempt(count) {
+        if (hydrate(count) || count >= 40) {
+            return;
+        }
+        window.setTimeout(function () {
+            attempt(count + 1);
+        }, 100);
+    }
+
+    function installObserver() {
+        if (typeof MutationObserver !== "function") {
+            return;
+        }
+
+        var root = document.getElementById("tab_subproblems") || document.body;
+        if (!root) {
+            return;
+        }
+
+        var observer = new MutationObserver(function (mutations) {
+            var shouldHydrate = mutations.some(function (mutation) {
+                return mutation.addedNodes && mutation.addedNodes.length > 0;
+            });
+            if (shouldHydrate) {
+                scheduleHydrateSoon();
+            }
+        });
+
+        observer.observe(root, {
+            childList: true,
+            subtree: true
+        });
+    }
+
+    if (document.readyState === "loading") {
+        document.addEventListener("DOMContentLoaded", function () {
+            installObserver();
+            attempt(0);
+        });
+    } else {
+        installObserver();
+        attempt(0);
+    }
+})();
@@ -0,0 +1,574 @@
+(function() {
+  window.__clozeProblemInstances = window.__clozeProblemInstances || {};
+
+  // Mirrors the server parser: split on unescaped separators, then drop Moodle escapes, so that
+  // option values match the labels the answer key is graded against.
+  function splitUnescaped(text, separator) {
+    var parts = [];
+    var current = "";
+    for (var i = 0; i < text.length; i++) {
+      var ch = text.charAt(i);
+      if (ch === "\\" && i + 1 < text.length) {
+        current += ch + text.charAt(i + 1);
+        i++;
+      } else if (ch === separator) {
+        parts.push(current);
+        current = "";
+      } else {
+        current += ch;
+      }
+    }
+    parts.push(current);
+    return parts;
+  }
+
+  function parseMultichoiceLabels(rhs) {
+    return splitUnescaped(String(rhs), "~").map(function (item) {
+      item = item.trim();
+      if (item.charAt(0) === "=") {
+        item = item.slice(1).trim();
+      } else {
+        var weightedMatch = item.match(/^%-?\d+(?:\.\d+)?%([\s\S]*)$/);
+        if (weightedMatch) {
+          item = weightedMatch[1].trim();
+        }
+      }
+      item = splitUnescaped(item, "#")[0].trim();
+      return item.replace(/\\([~#}:=%\\])/g, "$1") || null;
+    }).filter(Boolean);
+  }
+
+  function initClozeProblem(config) {
+    var uniq = String(config.uniq);
+    var pid = String(config.pid);
+    var slotPrefix = uniq + "_slot_";
+    var hidden = document.getElementById(uniq + "_json");
+    if (!hidden) return;
+
+    var variants = config.variants || {};
+    var variantCount = Number(config.variantCount) || 0;
+    var variantsUrl = config.variantsUrl || null;
+    var problemCount = config.problemCount;
+    var defaultIndex = config.defaultIndex;
+    var tokenRe = /\{(\d+):(SHORTANSWER|NUMERICAL|MULTICHOICE):((?:\\.|[^}])*)\}/g;
+    var textRoot = document.getElementById(uniq + "_text");
+    var titleRoot = document.getElementById(uniq + "_title");
+    var lastInlineFeedback = null;
+
+    function escapeHtml(value) {
+      return String(value)
+        .replace(/&/g, "&amp;")
+        .replace(/</g, "&lt;")
+        .replace(/>/g, "&gt;")
+        .replace(/"/g, "&quot;")
+        .replace(/'/g, "&#39;");
+    }
+
+    function normalizeProblemCount(value) {
+      var parsed = Number(value);
+      if (!Number.isFinite(parsed) || parsed < 1) {
+        return 1;
+      }
+      return Math.max(1, Math.floor(parsed));
+    }
+
+    function parseSelection(selection) {
+      var values = [];
+      if (Array.isArray(selection)) {
+        values = selection;
+      } else if (selection !== null && selection !== undefined) {
+        if (typeof selection === "string") {
+          var trimmed = selection.trim();
+          if (!trimmed) {
+            values = [];
+          } else {
+            try {
+              var parsed = JSON.parse(trimmed);
+              if (Array.isArray(parsed)) {
+                values = parsed;
+              } else {
+                values = trimmed.split(",");
+              }
+            } catch (err) {
+              values = trimmed.split(",");
+            }
+          }
+        } else {
+          values = [selection];
+        }
+      }
+
+      var unique = [];
+      var seen = {};
+      values.forEach(function(value) {
+        var index = Number(value);
+        if (!Number.isInteger(index) || index < 0 || index >= variantCount || seen[index]) {
+          return;
+        }
+        seen[index] = true;
+        unique.push(index);
+      });
+      return unique;
+    }
+
+    function selectionToken(selection) {
+      return selection.length === 1 ? String(selection[0]) : selection.join(",");
+    }
+
+    function renumberSlots(text) {
+      var nextSlot = 0;
+      tokenRe.lastIndex = 0;
+      return String(text || "").replace(tokenRe, function (_, __, kind, rhs) {
+        nextSlot += 1;
+        return '{' + nextSlot + ':' + kind + ':' + rhs + '}';
+      });
+    }
+
+    function selectionIndices(selection) {
+      var count = Math.min(normalizeProblemCount(problemCount), Math.max(variantCount, 1));
+      var indices = parseSelection(selection).slice(0, count);
+      if (!indices.length && variantCount) {
+        indices = [0];
+      }
+      return indices;
+    }
+
+    function ensureVariants(indices, callback) {
+      var missing = indices.filter(function(index) {
+        return !variants[index];
+      });
+      if (!missing.length || !variantsUrl || typeof window.fetch !== "function") {
+        callback();
+        return;
+      }
+      window.fetch(variantsUrl + "?indices=" + missing.join(","), { credentials: "same-origin" })
+        .then(function(response) {
+          return response.ok ? response.json() : { variants: {} };
+        })
+        .then(function(payload) {
+          var fetched = (payload && payload.variants) || {};
+          Object.keys(fetched).forEach(function(index) {
+            variants[index] = fetched[index];
+          });
+        })
+        .catch(function() {
+          return null;
+        })
+        .then(callback);
+    }
+
+    function composeVariant(selection) {
+      var indices = selectionIndices(selection);
+
+      var chosen = indices.map(function(index) {
+        return variants[index];
+      }).filter(Boolean);
+
+      var combinedText = chosen.map(function(variant, idx) {
+        var parts = [];
+        if (chosen.length > 1 && variant.name) {
+          parts.push('<p><strong>' + escapeHtml(variant.name) + '</strong></p>');
+        }
+        parts.push(variant.text || '');
+        return '<div class="cloze-random-problem" data-cloze-variant-id="' +
+          escapeHtml(String(variant.id == null ? indices[idx] : variant.id)) + '">' +
+          parts.join('') +
+          '</div>';
+      }).join('<hr class="cloze-random-problem-separator">');
+
+      if (chosen.length === 1) {
+        combinedText = chosen[0].text || "";
+      }
+
+      return {
+        index: selectionToken(indices),
+        name: chosen.length === 1 ? chosen[0].name : null,
+        text: renumberSlots(combinedText)
+      };
+    }
+
+    function renderMultichoice(slot, rhs) {
+      var options = parseMultichoiceLabels(rhs);
+
+      var labelText = 'Blank ' + slot;
+      var html = '<span class="cloze-slot-wrapper" style="display:inline-block; min-width:140px; vertical-align:middle; margin:0 4px;">';
+      html += '<select class="form-control cloze-input" data-slot="' + slot + '" id="' + escapeHtml(slotPrefix + slot) + '"' +
+        ' aria-label="' + escapeHtml(labelText) + '"' +
+        ' style="display:block; width:100%; min-width:140px; vertical-align:middle;">';
+      html += '<option value=""></option>';
+      options.forEach(function (option) {
+        html += '<option value="' + escapeHtml(option) + '">' + escapeHtml(option) + '</option>';
+      });
+      html += '</select>';
+      html += '<span class="cloze-slot-feedback text-muted" data-slot-feedback="' + escapeHtml(slot) + '" aria-live="polite" style="display:block; font-size:0.85em; margin-top:4px;"></span>';
+      html += '</span>';
+      return html;
+    }
+
+    function clearInlineFeedback() {
+      var feedbackNodes = textRoot.querySelectorAll('[data-slot-feedback]');
+      feedbackNodes.forEach(function(node) {
+        node.textContent = '';
+      });
+    }
+
+    function renderInlineFeedback(feedbackMap) {
+      clearInlineFeedback();
+      if (!feedbackMap || typeof feedbackMap !== "object") {
+        lastInlineFeedback = null;
+        return;
+      }
+      lastInlineFeedback = feedbackMap;
+      Object.keys(feedbackMap).forEach(function(slot) {
+        var node = textRoot.querySelector('[data-slot-feedback="' + slot + '"]');
+        if (node) {
+          var text = feedbackMap[slot] || '';
+          text = String(text).replace(/<[^>]*>/g, ' ').replace(/\s+/g, ' ').trim();
+          node.textContent = text;
+        }
+      });
+    }
+
+    function extractInlineMessage(problemMessage) {
+      if (!problemMessage || typeof problemMessage !== "string") {
+        return "";
+      }
+      var message = problemMessage.replace(/<[^>]*>/g, ' ').replace(/\s+/g, ' ').trim();
+      var summaryMatch = message.match(/^.*?You got \d+\/\d+ blanks right\.?(?:\s+|$)(.*)$/);
+      if (summaryMatch) {
+        return (summaryMatch[1] || "").trim();
+      }
+      return "";
+    }
+
+    function normalizeInlineFeedback(problemFeedback) {
+      if (Array.isArray(problemFeedback)) {
+        if (problemFeedback.length > 2 && problemFeedback[2] && typeof problemFeedback[2] === "object") {
+          var mappedFeedback = problemFeedback[2];
+          if (Object.keys(mappedFeedback).length > 0) {
+            return mappedFeedback;
+          }
+        }
+
+        var fallbackMessage = extractInlineMessage(problemFeedback[1]);
+        if (fallbackMessage) {
+          var inputs = textRoot.querySelectorAll("input.cloze-input, select.cloze-input");
+          if (inputs.length === 1) {
+            var onlySlot = inputs[0].getAttribute("data-slot");
+            if (onlySlot) {
+              var fallbackMap = {};
+              fallbackMap[onlySlot] = fallbackMessage;
+              return fallbackMap;
+            }
+          }
+        }
+        return null;
+      }
+
+      if (problemFeedback && typeof problemFeedback === "object") {
+        return Object.keys(problemFeedback).length > 0 ? problemFeedback : null;
+      }
+
+      return null;
+    }
+
+    function enhanceConvertedTables() {
+      if (!textRoot) {
+        return;
+      }
+
+      var comparisonTables = textRoot.querySelectorAll('.cloze-converted-table');
+      comparisonTables.forEach(function(table) {
+        if (table.dataset.clozeEnhanced === '1') {
+          return;
+        }
+
+        var rows = Array.prototype.slice.call(table.rows || []);
+        if (rows.length < 2) {
+          return;
+        }
+
+        var headerCells = Array.prototype.slice.call(rows[0].cells || []);
+        var headers = headerCells.map(function(cell) {
+          return (cell.textContent || '').replace(/\s+/g, ' ').trim().toLowerCase();
+        });
+
+        if (headers.length === 2 && headers[0] === 'tlb' && headers[1] === 'page table') {
+          var contentCells = Array.prototype.slice.call(rows[1].cells || []);
+          if (contentCells.length === 2) {
+            var wrapper = document.createElement('div');
+            wrapper.className = 'cloze-comparison-sections';
+
+            ['TLB', 'Page Table'].forEach(function(title, index) {
+              var section = document.createElement('section');
+              section.className = 'cloze-comparison-section';
+
+              var heading = document.createElement('h4');
+              heading.className = 'cloze-comparison-heading';
+              heading.textContent = title;
+              section.appendChild(heading);
+
+              var body = document.createElement('div');
+              body.className = 'cloze-comparison-body';
+              body.innerHTML = contentCells[index].innerHTML;
+              section.appendChild(body);
+              wrapper.appendChild(section);
+            });
+
+            table.dataset.clozeEnhanced = '1';
+            table.parentNode.replaceChild(wrapper, table);
+          }
+        }
+      });
+
+      textRoot.querySelectorAll('.cloze-converted-table').forEach(function(table) {
+        var text = (table.textContent || '').replace(/\s+/g, ' ').trim();
+        if (table.querySelector('.cloze-input')) {
+          table.classList.add('cloze-answer-table');
+        }
+        if (/Tag=|PPN=|VPN|Way #|Set #|Page Table|TLB|Data =/.test(text)) {
+          table.classList.add('cloze-data-table');
+        }
+      });
+    }
+
+    function collect() {
+      var current = {};
+      try {
+        current = JSON.parse(hidden.value || "{}");
+      } catch (err) {
+        current = {};
+      }
+
+      var inputs = document.querySelectorAll('input.cloze-input, select.cloze-input');
+      inputs.forEach(function(inp) {
+        if (inp.id.indexOf(slotPrefix) === 0) {
+          current[inp.getAttribute("data-slot")] = inp.value;
+        }
+      });
+      hidden.value = JSON.stringify(current);
+      return current;
+    }
+
+    function renderVariant(index, current) {
+      ensureVariants(selectionIndices(index), function() {
+        renderLoadedVariant(index, current);
+      });
+    }
+
+    function renderLoadedVariant(index, current) {
+      var variant = composeVariant(index);
+      if (!variant || !textRoot) return;
+
+      if (!current) {
+        try {
+          current = JSON.parse(hidden.value || "{}");
+        } catch (err) {
+          current = {};
+        }
+      }
+      current.__variant = String(variant.index);
+
+      if (titleRoot && variant.name) {
+        titleRoot.textContent = variant.name;
+      }
+
+      var text = variant.text || "";
+      textRoot.innerHTML = text.replace(tokenRe, function (_, slot, kind, rhs) {
+        if (kind === "MULTICHOICE") {
+          return renderMultichoice(slot, rhs);
+        }
+        var inputType = kind === "NUMERICAL" ? "number" : "text";
+        var stepAttr = inputType === "number" ? ' step="any"' : "";
+        var labelText = 'Blank ' + slot;
+        return '<span class="cloze-slot-wrapper" style="display:inline-block; min-width:140px; vertical-align:middle; margin:0 4px;">' +
+          '<input type="' + inputType + '" class="form-control cloze-input" data-slot="' + slot + '"' +
+          ' id="' + escapeHtml(slotPrefix + slot) + '" aria-label="' + escapeHtml(labelText) + '"' + stepAttr +
+          ' style="display:block; width:100%; min-width:140px; vertical-align:middle;">' +
+          '<span class="cloze-slot-feedback text-muted" data-slot-feedback="' + escapeHtml(slot) + '" aria-live="polite" style="display:block; font-size:0.85em; margin-top:4px;"></span>' +
+          '</span>';
+      });
+
+      var inputs = textRoot.querySelectorAll("input.cloze-input, select.cloze-input");
+      inputs.forEach(function(input) {
+        var slot = input.getAttribute("data-slot");
+        input.value = current[slot] || "";
+      });
+
+      hidden.value = JSON.stringify(current);
+      enhanceConvertedTables();
+      clearInlineFeedback();
+      if (lastInlineFeedback) {
+        renderInlineFeedback(lastInlineFeedback);
+      }
+    }
+
+    function normalizeAnswers(rawValue) {
+      if (!rawValue) {
+        return {};
+      }
+      if (typeof rawValue === "string") {
+        try {
+          rawValue = JSON.parse(rawValue);
+        } catch (err) {
+          return {};
+        }
+      }
+      if (Array.isArray(rawValue)) {
+        for (var i = 0; i < rawValue.length; i += 1) {
+          var nested = normalizeAnswers(rawValue[i]);
+          if (Object.keys(nested).length > 0) {
+            return nested;
+          }
+        }
+        return {};
+      }
+      if (!rawValue || typeof rawValue !== "object") {
+        return {};
+      }
+      var wrapperKeys = ["value", "answer", "data", "raw"];
+      for (var j = 0; j < wrapperKeys.length; j += 1) {
+        if (Object.prototype.hasOwnProperty.call(rawValue, wrapperKeys[j])) {
+          var unwrapped = normalizeAnswers(rawValue[wrapperKeys[j]]);
+          if (Object.keys(unwrapped).length > 0) {
+            return unwrapped;
+          }
+        }
+      }
+      var normalized = {};
+      Object.keys(rawValue).forEach(function (key) {
+        var value = rawValue[key];
+        normalized[String(key)] = value == null ? "" : String(value);
+      });
+      return normalized;
+    }
+
+    function getVariantFromState() {
+      if (!window.input || !window.input['@state']) {
+        return null;
+      }
+      try {
+        var parsedState = window.input['@state'];
+        if (typeof parsedState === "string") {
+          parsedState = JSON.parse(parsedState);
+        }
+        if (parsedState && parsedState[pid] && parsedState[pid].variant !== undefined) {
+          return parsedState[pid].variant;
+        }
+      } catch (err) {
+        return null;
+      }
+      return null;
+    }
+
+    function setAnswers(rawValue) {
+      var current = normalizeAnswers(rawValue);
+      var variantIndex = current.__variant;
+      if (variantIndex === undefined || variantIndex === null || variantIndex === "") {
+        variantIndex = getVariantFromState();
+      }
+      if (variantIndex === undefined || variantIndex === null || variantIndex === "") {
+        variantIndex = defaultIndex;
+      }
+      renderVariant(variantIndex, current);
+    }
+
+    var instance = {
+      collect: collect,
+      setAnswers: setAnswers,
+      setFeedback: function(rawFeedback) {
+        renderInlineFeedback(normalizeInlineFeedback(rawFeedback));
+      }
+    };
+    window.__clozeProblemInstances[pid] = instance;
+
+    // Answers are collected from events on this problem's own inputs; submissions loaded later
+    // arrive through load_input_cloze, so nothing needs to poll the hidden field.
+    if (textRoot) {
+      textRoot.addEventListener("input", function(ev) {
+        if (ev.target && ev.target.classList && ev.target.classList.contains("cloze-input")
+            && ev.target.id.indexOf(slotPrefix) === 0) {
+          collect();
+        }
+      });
+    }
+
+    var form = hidden.closest("form");
+    if (form) {
+      form.addEventListener("submit", function() {
+        collect();
+      });
+      form.addEventListener("reset", function() {
+        window.setTimeout(function() {
+          setAnswers(hidden.value);
+        }, 0);
+      });
+    }
+
+    var initialAnswers = {};
+    if (window.input && Object.prototype.hasOwnProperty.call(window.input, pid)) {
+      initialAnswers = normalizeAnswers(window.input[pid]);
+      if (Object.keys(initialAnswers).length > 0) {
+        setAnswers(initialAnswers);
+        return;
+      }
+    }
+
+    var variantIndex = defaultIndex;
+    if (normalizeProblemCount(problemCount) <= 1 && window.input && Array.isArray(window.input['@random']) && window.input['@random'].length > 0) {
+      var numeric = Number(window.input['@random'][0]);
+      if (!Number.isNaN(numeric) && variantCount > 0) {
+        variantIndex = Math.floor(Math.abs(numeric) * variantCount) % variantCount;
+      }
+    }
+
+    renderVariant(variantIndex);
+  }
+
+  function notify(name, problemId) {
+    if (typeof window.CustomEvent !== "function") {
+      return;
+    }
+    document.dispatchEvent(new window.CustomEvent(name, { detail: { problemId: String(problemId) } }));
+  }
+
+  window.load_input_cloze = function (submissionId, problemId, allInputs) {
+    var target = window.__clozeProblemInstances[String(problemId)];
+    if (target) {
+      var rawValue = allInputs && Object.prototype.hasOwnProperty.call(allInputs, problemId) ? allInputs[problemId] : null;
+      target.setAnswers(rawValue);
+    }
+    notify("cloze:input", problemId);
+  };
+
+  window.load_feedback_cloze = function (problemId, rawFeedback) {
+    var target = window.__clozeProblemInstances[String(problemId)];
+    if (target) {
+      target.setFeedback(rawFeedback);
+    }
+    notify("cloze:feedback", problemId);
+  };
+
+  // Every cloze problem embeds its configuration as inline JSON followed by this (cached)
+  // bundle; each execution initializes the configurations that are not bound yet.
+  function initPendingProblems() {
+    var nodes = document.querySelectorAll('script[type="application/json"][data-cloze-problem]');
+    Array.prototype.forEach.call(nodes, function(node) {
+      if (node.getAttribute("data-cloze-bound")) {
+        return;
+      }
+      node.setAttribute("data-cloze-bound", "1");
+      var config;
+      try {
+        config = JSON.parse(node.textContent || "{}");
+      } catch (err) {
+        return;
+      }
+      initClozeProblem(config);
+    });
+  }
+
+  window.__clozeInitProblems = initPendingProblems;
+  window.__clozeParseChoices = parseMultichoiceLabels;
+  initPendingProblems();
+})();
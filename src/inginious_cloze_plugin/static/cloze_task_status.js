@@ -1,12 +1,25 @@
 (function () {
     "use strict";
 
+    if (typeof window.load_feedback_cloze !== "function") {
+        window.load_feedback_cloze = function () {
+            return;
+        };
+    }
+
+    if (typeof window.load_input_cloze !== "function") {
+        window.load_input_cloze = function () {
+            return;
+        };
+    }
+
     function normalizeText(node) {
         return (node && node.textContent ? node.textContent : "").replace(/\s+/g, " ").trim();
     }
 
     function extractFeedbackText() {
-        var alerts = document.querySelectorAll(".alert");
+        var root = document.getElementById("task_alert") || document;
+        var alerts = root.querySelectorAll(".alert");
         for (var i = 0; i < alerts.length; i += 1) {
             var text = normalizeText(alerts[i]);
             if (text.indexOf("Your score is ") !== -1 || text.indexOf("Your submission timed out.") !== -1) {
@@ -59,25 +72,31 @@
         }
     }
 
+    var syncPending = false;
+
+    function scheduleSync() {
+        if (syncPending) {
+            return;
+        }
+        syncPending = true;
+        window.setTimeout(function () {
+            syncPending = false;
+            syncSidebarFromFeedback();
+        }, 0);
+    }
+
     function init() {
         syncSidebarFromFeedback();
 
-        var observer = new MutationObserver(function () {
-            syncSidebarFromFeedback();
-        });
-
-        observer.observe(document.body, {
-            childList: true,
-            subtree: true,
-            characterData: true
-        });
-
-        var taskForm = document.getElementById("task");
-        if (taskForm) {
-            taskForm.addEventListener("submit", function () {
-                window.setTimeout(syncSidebarFromFeedback, 250);
-                window.setTimeout(syncSidebarFromFeedback, 1000);
-                window.setTimeout(syncSidebarFromFeedback, 2500);
+        // The cloze problems announce new feedback; the result banner itself is rendered into
+        // #task_alert, so that container is the only one watched for late updates.
+        document.addEventListener("cloze:feedback", scheduleSync);
+
+        var alertRoot = document.getElementById("task_alert");
+        if (alertRoot && typeof MutationObserver === "function") {
+            new MutationObserver(scheduleSync).observe(alertRoot, {
+                childList: true,
+                subtree: true
             });
         }
     }
@@ -1,21 +1,86 @@
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import subprocess
 import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
 
 sys.path.insert(0, "src")
+sys.path.insert(0, "scripts")
 
+import convert_moodle_batch
+import convert_moodle_cache_xml
 import inginious_cloze_plugin
-from inginious_cloze_plugin.cloze_agent import grade_cloze_problem, parse_submission_payload
+from inginious_cloze_plugin.agent_cloze import WorkerMetrics, WorkerSupervisor, aggregate_worker_stats
+from inginious_cloze_plugin import cloze_agent
+from inginious_cloze_plugin.cloze_agent import (
+    ClozeAgent,
+    effective_concurrency,
+    grade_cloze_problem,
+    parse_submission_payload,
+)
 from inginious_cloze_plugin.__init__ import _merge_cloze_problem_fields, _parse_simple_task_yaml
+from inginious_cloze_plugin.cloze_cache import LRUCache, TTLCache
+from inginious_cloze_plugin.cloze_user_tasks import (
+    UserTaskWriteBehind,
+    configure_write_behind,
+    user_task_operations,
+    write_behind,
+)
+from inginious_cloze_plugin.cloze_metrics import REGISTRY, MetricsRegistry
+from inginious_cloze_plugin import cloze_core
 from inginious_cloze_plugin.cloze_core import (
     build_variant_record,
     choose_variant_indices,
+    clear_solution_cache,
+    compile_cloze_text,
+    compile_grading_plan,
+    grade_answers_batch,
     grade_answers,
     load_variants_payload,
     normalize_problem_count,
     normalize_inline_variants,
     parse_solutions_from_text,
+    redact_cloze_text,
+    regrade_submissions,
     renumber_cloze_slots,
+    solution_cache_stats,
+    tokenize_cloze,
+)
+from inginious_cloze_plugin.cloze_problem_backend import (
+    ClozeProblem,
+    _read_task_file,
+    _read_task_file_bytes,
+    build_variant,
+    clear_variants_cache,
+    load_variants,
+    variants_cache_stats,
 )
-from inginious_cloze_plugin.cloze_problem_backend import ClozeProblem, build_variant, load_variants
+from inginious_cloze_plugin.cloze_problem_frontend import (
+    DisplayableClozeProblem,
+    clear_prompt_cache,
+    configure_frontend,
+    prompt_cache_stats,
+)
+from inginious_cloze_plugin.cloze_sanitize import sanitize_moodle_html
+from inginious_cloze_plugin.cloze_workload import (
+    AnswerMix,
+    generate_moodle_xml,
+    generate_submissions,
+    generate_variants,
+)
+from inginious_cloze_plugin.pages import requested_variants_payload, static_asset, variants_payload
+
+
+def _embedded_problem_config(rendered):
+    start = rendered.index("data-cloze-problem=")
+    start = rendered.index(">", start) + 1
+    return json.loads(rendered[start:rendered.index("</script>", start)])
 
 
 class DummyTaskFS:
@@ -26,6 +91,47 @@ class DummyTaskFS:
         return self._files[path]
 
 
+class LocalTaskFS:
+    def __init__(self, prefix):
+        self.prefix = str(prefix)
+        self.reads = 0
+
+    def get(self, path):
+        self.reads += 1
+        with open(os.path.join(self.prefix, path), "rb") as handle:
+            return handle.read()
+
+
+class DummyTasksFS(DummyTaskFS):
+    def from_subfolder(self, name):
+        return self
+
+
+class StandInAgent(object):
+    """Stands in for ``inginious.agent.Agent`` when INGInious is not installed."""
+
+    def __init__(self, context, backend_addr, friendly_name, concurrency, tasks_filesystem, ssh_allowed=False):
+        self._context = context
+        self._backend_addr = backend_addr
+        self._friendly_name = friendly_name
+        self._concurrency = concurrency
+        self._fs = tasks_filesystem
+
+
+# Mixed in after ClozeAgent so that its super().__init__() lands here instead of on object.
+AGENT_BASES = (ClozeAgent, StandInAgent) if cloze_agent.Agent is object else (ClozeAgent,)
+
+
+class RecordingClozeAgent(*AGENT_BASES):
+    def __init__(self, tasks_fs, grading_workers=0):
+        super().__init__(None, "inproc://test", "test", 1, tasks_fs, grading_workers=grading_workers)
+        self.results = []
+
+    async def send_job_result(self, job_id, result, text="", grade=None, problems=None, tests=None,
+                              custom=None, state="", archive=None, stdout=None, stderr=None):
+        self.results.append((job_id, result, text, grade, problems, state))
+
+
 class DummyPluginManager:
     def __init__(self):
         self.env_types = []
@@ -129,6 +235,59 @@ def test_load_variants_reads_json_file():
     assert [variant["name"] for variant in variants] == ["A", "B"]
 
 
+def test_load_variants_caches_file_until_it_changes(tmp_path):
+    clear_variants_cache()
+    variants_path = tmp_path / "variants.json"
+    variants_path.write_text('[{"name": "A", "text": "a={1:SHORTANSWER:=a}"}]', encoding="utf-8")
+    task_fs = LocalTaskFS(tmp_path)
+
+    first = load_variants({"variants_file": "variants.json"}, task_fs)
+    second = load_variants({"variants_file": "variants.json"}, task_fs)
+
+    assert first == second
+    assert task_fs.reads == 1
+
+    variants_path.write_text('[{"name": "B", "text": "bb={1:SHORTANSWER:=b}"}]', encoding="utf-8")
+    os.utime(variants_path, ns=(1, 1))
+
+    assert [variant["name"] for variant in load_variants({"variants_file": "variants.json"}, task_fs)] == ["B"]
+    assert task_fs.reads == 2
+    assert (variants_cache_stats()["hits"], variants_cache_stats()["misses"]) == (1, 2)
+
+
+def test_load_variants_without_stat_reuses_parsed_content():
+    clear_variants_cache()
+    task_fs = DummyTaskFS({"variants.json": '[{"text": "a={1:SHORTANSWER:=a}"}]'})
+
+    load_variants({"variants_file": "variants.json"}, task_fs)
+    load_variants({"variants_file": "variants.json"}, task_fs)
+
+    stats = variants_cache_stats()
+    assert stats["hits"] == 1
+    assert stats["size"] == 1
+    assert stats["weight"] == len('[{"text": "a={1:SHORTANSWER:=a}"}]')
+
+
+def test_read_task_file_remembers_working_reader_per_filesystem_type():
+    class ReadFileOnlyTaskFS:
+        def __init__(self):
+            self.get_calls = 0
+
+        def get(self, path):
+            self.get_calls += 1
+            raise OSError("not supported")
+
+        def read_file(self, path):
+            return "payload:" + path
+
+    task_fs = ReadFileOnlyTaskFS()
+
+    assert _read_task_file(task_fs, "a.json") == "payload:a.json"
+    assert _read_task_file_bytes(task_fs, "b.json") == b"payload:b.json"
+    assert _read_task_file_bytes(ReadFileOnlyTaskFS(), "c.json") == b"payload:c.json"
+    assert task_fs.get_calls == 1
+
+
 def test_build_variant_uses_submitted_variant_index():
     task_fs = DummyTaskFS({
         "variants.json": """
@@ -243,6 +402,214 @@ def test_build_variant_record_renumbers_duplicate_slots_before_grading():
     assert set(variant["solutions"].keys()) == {"1", "2", "3"}
 
 
+def test_compile_cloze_text_reuses_cached_solutions():
+    clear_solution_cache()
+    variants = [{"text": "{1:SHORTANSWER:=a} {1:NUMERICAL:=2}"}]
+
+    first = build_variant_record(variants)
+    second = build_variant_record(variants)
+
+    assert first["solutions"] is second["solutions"]
+    assert second["slots"] == ["1", "2"]
+    assert solution_cache_stats()["misses"] == 1
+    assert solution_cache_stats()["hits"] == 1
+    assert compile_cloze_text("{1:SHORTANSWER:=a} {1:NUMERICAL:=2}")["text"] == first["text"]
+
+
+def test_tokenize_cloze_splits_literals_and_blanks_with_offsets():
+    text = "<p>A={3:SHORTANSWER:=a\\}b}</p>{1:NUMERICAL:=2}"
+
+    tokens = tokenize_cloze(text)
+
+    assert [(token.slot, token.kind) for token in tokens] == [
+        (None, None),
+        ("3", "SHORTANSWER"),
+        (None, None),
+        ("1", "NUMERICAL"),
+    ]
+    assert all(text[token.start:token.end] == token.text for token in tokens)
+    assert tokens[1].rhs == "=a\\}b"
+
+
+def test_build_variant_record_tokens_match_renumbered_text():
+    variant = build_variant_record([{"text": "x {4:SHORTANSWER:=a} y {4:SHORTANSWER:=b}"}])
+
+    assert "".join(token.text for token in variant["tokens"]) == variant["text"]
+    assert [token.slot for token in variant["tokens"] if token.is_blank] == ["1", "2"]
+    assert all(variant["text"][token.start:token.end] == token.text for token in variant["tokens"])
+
+
+def test_render_prompt_with_inputs_replaces_each_blank():
+    problem = DisplayableClozeProblem("p1", {"text": "a {1:SHORTANSWER:=x} b {2:NUMERICAL:=1} c"}, None, None)
+
+    rendered = problem._render_prompt_with_inputs("a {1:SHORTANSWER:=x} b {2:NUMERICAL:=1} c", "u")
+
+    assert rendered.startswith("a <span")
+    assert rendered.endswith("</span> c")
+    assert 'id="u_slot_1"' in rendered
+    assert 'type="number" class="form-control cloze-input" data-slot="2"' in rendered
+    assert "SHORTANSWER" not in rendered
+
+
+def test_redact_cloze_text_drops_answer_keys_but_keeps_choices():
+    redacted = redact_cloze_text(
+        "a {1:SHORTANSWER:=Paris#ok} b {2:NUMERICAL:=4:0.5} c {3:MULTICHOICE:%0%no#bad~=yes}"
+    )
+
+    assert redacted == "a {1:SHORTANSWER:} b {2:NUMERICAL:} c {3:MULTICHOICE:no~yes}"
+
+
+def _browser_multichoice_labels(rhs):
+    script = os.path.join("src", "inginious_cloze_plugin", "static", "cloze_problem.js")
+    runner = (
+        "global.window = {}; global.document = {querySelectorAll: function () { return []; }};"
+        "require(process.argv[1]);"
+        "console.log(JSON.stringify(window.__clozeParseChoices(process.argv[2])));"
+    )
+    output = subprocess.run(["node", "-e", runner, os.path.abspath(script), rhs],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def test_lazy_multichoice_choices_grade_like_eager_ones():
+    if shutil.which("node") is None:
+        pytest.skip("node is not installed")
+    text = r"pick {1:MULTICHOICE:%0%a\:b#no~=x=1#yes~%50%50\%~y\~z}"
+    solutions = parse_solutions_from_text(text)
+
+    for served_text in (text, redact_cloze_text(text)):
+        rhs = [token for token in tokenize_cloze(served_text) if token.is_blank][0].rhs
+        labels = _browser_multichoice_labels(rhs)
+
+        assert labels == ["a:b", "x=1", "50%", "y~z"]
+        assert grade_answers(solutions, {"1": labels[1]})["score"] == 1.0
+        assert grade_answers(solutions, {"1": labels[2]})["score"] == 0.5
+
+
+def test_variants_payload_returns_only_requested_redacted_variants():
+    task_fs = DummyTaskFS({"variants.json": '[{"text": "{1:SHORTANSWER:=red}"}, {"text": "{1:SHORTANSWER:=blue}"}]'})
+
+    payload = variants_payload({"variants_file": "variants.json"}, task_fs, [1, 7])
+
+    assert payload == {"count": 2, "variants": {"1": {"id": "1", "name": None, "text": "{1:SHORTANSWER:}"}}}
+
+
+class FakeCourseTask:
+    def __init__(self, is_open=True):
+        self.is_open = is_open
+
+    def get_accessible_time(self):
+        return SimpleNamespace(is_open=lambda: self.is_open)
+
+
+class FakeTaskUserManager:
+    def __init__(self, visible=True, staff=False):
+        self.visible = visible
+        self.staff = staff
+
+    def course_is_open_to_user(self, course):
+        return True
+
+    def task_is_visible_by_user(self, task):
+        return self.visible
+
+    def has_staff_rights_on_course(self, course):
+        return self.staff
+
+
+def _variants_course_factory(task):
+    tasks_fs = DummyTasksFS({
+        "task.yaml": "problems:\n  p1:\n    type: cloze\n    variants_file: variants.json\n    random_problem_count: 2\n",
+        "variants.json": json.dumps([{"text": "{1:SHORTANSWER:=v%d}" % index} for index in range(4)]),
+    })
+    tasks = {"exam": task}
+    course = SimpleNamespace(get_task=lambda taskid: tasks[taskid])
+    return SimpleNamespace(get_course=lambda courseid: course, get_fs=lambda: tasks_fs)
+
+
+def test_requested_variants_payload_hides_hidden_and_closed_tasks():
+    open_factory = _variants_course_factory(FakeCourseTask(is_open=True))
+    closed_factory = _variants_course_factory(FakeCourseTask(is_open=False))
+
+    with pytest.raises(LookupError):
+        requested_variants_payload(open_factory, FakeTaskUserManager(visible=False), "c", "exam", "p1", "0")
+    with pytest.raises(LookupError):
+        requested_variants_payload(closed_factory, FakeTaskUserManager(), "c", "exam", "p1", "0")
+    with pytest.raises(LookupError):
+        requested_variants_payload(open_factory, FakeTaskUserManager(), "c", "missing", "p1", "0")
+
+    staff_payload = requested_variants_payload(closed_factory, FakeTaskUserManager(staff=True), "c", "exam", "p1", "1")
+    assert list(staff_payload["variants"]) == ["1"]
+
+
+def test_requested_variants_payload_requires_and_caps_indices():
+    factory = _variants_course_factory(FakeCourseTask())
+
+    for raw_indices in (None, "", "x"):
+        with pytest.raises(ValueError):
+            requested_variants_payload(factory, FakeTaskUserManager(), "c", "exam", "p1", raw_indices)
+
+    payload = requested_variants_payload(factory, FakeTaskUserManager(), "c", "exam", "p1", "3,3,0,1,2")
+    assert payload["count"] == 4
+    assert sorted(payload["variants"]) == ["0", "3"]
+
+
+def test_show_input_embeds_only_selected_variant_in_lazy_mode(tmp_path):
+    task_dir = tmp_path / "course" / "task"
+    task_dir.mkdir(parents=True)
+    (task_dir / "variants.json").write_text(
+        '[{"text": "{1:SHORTANSWER:=secret}"}, {"text": "{1:SHORTANSWER:=covert}"}]', encoding="utf-8"
+    )
+    problem = DisplayableClozeProblem("p1", {"variants_file": "variants.json"}, None, LocalTaskFS(task_dir))
+
+    configure_frontend(lazy_variants=True)
+    try:
+        rendered = problem.show_input(None, "en", None)
+    finally:
+        configure_frontend(lazy_variants=False)
+
+    assert "secret" not in rendered and "covert" not in rendered
+    config = _embedded_problem_config(rendered)
+    assert config["variantCount"] == 2
+    assert config["variantsUrl"] == "/plugins/cloze/variants/course/task/p1"
+
+
+def test_render_prompt_with_inputs_reuses_cached_markup_per_text():
+    clear_prompt_cache()
+    problem = DisplayableClozeProblem("p1", {}, None, None)
+    text = "a {1:SHORTANSWER:=x} b"
+
+    first = problem._render_prompt_with_inputs(text, "u1")
+    second = problem._render_prompt_with_inputs(text, "u2")
+
+    assert first.replace('id="u1_slot_1"', 'id="u2_slot_1"') == second
+    assert prompt_cache_stats()["hits"] == 1
+
+
+def test_show_input_references_fingerprinted_bundles_and_inline_config():
+    problem = DisplayableClozeProblem("p1", {"text": "x={1:SHORTANSWER:=a</script>}"}, None, None)
+
+    rendered = problem.show_input(None, "en", None)
+
+    assert "</script>}" not in rendered
+    assert _embedded_problem_config(rendered)["pid"] == "p1"
+    bundle = static_asset("cloze_problem.js")
+    assert '<script src="/plugins/cloze/static/{}"></script>'.format(bundle.fingerprinted_name) in rendered
+    assert bundle.fingerprinted_name.startswith("cloze_problem.") and bundle.etag.strip('"') in bundle.fingerprinted_name
+    assert gzip.decompress(bundle.gzipped) == bundle.body
+
+
+def test_lru_cache_evicts_least_recently_used_entry():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert "b" not in cache
+    assert cache.stats() == {"size": 2, "maxsize": 2, "hits": 1, "misses": 0, "evictions": 1}
+
+
 def test_parse_simple_task_yaml_keeps_multiple_cloze_problems():
     parsed = _parse_simple_task_yaml(
         """
@@ -394,6 +761,99 @@ def test_grade_answers_returns_feedback_for_partial_numerical_match():
     }
 
 
+def test_grading_plan_picks_best_overlapping_numerical_interval():
+    solutions = parse_solutions_from_text(
+        "{1:NUMERICAL:%50%10:5#Near~=10:0.5#Exact~%25%30:1#Far} {2:SHORTANSWER:%50%Lyon#Close~=Paris#Yes}"
+    )
+    plan = compile_grading_plan(solutions)
+
+    def graded(first, second):
+        return grade_answers(solutions, {"1": first, "2": second}, plan=plan)
+
+    assert graded("10.2", "PARIS")["score"] == 1.0
+    assert graded("13", "lyon")["feedback"] == {"1": "Near", "2": "Close"}
+    assert graded("29.5", "nope")["score"] == 0.125
+    assert graded("20", "")["score"] == 0.0
+    assert graded("not a number", "Paris")["feedback"] == {"2": "Yes"}
+
+
+def test_build_variant_record_exposes_cached_grading_plan():
+    variants = [{"text": "{1:SHORTANSWER:=a}"}]
+
+    assert build_variant_record(variants)["grading_plan"] is build_variant_record(variants)["grading_plan"]
+
+
+def test_grade_answers_details_reports_each_slot():
+    solutions = parse_solutions_from_text("{1:SHORTANSWER:=a} {2:SHORTANSWER:%50%b#Half~=c} {3:NUMERICAL:=1}")
+
+    result = grade_answers(solutions, {"1": "A", "2": "b"}, details=True)
+
+    assert [(entry["slot"], entry["score"], entry["feedback"], entry["missing"]) for entry in result["slots"]] == [
+        ("1", 1.0, None, False),
+        ("2", 0.5, "Half", False),
+        ("3", 0.0, None, True),
+    ]
+    assert result["slots"][1]["matched"] == {"weight": 0.5, "answer": "b", "feedback": "Half"}
+
+
+def test_cloze_problem_check_answer_reports_each_blank_from_one_pass():
+    problem = ClozeProblem("p1", {"text": "{1:SHORTANSWER:=a} {2:SHORTANSWER:=b} {3:SHORTANSWER:=c}"}, None, None)
+
+    assert problem.check_answer({"__variant": "0", "1": "a", "2": "x"}, "en")[2] == [
+        "Blank 2: incorrect.",
+        "Blank 3: missing answer.",
+    ]
+
+
+def test_grade_answers_batch_matches_single_grading():
+    solutions = parse_solutions_from_text(
+        "{1:NUMERICAL:=4:0.5~%50%4:2} {2:SHORTANSWER:=Paris~%50%Lyon} {3:MULTICHOICE:a~=b}"
+    )
+    answer_sets = [
+        {"1": "4.2", "2": "paris", "3": "b"},
+        {"1": "5.5", "2": "Lyon", "3": "a"},
+        {"1": "x", "2": "", "3": "b"},
+        {},
+    ]
+
+    batch = grade_answers_batch(solutions, answer_sets)
+
+    for index, answers in enumerate(answer_sets):
+        single = grade_answers(solutions, answers)
+        assert float(batch["scores"][index]) == single["score"]
+        assert int(batch["correct"][index]) == single["correct"]
+    assert [bool(flag) for flag in batch["slot_correct"][1]] == [False, False, False]
+
+
+def test_regrade_submissions_groups_by_variant_selection():
+    variants = [{"text": "red={1:SHORTANSWER:=red}"}, {"text": "blue={1:SHORTANSWER:=blue}"}]
+
+    regraded = regrade_submissions(variants, [
+        {"__variant": "1", "1": "blue"},
+        {"__variant": "0", "1": "blue"},
+        {"__variant": "1", "1": "red"},
+    ])
+
+    assert regraded["selection"] == [1, 0, 1]
+    assert [float(score) for score in regraded["scores"]] == [1.0, 0.0, 0.0]
+    assert regraded["groups"][1]["indices"] == [0, 2]
+
+
+def test_regrade_submissions_numpy_and_python_paths_agree(monkeypatch):
+    pytest.importorskip("numpy")
+    variants = generate_variants(6, 8, seed=3, kind_weights={"NUMERICAL": 2, "SHORTANSWER": 1, "MULTICHOICE": 1})
+    answer_sets = [record["input"] for record in generate_submissions(variants, 200, seed=4, problem_count=2)]
+    answer_sets += [{"__variant": "1", "1": "not a number"}, {}, "garbled"]
+
+    vectorised = regrade_submissions(variants, answer_sets, problem_count=2)
+    monkeypatch.setattr(cloze_core, "np", None)
+    pure = regrade_submissions(variants, answer_sets, problem_count=2)
+
+    assert pure["selection"] == vectorised["selection"]
+    assert pure["scores"] == [float(score) for score in vectorised["scores"]]
+    assert pure["correct"] == [int(value) for value in vectorised["correct"]]
+
+
 def test_parse_submission_payload_reads_hidden_json():
     answers = parse_submission_payload('{"__variant":"1","1":"Paris","2":"4"}')
 
@@ -442,6 +902,225 @@ def test_grade_cloze_problem_returns_partial_credit_and_feedback():
     }
 
 
+def test_cloze_agent_grades_subproblems_on_pool_in_problem_order():
+    tasks_fs = DummyTasksFS({
+        "a.json": '[{"text": "{1:SHORTANSWER:=a} {2:SHORTANSWER:=b}"}]',
+        "b.json": '[{"text": "{1:NUMERICAL:=3}"}]',
+    })
+    msg = SimpleNamespace(
+        job_id="job",
+        course_id="course",
+        task_id="task",
+        task_problems={
+            "p1": {"type": "cloze", "variants_file": "a.json"},
+            "p2": {"type": "cloze", "variants_file": "b.json"},
+        },
+        inputdata={"p1": '{"__variant": "0", "1": "a", "2": "x"}', "p2": '{"1": "3"}'},
+    )
+    inline_agent = RecordingClozeAgent(tasks_fs)
+    pooled_agent = RecordingClozeAgent(tasks_fs, grading_workers=2)
+
+    asyncio.run(inline_agent.new_job(msg))
+    asyncio.run(pooled_agent.new_job(msg))
+
+    assert pooled_agent.results == inline_agent.results
+    pooled_agent.close()
+    assert pooled_agent._grading_executor is None
+    asyncio.run(pooled_agent.new_job(msg))
+    assert pooled_agent.results[1] == inline_agent.results[0]
+    job_id, result, text, grade, problems, state = pooled_agent.results[0]
+    assert (result, text) == ("failed", "You got 2/3 blanks right.")
+    assert list(problems) == ["p1", "p2"]
+    assert abs(grade - 200.0 / 3.0) < 1e-9
+
+
+def test_cloze_agent_advertises_only_capacity_backed_by_grading_workers():
+    assert effective_concurrency(8, 0) == 1
+    assert effective_concurrency(8, 4) == 4
+    assert effective_concurrency(2, 4) == 2
+    assert RecordingClozeAgent(DummyTasksFS({}), grading_workers=3)._concurrency == 1
+
+
+def test_cloze_agent_counts_jobs_by_result():
+    agent = RecordingClozeAgent(DummyTasksFS({}), grading_workers=1)
+    msg = SimpleNamespace(job_id="j", course_id="c", task_id="t", inputdata={"p1": '{"1": "a"}'},
+                          task_problems={"p1": {"type": "cloze", "text": "{1:SHORTANSWER:=a}"}})
+
+    asyncio.run(agent.new_job(msg))
+    asyncio.run(agent.new_job(SimpleNamespace(job_id="k", course_id="c", task_id="t", inputdata={}, task_problems={})))
+
+    assert (agent.job_stats["jobs"], agent.job_stats["success"], agent.job_stats["crashed"]) == (2, 1, 1)
+
+
+def test_cloze_agent_records_job_metrics():
+    agent = RecordingClozeAgent(DummyTasksFS({}), grading_workers=0)
+    msg = SimpleNamespace(job_id="j", course_id="c", task_id="t", inputdata={"p1": '{"1": "b"}'},
+                          task_problems={"p1": {"type": "cloze", "text": "{1:SHORTANSWER:=a}"}})
+    jobs, grades = REGISTRY.get("cloze_agent_jobs_total"), REGISTRY.get("cloze_grade_problem_duration_seconds")
+    failed_before, graded_before = jobs.value(result="failed"), grades.count(status="failed")
+
+    asyncio.run(agent.new_job(msg))
+
+    assert jobs.value(result="failed") == failed_before + 1
+    assert grades.count(status="failed") == graded_before + 1
+    assert REGISTRY.get("cloze_agent_jobs_in_flight").value() == 0
+    assert 'cloze_agent_jobs_total{result="failed"}' in REGISTRY.render()
+
+
+def test_load_variants_metric_covers_inline_problems():
+    loads = REGISTRY.get("cloze_load_variants_duration_seconds")
+    before = loads.count()
+
+    load_variants({"text": "{1:SHORTANSWER:=a}"})
+    load_variants({"variants": [{"text": "{1:SHORTANSWER:=b}"}]})
+
+    assert loads.count() == before + 2
+
+
+def test_metrics_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    registry.counter("jobs_total", "Jobs.", ("result",)).inc(result='a"b')
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    latency.observe(0.05)
+    latency.observe(2.0)
+    registry.gauge("size", "Size.", function=lambda: {(): 3})
+
+    assert registry.render().splitlines() == [
+        "# HELP jobs_total Jobs.",
+        "# TYPE jobs_total counter",
+        'jobs_total{result="a\\"b"} 1',
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 1',
+        'latency_seconds_bucket{le="+Inf"} 2',
+        "latency_seconds_sum 2.05",
+        "latency_seconds_count 2",
+        "# HELP size Size.",
+        "# TYPE size gauge",
+        "size 3",
+    ]
+
+
+def test_start_cloze_agent_honours_inline_grading_workers(monkeypatch):
+    started = []
+
+    async def idle(agent):
+        started.append(agent)
+
+    class EmbeddedClozeAgent(*AGENT_BASES):
+        pass
+
+    monkeypatch.setattr(inginious_cloze_plugin, "ClozeAgent", EmbeddedClozeAgent)
+    monkeypatch.setattr(inginious_cloze_plugin, "_restart_on_cancel", idle)
+    monkeypatch.setattr(inginious_cloze_plugin, "_AGENT_TASKS", [])
+    client = SimpleNamespace(_context=object(), _router_addr="inproc://backend_client")
+    course_factory = SimpleNamespace(get_fs=lambda: DummyTasksFS({}))
+
+    async def start():
+        inginious_cloze_plugin._start_cloze_agent(
+            client, course_factory, {"agent_concurrency": 4, "agent_grading_workers": 0}
+        )
+        await asyncio.gather(*inginious_cloze_plugin._AGENT_TASKS)
+
+    asyncio.run(start())
+
+    assert len(started) == 1
+    assert started[0]._grading_pool() is None
+    assert started[0].grading_capacity == 1
+
+
+def test_aggregate_worker_stats_sums_numeric_counters():
+    assert aggregate_worker_stats({
+        "a": {"jobs": 2, "grading_seconds": 0.5, "name": "a"},
+        "b": {"jobs": 3, "grading_seconds": 1.0},
+    }) == {"jobs": 5, "grading_seconds": 1.5}
+
+
+class FakeWorkerProcess:
+    def __init__(self, index):
+        self.index = index
+        self.pid = 1000 + index
+        self.exitcode = None
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def join(self, timeout=None):
+        pass
+
+    def terminate(self):
+        self.alive = False
+        self.exitcode = -15
+
+    def kill(self):
+        self.alive = False
+        self.exitcode = -9
+
+
+def test_worker_supervisor_restarts_killed_worker_with_backoff():
+    now = [0.0]
+    started = []
+
+    def start_worker(index):
+        started.append(FakeWorkerProcess(index))
+        return started[-1]
+
+    supervisor = WorkerSupervisor(2, start_worker, clock=lambda: now[0])
+    supervisor.start()
+    assert [process.index for process in started] == [0, 1]
+
+    started[1].kill()
+    supervisor.poll()
+    assert supervisor.processes[1] is None and supervisor.alive() == 1
+
+    now[0] = 0.5
+    supervisor.poll()
+    assert len(started) == 2
+    now[0] = 1.0
+    supervisor.poll()
+    assert [process.index for process in started] == [0, 1, 1]
+    assert supervisor.alive() == 2 and supervisor.restarts == 1
+
+    # A worker that crashes again right away waits longer before its next restart.
+    started[2].kill()
+    supervisor.poll()
+    now[0] = 2.5
+    supervisor.poll()
+    assert len(started) == 3
+    now[0] = 3.0
+    supervisor.poll()
+    assert len(started) == 4
+
+    supervisor.stop()
+    assert supervisor.alive() == 0
+
+
+def test_worker_metrics_sums_worker_registries():
+    first, second = MetricsRegistry(), MetricsRegistry()
+    for registry, result in ((first, "success"), (second, "failed")):
+        registry.counter("jobs_total", "Jobs.", ("result",)).inc(result=result)
+        registry.counter("jobs_total", "Jobs.", ("result",)).inc(result="success")
+        registry.histogram("latency_seconds", "Latency.", buckets=(1.0,)).observe(0.5)
+    metrics = WorkerMetrics()
+    metrics.update("a", first.snapshot())
+    metrics.update("b", second.snapshot())
+
+    assert metrics.render().splitlines() == [
+        "# HELP jobs_total Jobs.",
+        "# TYPE jobs_total counter",
+        'jobs_total{result="success"} 3',
+        'jobs_total{result="failed"} 1',
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 2',
+        "latency_seconds_sum 1",
+        "latency_seconds_count 2",
+    ]
+
+
 def test_cloze_problem_check_answer_uses_variant_from_submission():
     task_fs = DummyTaskFS({
         "variants.json": """
@@ -469,9 +1148,311 @@ def test_cloze_problem_check_answer_uses_variant_from_submission():
     )
 
 
+class RecordingCollection:
+    def __init__(self):
+        self.calls = []
+
+    def update_one(self, query, update, upsert=False):
+        self.calls.append((query, update, upsert))
+
+
+def test_user_task_operations_encode_evaluation_mode_in_filters():
+    submission = {"_id": "s1", "username": ["alice", "bob"], "courseid": "c", "taskid": "t", "grade": 50.0,
+                  "result": "failed", "state": "{}"}
+
+    operations = user_task_operations(submission, "best")
+
+    assert len(operations) == 4
+    query, update, upsert = operations[0]
+    assert query == {"username": "alice", "courseid": "c", "taskid": "t"}
+    assert update["$setOnInsert"]["submissionid"] == "s1" and upsert
+    query, update, upsert = operations[1]
+    assert query["$or"] == [{"grade": {"$lte": 50.0}}, {"grade": {"$exists": False}}]
+    assert update["$set"]["grade"] == 50.0 and not upsert
+    assert "$or" not in user_task_operations(submission, "last")[1][0]
+    assert user_task_operations(submission, "student")[1][0]["$or"] == [{"submissionid": None}, {"submissionid": "s1"}]
+    assert len(user_task_operations(submission, None)[1][0]["$or"]) == 4
+
+
+def test_user_task_write_behind_keeps_best_submission_per_user():
+    collection = RecordingCollection()
+    writer = UserTaskWriteBehind(SimpleNamespace(user_tasks=collection), delay=60)
+    base = {"username": ["alice"], "courseid": "c", "taskid": "t", "state": "{}"}
+
+    writer.submit(dict(base, _id="s1", grade=80.0), "best")
+    writer.submit(dict(base, _id="s2", grade=40.0), "best")
+    writer.submit(dict(base, _id="s3", grade=90.0), "best")
+    writer.flush()
+
+    assert writer.coalesced == 2
+    assert [update.get("$set", {}).get("submissionid") for _, update, _ in collection.calls] == [None, "s3"]
+
+
+def test_configure_write_behind_retires_previous_writer():
+    collection = RecordingCollection()
+    first = configure_write_behind(SimpleNamespace(user_tasks=collection), 60)
+    first.submit({"username": ["alice"], "courseid": "c", "taskid": "t", "state": "{}", "_id": "s1"}, "last")
+
+    second = configure_write_behind(SimpleNamespace(user_tasks=collection), 60)
+    try:
+        assert write_behind() is second
+        assert len(collection.calls) == 2
+        first._thread.join(timeout=5)
+        assert not first._thread.is_alive()
+    finally:
+        configure_write_behind(None, None)
+    assert second._closed
+
+
+def test_looks_like_cloze_state_rejects_other_states_without_parsing():
+    assert inginious_cloze_plugin._looks_like_cloze_state('{"p1": {"correct": 1, "total": 2}}')
+    assert not inginious_cloze_plugin._looks_like_cloze_state('{"p1": {"score": 1}}')
+    assert not inginious_cloze_plugin._looks_like_cloze_state("")
+    assert not inginious_cloze_plugin._looks_like_cloze_state(None)
+
+
+def test_ttl_cache_expires_entries():
+    now = [0.0]
+    cache = TTLCache(4, ttl=10, clock=lambda: now[0])
+    cache.put("a", None)
+
+    assert cache.get("a", "missing") is None
+    now[0] = 10.0
+    assert cache.get("a", "missing") == "missing"
+    assert cache.stats()["expirations"] == 1
+
+
+class CountingCourseFactory:
+    def __init__(self):
+        self.lookups = 0
+        self.mode = "best"
+
+    def get_course(self, courseid):
+        self.lookups += 1
+        dispenser = SimpleNamespace(get_evaluation_mode=lambda taskid: self.mode)
+        return SimpleNamespace(get_task_dispenser=lambda: dispenser)
+
+    def update_course_descriptor_content(self, courseid, content):
+        self.mode = content["mode"]
+
+
+def test_evaluation_mode_is_cached_until_course_is_edited():
+    inginious_cloze_plugin.invalidate_evaluation_mode_cache()
+    course_factory = CountingCourseFactory()
+    inginious_cloze_plugin._watch_course_updates(course_factory)
+
+    assert inginious_cloze_plugin._get_evaluation_mode(course_factory, "c", "t") == "best"
+    assert inginious_cloze_plugin._get_evaluation_mode(course_factory, "c", "t") == "best"
+    course_factory.update_course_descriptor_content("c", {"mode": "last"})
+
+    assert inginious_cloze_plugin._get_evaluation_mode(course_factory, "c", "t") == "last"
+    assert course_factory.lookups == 2
+
+
+def test_task_descriptor_is_parsed_once_until_it_changes(tmp_path):
+    descriptor = tmp_path / "task.yaml"
+    descriptor.write_text("name: First\nproblems: {}\n", encoding="utf-8")
+    task_fs = LocalTaskFS(tmp_path)
+
+    first = inginious_cloze_plugin._load_task_descriptor_from_task_fs(task_fs)
+    first["name"] = "mutated by caller"
+    second = inginious_cloze_plugin._load_task_descriptor_from_task_fs(task_fs)
+    descriptor.write_text("name: Second edition\nproblems: {}\n", encoding="utf-8")
+    third = inginious_cloze_plugin._load_task_descriptor_from_task_fs(task_fs)
+
+    assert second["name"] == "First"
+    assert third["name"] == "Second edition"
+    assert task_fs.reads == 2
+
+
+def test_known_path_scan_remembers_course_root(tmp_path, monkeypatch):
+    task_dir = tmp_path / "second" / "course" / "task"
+    task_dir.mkdir(parents=True)
+    (task_dir / "task.yaml").write_text("name: On disk\n", encoding="utf-8")
+    roots = (str(tmp_path / "first"), str(tmp_path / "second"))
+    monkeypatch.setattr(inginious_cloze_plugin, "_KNOWN_TASK_ROOTS", roots)
+    monkeypatch.setattr(inginious_cloze_plugin, "_KNOWN_ROOT_BY_COURSE", {})
+
+    descriptor = inginious_cloze_plugin._load_task_descriptor_from_known_paths("course", "task")
+
+    assert descriptor == {"name": "On disk"}
+    assert inginious_cloze_plugin._KNOWN_ROOT_BY_COURSE == {"course": roots[1]}
+
+
+def test_sanitize_moodle_html_cleans_tags_and_expands_shorthand():
+    text = (
+        '<p><p><span style="x">Value</span> {:SA:=<b>0x1F</b>}<br/></p> </p>'
+        '<style>p { width: 1px; }</style><table width="100%" class="grid"><tr><td align="left">a</td></tr></table>'
+    )
+
+    assert sanitize_moodle_html(text) == (
+        '<p><span style="x">Value {1:SHORTANSWER:=<b>0x1F</b>}<div class="cloze-converted-break"></div></p>'
+        '<table class="grid cloze-converted-table"><tr><td>a</td></tr></table>'
+    )
+
+
+def test_sanitize_moodle_html_only_strips_attributes_inside_tags():
+    text = '<pre>set width="3" here</pre> a < b {:NM:=4:0.5}'
+
+    assert sanitize_moodle_html(text) == (
+        '<pre class="cloze-converted-code">set width="3" here</pre> a < b {1:NUMERICAL:=4:0.5}'
+    )
+
+
+def test_workload_generator_is_seeded_and_answers_follow_the_mix():
+    variants = generate_variants(4, 6, seed=7, table_ratio=0.5, table_rows=4)
+    loaded = load_variants_payload({"variants": variants})
+
+    def scores(mix):
+        results = []
+        for record in generate_submissions(variants, 20, seed=1, mix=mix, problem_count=2):
+            answers = parse_submission_payload(json.dumps(record["input"]))
+            variant = build_variant_record(loaded, submitted_variant=answers["__variant"], problem_count=2)
+            results.append(grade_answers(variant["solutions"], answers, plan=variant["grading_plan"])["score"])
+        return results
+
+    assert generate_variants(4, 6, seed=7, table_ratio=0.5, table_rows=4) == variants
+    assert set(scores(AnswerMix(1, 0, 0))) == {1.0}
+    assert set(scores(AnswerMix(0, 0, 1))) == {0.0}
+    assert all(0.0 < score < 1.0 for score in scores(AnswerMix(0, 1, 0)))
+
+
 def test_init_registers_cloze_environment():
     plugin_manager = DummyPluginManager()
 
     inginious_cloze_plugin.init(plugin_manager, None, None, {})
 
     assert [env.id for env in plugin_manager.env_types] == ["cloze"]
+
+
+@pytest.mark.parametrize("script", ["convert_moodle_cloze_xml.py", "convert_moodle_cache_xml.py"])
+def test_moodle_converter_stream_output_matches_in_memory_output(tmp_path, script):
+    export = tmp_path / "export.xml"
+    export.write_text("\n\n" + generate_moodle_xml(40, seed=5), encoding="utf-8")
+    outputs = {}
+    for mode in ("memory", "stream"):
+        outputs[mode] = tmp_path / "{}.json".format(mode)
+        command = [sys.executable, os.path.join("scripts", script), str(export), "-o", str(outputs[mode]),
+                   "--keep-names"] + (["--stream"] if mode == "stream" else [])
+        subprocess.run(command, check=True, capture_output=True)
+
+    assert outputs["stream"].read_bytes() == outputs["memory"].read_bytes()
+    assert len(json.loads(outputs["memory"].read_text(encoding="utf-8"))["variants"]) > 20
+
+
+def _moodle_question(question_type, name, text):
+    return ('<question type="{}"><name><text>{}</text></name><questiontext format="html">'
+            "<text><![CDATA[{}]]></text></questiontext></question>").format(question_type, name, text)
+
+
+def _moodle_category(path):
+    return '<question type="category"><category><text>{}</text></category></question>'.format(path)
+
+
+def test_batch_expand_inputs_accepts_directories_globs_and_missing_paths(tmp_path):
+    (tmp_path / "bank" / "nested").mkdir(parents=True)
+    for relative in ("bank/a.xml", "bank/nested/b.xml", "bank/notes.txt", "c.xml"):
+        (tmp_path / relative).write_text("<quiz/>", encoding="utf-8")
+
+    inputs = convert_moodle_batch._expand_inputs([
+        str(tmp_path / "bank"), str(tmp_path / "*.xml"), str(tmp_path / "bank" / "a.xml"), str(tmp_path / "gone.xml"),
+    ])
+
+    assert [path.relative_to(tmp_path).as_posix() for path in inputs] == [
+        "bank/a.xml", "bank/nested/b.xml", "c.xml", "gone.xml",
+    ]
+
+
+def test_batch_output_paths_reject_name_collisions(tmp_path):
+    outputs = convert_moodle_batch._output_paths([Path("one/a.xml"), Path("one/b.xml")], tmp_path)
+    assert outputs == {Path("one/a.xml"): tmp_path / "a.json", Path("one/b.xml"): tmp_path / "b.json"}
+
+    with pytest.raises(SystemExit, match="a.json"):
+        convert_moodle_batch._output_paths([Path("one/a.xml"), Path("two/a.xml")], tmp_path)
+
+
+def test_batch_category_slug_keeps_meaningful_path_tail():
+    assert convert_moodle_batch._category_slug("$course$/top/Cache/Direct mapped") == "top_cache_direct_mapped"
+    assert convert_moodle_batch._category_slug("$system$/TLB (2-level)") == "tlb_2_level"
+    assert convert_moodle_batch._category_slug("$course$/") == "uncategorized"
+    assert convert_moodle_batch._category_slug("") == "uncategorized"
+
+
+def _run_batch(*args):
+    return subprocess.run([sys.executable, os.path.join("scripts", "convert_moodle_batch.py"), "-j", "1"] + list(args),
+                          capture_output=True, text=True)
+
+
+def test_batch_per_category_splits_variants_by_category(tmp_path):
+    export = tmp_path / "bank.xml"
+    export.write_text("<quiz>{}</quiz>".format("".join([
+        _moodle_category("$course$/top/Cache"),
+        _moodle_question("cloze", "c1", "<p>a {1:SHORTANSWER:=a}</p>"),
+        _moodle_question("multichoice", "m1", "ignored"),
+        _moodle_question("cloze", "c2", "<p>b {1:SHORTANSWER:=b}</p>"),
+        _moodle_category("$course$/top/TLB"),
+        _moodle_question("cloze", "t1", "<p>c {1:SHORTANSWER:=c}</p>"),
+    ])), encoding="utf-8")
+
+    completed = _run_batch(str(export), "-o", str(tmp_path / "out"), "--per-category", "--keep-names")
+
+    assert completed.returncode == 0, completed.stderr
+    category_dir = tmp_path / "out" / "bank"
+    assert sorted(path.name for path in category_dir.iterdir()) == ["top_cache.json", "top_tlb.json"]
+    cache = json.loads((category_dir / "top_cache.json").read_text(encoding="utf-8"))["variants"]
+    tlb = json.loads((category_dir / "top_tlb.json").read_text(encoding="utf-8"))["variants"]
+    assert [(variant["id"], variant["name"]) for variant in cache] == [("0", "c1"), ("1", "c2")]
+    assert [(variant["id"], variant["name"]) for variant in tlb] == [("0", "t1")]
+
+
+def test_batch_exit_code_reports_failed_files(tmp_path):
+    (tmp_path / "good.xml").write_text(
+        "<quiz>{}</quiz>".format(_moodle_question("cloze", "q", "{1:SHORTANSWER:=a}")), encoding="utf-8"
+    )
+    (tmp_path / "broken.xml").write_text("<quiz><question", encoding="utf-8")
+
+    completed = _run_batch(str(tmp_path / "good.xml"), str(tmp_path / "broken.xml"), "-o", str(tmp_path / "out"))
+
+    assert completed.returncode == 1
+    assert "FAILED" in completed.stderr and "broken.xml" in completed.stderr
+    assert "Converted 1/2 file(s)" in completed.stdout
+    assert (tmp_path / "out" / "good.json").exists()
+    assert not (tmp_path / "out" / "broken.json").exists()
+
+
+def test_cache_converter_output_matches_recursive_renderer_fixture():
+    fixture = (
+        "<p><span>Address <b>0x1F</b></span></p>"
+        "<table><tr><td>TLB</td><td>Page table</td></tr>"
+        "<tr><td><span>VPN 3</span></td><td>PPN=7<br>valid=1</td></tr></table>"
+        '<table border="1"><tr><th>Set</th><th>Line</th></tr>'
+        "<tr><td>Tag 0x2<br>Data = 01 02<br>03 04</td><td>{1:SHORTANSWER:=hit}</td></tr></table>"
+        "<pre>mov r1, r2</pre><ul><li>. first</li></ul><p> </p>"
+    )
+
+    # Rendered by the recursive implementation the iterative walk replaced.
+    assert convert_moodle_cache_xml._cleanup_cache_html(fixture) == (
+        "<p>Address <b>0x1F</b></p>"
+        '<div class="cloze-comparison-sections">'
+        '<section class="cloze-comparison-section"><h4 class="cloze-comparison-heading">TLB</h4>'
+        '<div class="cloze-comparison-body">VPN 3</div></section>'
+        '<section class="cloze-comparison-section"><h4 class="cloze-comparison-heading">Page Table</h4>'
+        '<div class="cloze-comparison-body"><div class="cloze-cache-meta">PPN=7</div>'
+        '<div class="cloze-cache-meta">valid=1</div></div></section></div>'
+        '<table border="1" class="cloze-converted-table"><tr><th>Set</th><th>Line</th></tr>'
+        '<tr><td><div class="cloze-cache-meta">Tag 0x2</div>'
+        '<pre class="cloze-converted-code cloze-cache-bytes">Data = 01 02\n03 04</pre></td>'
+        "<td>{1:SHORTANSWER:=hit}</td></tr></table>"
+        '<pre class="cloze-converted-code">mov r1, r2</pre><ul><li>first</li></ul>'
+    )
+
+
+def test_cache_converter_handles_deeply_nested_html(tmp_path):
+    depth = 3000
+    body = "<div>" * depth + "<span>{1:SHORTANSWER:=x}</span>" + "</div>" * depth
+    export = tmp_path / "deep.xml"
+    export.write_text("<quiz>{}</quiz>".format(_moodle_question("cloze", "deep", body)), encoding="utf-8")
+
+    variants = convert_moodle_cache_xml.convert_moodle_cache_xml(export)["variants"]
+
+    assert variants[0]["text"] == "<div>" * depth + "{1:SHORTANSWER:=x}" + "</div>" * depth